@@ -0,0 +1,104 @@
+"""
+Micro-benchmark for datetime_from_html.parse_date.
+
+Parses generated date strings in the forms found on Dutch news sites: ISO
+8601 from heads and sitemaps, day-month-year and Dutch dates from the text of
+pages. dateutil.parser.parse, which parsed all dates before, is measured next
+to parse_date without (cold) and with (warm) its memo, and the number of
+strings each reads correctly is reported; dateutil does not read Dutch month
+names.
+"""
+__author__ = 'roelvdberg@gmail.com'
+
+from datetime import datetime, timedelta
+
+from benchmark import common
+
+import dateutil.parser
+
+MONTHS = ('jan', 'februari', 'mrt', 'april', 'mei', 'jun', 'juli', 'aug',
+          'sept', 'oktober', 'nov', 'december')
+DAYS = ('maandag', 'dinsdag', 'woensdag', 'donderdag', 'vrijdag', 'zaterdag',
+        'zondag')
+
+FORMATS = (
+    ('iso', lambda d: d.strftime('%Y-%m-%dT%H:%M:%S+01:00')),
+    ('numeric', lambda d: d.strftime('%d-%m-%Y %H:%M')),
+    ('dutch', lambda d: '{} {} {} {}, {:%H:%M} uur'.format(
+        DAYS[d.weekday()], d.day, MONTHS[d.month - 1], d.year, d)),
+)
+
+
+def generated_dates(n):
+    """
+    Returns the datetimes of n articles, one every 17 minutes.
+    """
+    start = datetime(2016, 1, 1)
+    return [start + timedelta(minutes=17 * i) for i in range(n)]
+
+
+def old_parse(string):
+    """
+    How dates were parsed before parse_date.
+    """
+    try:
+        return dateutil.parser.parse(string, dayfirst=string[4] != '-')
+    except (ValueError, OverflowError):
+        return None
+
+
+class Benchmark(common.Benchmark):
+    """
+    Benchmarks of parsing the strings of dates.
+    """
+
+    def __init__(self, dates, repeat):
+        super().__init__(repeat)
+        self.dates = dates
+
+    def measure(self, name, function, strings, before=None):
+        def parse():
+            for string in strings:
+                function(string)
+
+        best, _ = self.best(parse, before)
+        self.report(name, dates=len(strings), best_ms=best * 1e3,
+                    dates_per_s=len(strings) / best)
+        return best
+
+    def correct(self, function, strings):
+        """
+        Number of strings that function reads as their datetime.
+        """
+        return sum(1 for string, date in zip(strings, self.dates)
+                   if function(string) is not None and
+                   function(string).replace(tzinfo=None) == date)
+
+    def run(self):
+        from datetime_from_html import parse_date
+        for name, format_ in FORMATS:
+            strings = [format_(date) for date in self.dates]
+            before = self.measure(name + ' dateutil', old_parse, strings)
+            cold = self.measure(name + ' cold', parse_date, strings,
+                                parse_date.cache_clear)
+            warm = self.measure(name + ' warm', parse_date, strings)
+            self.report(name + ' speedup', cold=before / cold,
+                        warm=before / warm)
+            self.report(name + ' correct',
+                        dateutil=self.correct(old_parse, strings),
+                        parse_date=self.correct(parse_date, strings))
+
+
+def main(arguments=None):
+    parser = common.parser(__doc__, repeat=5)
+    parser.add_argument('--dates', type=int, default=2000,
+                        help='generated dates per format')
+    args = parser.parse_args(arguments)
+    common.header(dates=args.dates)
+    benchmark = Benchmark(generated_dates(args.dates), args.repeat)
+    benchmark.run()
+    common.write_json(args.json, benchmark)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,180 @@
+"""
+Micro-benchmarks for filequeue.FileQueue.
+
+Throughput and latency of put and get of single urls and of batches, pickled
+and not, the time to reopen a persistent queue of --reopen-items items, and
+the throughput of producer and consumer threads sharing a queue.
+"""
+__author__ = 'roelvdberg@gmail.com'
+
+import os
+import threading
+import time
+
+from benchmark import common
+
+from filequeue import Empty, FileQueue
+
+
+def open_files():
+    """
+    Number of open file descriptors of this process, -1 when unknown.
+    """
+    try:
+        return len(os.listdir('/proc/self/fd'))
+    except FileNotFoundError:
+        return -1
+
+
+def item(i, pickled):
+    url = 'http://www.nu.nl/binnenland/{}/artikel.html'.format(i)
+    return (url, i % 3) if pickled else url
+
+
+def percentiles(latencies):
+    latencies = sorted(latencies)
+    return {
+        'p50_us': latencies[len(latencies) // 2] * 1e6,
+        'p99_us': latencies[int(len(latencies) * 0.99)] * 1e6
+    }
+
+
+class Benchmark(common.Benchmark):
+    """
+    Benchmarks of queues in directory.
+    """
+    width = 34
+
+    def __init__(self, directory):
+        super().__init__()
+        self.directory = directory
+
+    def queue(self, name, **kwargs):
+        return FileQueue(directory=self.directory, name=name, overwrite=True,
+                         **kwargs)
+
+    def single(self, n, pickled):
+        """
+        Throughput and latency of put and get of single items.
+        """
+        q = self.queue('single', pickled=pickled)
+        kind = 'pickled' if pickled else 'unpickled'
+        for operation in ('put', 'get'):
+            latencies = []
+            start = time.perf_counter()
+            for i in range(n):
+                t = time.perf_counter()
+                if operation == 'put':
+                    q.put(item(i, pickled))
+                else:
+                    q.get()
+                latencies.append(time.perf_counter() - t)
+            elapsed = time.perf_counter() - start
+            self.report('{} {}'.format(operation, kind),
+                        ops_per_s=n / elapsed, fds=open_files(),
+                        **percentiles(latencies))
+        q.remove()
+
+    def batch(self, n, pickled, size=100):
+        """
+        Throughput of put_many and get_many with batches of size items.
+        """
+        q = self.queue('batch', pickled=pickled)
+        kind = 'pickled' if pickled else 'unpickled'
+        start = time.perf_counter()
+        for i in range(0, n, size):
+            q.put_many(item(j, pickled) for j in range(i, min(i + size, n)))
+        elapsed = time.perf_counter() - start
+        self.report('put_many({}) {}'.format(size, kind),
+                    items_per_s=n / elapsed)
+        start = time.perf_counter()
+        try:
+            while True:
+                q.get_many(size)
+        except Empty:
+            pass
+        elapsed = time.perf_counter() - start
+        self.report('get_many({}) {}'.format(size, kind),
+                    items_per_s=n / elapsed)
+        q.remove()
+
+    def reopen(self, n):
+        """
+        Time to reopen a persistent queue of n items, half of them read.
+        """
+        q = self.queue('reopen', pickled=False, persistent=True)
+        for i in range(0, n, 1000):
+            q.put_many(item(j, False) for j in range(i, min(i + 1000, n)))
+        for _ in range(0, n // 2, 1000):
+            q.get_many(1000)
+        q.remove()
+        del q
+        start = time.perf_counter()
+        q = self.queue('reopen', pickled=False, persistent=True)
+        elapsed = time.perf_counter() - start
+        qsize = q.qsize()
+        start = time.perf_counter()
+        q.get()
+        first_get = time.perf_counter() - start
+        self.report('reopen persistent', items=n, qsize=qsize,
+                    reopen_ms=elapsed * 1e3, first_get_ms=first_get * 1e3)
+        q.remove()
+
+    def concurrent(self, n, producers, consumers):
+        """
+        Throughput of producer and consumer threads sharing one queue.
+        """
+        q = self.queue('concurrent', pickled=False)
+        per_producer = n // producers
+        consumed = []
+
+        def produce(p):
+            for i in range(per_producer):
+                q.put(item(p * per_producer + i, False))
+
+        def consume():
+            count = 0
+            try:
+                while True:
+                    count += len(q.get_many(10, block=True, timeout=0.5))
+            except Empty:
+                consumed.append(count)
+
+        threads = [threading.Thread(target=produce, args=(p,))
+                   for p in range(producers)]
+        threads += [threading.Thread(target=consume)
+                    for _ in range(consumers)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # consumers stop after waiting 0.5 s on an empty queue
+        elapsed = time.perf_counter() - start - 0.5
+        self.report('concurrent {}p/{}c'.format(producers, consumers),
+                    items_per_s=sum(consumed) / elapsed,
+                    consumed=sum(consumed), fds=open_files())
+        q.remove()
+
+
+def main(arguments=None):
+    parser = common.parser(__doc__)
+    parser.add_argument('--items', type=int, default=100000,
+                        help='items per throughput benchmark')
+    parser.add_argument('--reopen-items', type=int, default=1000000,
+                        help='items in the queue that is reopened')
+    args = parser.parse_args(arguments)
+    common.header(items=args.items)
+    with common.working_directory('bench_filequeue_') as directory:
+        benchmark = Benchmark(directory)
+        for pickled in (False, True):
+            benchmark.single(args.items, pickled)
+            benchmark.batch(args.items, pickled)
+        benchmark.reopen(args.reopen_items)
+        benchmark.concurrent(args.items, 1, 1)
+        benchmark.concurrent(args.items, 4, 4)
+    common.write_json(args.json, benchmark)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""
+Micro-benchmark for webpage.Links.
+
+Saves generated news-like pages (see bench_parse) to disk, as the crawler
+does, and extracts their links as the crawler did before: parsing the saved
+file again and deduplicating links with a new bloom filter per page, next to
+reading them from the element tree of the page that was already parsed (see
+WebpageRaw.base_tree).
+"""
+__author__ = 'roelvdberg@gmail.com'
+
+import os
+
+from benchmark import common
+from benchmark.bench_parse import generated_page
+
+from lxml import etree
+import pybloom.pybloom
+
+
+def links_before(filename):
+    """
+    Links of a saved page as Links.file_iter read them before.
+    """
+    import webpage
+    visited = pybloom.pybloom.BloomFilter(capacity=2000, error_rate=0.001)
+    links = []
+    for elem in webpage.file_iter(filename, {'a'}):
+        link = elem.attrib.get('href')
+        if link and link not in visited:
+            links.append(link)
+        visited.add(link)
+    return links
+
+
+class Benchmark(common.Benchmark):
+    """
+    Benchmarks of extracting the links of saved pages.
+    """
+
+    def __init__(self, filenames, repeat):
+        super().__init__(repeat)
+        self.filenames = filenames
+
+    def measure(self, name, function, items):
+        best, links = self.best(
+            lambda: sum(len(function(item)) for item in items))
+        self.report(name, pages=len(items), links=links, best_ms=best * 1e3,
+                    pages_per_s=len(items) / best)
+        return best
+
+    def run(self):
+        import webpage
+        # the tree the page object parsed for its own content
+        trees = []
+        for filename in self.filenames:
+            with open(filename, 'rb') as f:
+                trees.append(etree.HTML(f.read()))
+
+        def links_shared(tree):
+            return [item['links'] for item in webpage.Links(
+                url='http://www.nu.nl/', base='http://www.nu.nl', tree=tree,
+                download=False, save_file=True, filename='unused',
+                persistent=True)]
+
+        before = self.measure('file and bloom filter', links_before,
+                              self.filenames)
+        after = self.measure('shared tree', links_shared, trees)
+        self.report('speedup', factor=before / after)
+
+
+def main(arguments=None):
+    parser = common.parser(__doc__, repeat=5)
+    parser.add_argument('--generated', type=int, default=200,
+                        help='generated pages')
+    args = parser.parse_args(arguments)
+    with common.working_directory('bench_links_') as directory:
+        filenames = []
+        for i in range(args.generated):
+            filenames.append(os.path.join(directory,
+                                          'page_{}.html'.format(i)))
+            with open(filenames[-1], 'wb') as f:
+                f.write(generated_page(i))
+        common.header(pages=len(filenames))
+        benchmark = Benchmark(filenames, args.repeat)
+        benchmark.run()
+    common.write_json(args.json, benchmark)
+
+
+if __name__ == '__main__':
+    main()
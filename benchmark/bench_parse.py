@@ -0,0 +1,199 @@
+"""
+Micro-benchmark for Webpage.parse.
+
+Parses saved news pages (all .html files in --pages) or, without --pages,
+generated news-like pages, and extracts the tags of HeadingText from them.
+The walk over the tree that Webpage.parse made for every tag before is
+measured next to the single walk of Webpage._walk on its own and next to the
+current Webpage.parse, without and with a learned template of the host (see
+crawler/template.py) and for the same pages with JSON-LD article data (see
+crawler/structured_data.py), and the number of paragraphs and headings found
+is reported: the current parse keeps only the main content of a page (see
+crawler/content.py).
+"""
+__author__ = 'roelvdberg@gmail.com'
+
+import json
+import os
+import time
+
+from benchmark import common
+
+from lxml import etree
+
+PARAGRAPH = ('<p>Het kabinet wil de <a href="/politiek/{0}">regels</a> voor '
+             '<b>huurwoningen</b> aanpassen, meldt de minister in een brief '
+             'aan de Tweede Kamer. <i>Artikel {1}, paragraaf {0}.</i></p>\n')
+
+
+def generated_page(i, paragraphs=40, structured=False):
+    """
+    Returns a news-like page: navigation, an article with headings and
+    paragraphs, related links and scripts, and when structured is True
+    JSON-LD NewsArticle data with the article body.
+    """
+    navigation = ''.join('<li><a href="/sectie/{0}">Sectie {0}</a></li>'
+                         .format(j) for j in range(60))
+    article = ''.join(
+        ('<h2>Tussenkop {}</h2>\n'.format(j) if j % 8 == 0 else '') +
+        PARAGRAPH.format(j, i) for j in range(paragraphs))
+    data = ''
+    if structured:
+        body = '\n'.join(etree.HTML(PARAGRAPH.format(j, i)).xpath('string()')
+                         for j in range(paragraphs))
+        data = '<script type="application/ld+json">{}</script>'.format(
+            json.dumps({'@context': 'http://schema.org',
+                        '@type': 'NewsArticle',
+                        'headline': 'Artikel {}'.format(i),
+                        'datePublished': '2016-03-03T14:05:00+01:00',
+                        'articleBody': body}))
+    related = ''.join('<li><a href="/artikel/{0}"><h3>Gerelateerd {0}</h3>'
+                      '</a></li>'.format(j) for j in range(20))
+    return (
+        '<!DOCTYPE html><html><head><title>Artikel {0}</title>'
+        '<meta property="og:title" content="Artikel {0}">'
+        '<script>var page = {{"id": {0}}};</script>{4}</head><body>'
+        '<div id="cookie-consent"><p>Wij gebruiken cookies.</p></div>'
+        '<header><ul class="nav">{1}</ul></header>'
+        '<div class="article"><h1>Artikel {0}</h1>{2}</div>'
+        '<aside><h4>Meer nieuws</h4><ul>{3}</ul></aside>'
+        '<footer><p>Copyright</p><script src="/app.js"></script></footer>'
+        '</body></html>'
+    ).format(i, navigation, article, related, data).encode('utf-8')
+
+
+def load_pages(directory):
+    pages = []
+    for name in sorted(os.listdir(directory)):
+        if name.endswith(('.html', '.htm')):
+            with open(os.path.join(directory, name), 'rb') as f:
+                pages.append(f.read())
+    return pages
+
+
+def stringify(string):
+    return str(string) if string else ""
+
+
+def per_tag_walk(tree, tags):
+    """
+    Tag loop of Webpage.parse before it walked the tree once: a walk over the
+    whole tree for every tag, with text gathered recursively.
+    """
+    def textwalk(element):
+        children = [textwalk(x) + stringify(x.tail) for x in element]
+        return stringify(element.text) + "".join(children)
+
+    return [[textwalk(y) for y in tree.iter() if y.tag == t] for t in tags]
+
+
+class Benchmark(common.Benchmark):
+    """
+    Benchmarks of parsing pages.
+    """
+
+    def __init__(self, pages, repeat, structured_pages=None):
+        super().__init__(repeat)
+        self.pages = pages
+        self.structured_pages = structured_pages
+
+    def measure(self, name, function, trees):
+        def parse():
+            for tree in trees:
+                function(tree)
+
+        best, _ = self.best(parse)
+        self.report(name, pages=len(trees), best_ms=best * 1e3,
+                    pages_per_s=len(trees) / best)
+        return best
+
+    def run(self):
+        import template
+        import webpage
+        start = time.perf_counter()
+        trees = [etree.HTML(page) for page in self.pages]
+        self.report('lxml parse', pages=len(trees),
+                    best_ms=(time.perf_counter() - start) * 1e3)
+        page = webpage.HeadingText(url='http://www.nu.nl/artikel',
+                                   base='http://www.nu.nl',
+                                   html=self.pages[0])
+
+        def single_walk(tree):
+            page._base_tree = tree
+            page.parse()
+            for _ in page.records():
+                pass
+
+        def walk(tree):
+            page.trees = [tree]
+            page._walk()
+
+        before = self.measure('per tag walk',
+                              lambda tree: per_tag_walk(tree, page.tag), trees)
+        # the walk on its own, over the whole tree
+        page.skip = ()
+        page.texts = {}
+        walk_only = self.measure('walk', walk, trees)
+        self.report('speedup', factor=before / walk_only)
+        # a template store that never learns, and one that learns the
+        # template of the host from the first page
+        webpage.templates = template.TemplateStore(
+            persistent=False, learn_pages=float('inf'))
+        after = self.measure('single walk', single_walk, trees)
+        self.report('speedup', factor=before / after)
+        self.report('stored text', **self.stored(trees, page))
+        webpage.templates = template.TemplateStore(persistent=False,
+                                                   learn_pages=1)
+        single_walk(trees[0])
+        with_template = self.measure('with template', single_walk, trees)
+        self.report('speedup', factor=before / with_template)
+        if self.structured_pages:
+            trees = [etree.HTML(page) for page in self.structured_pages]
+            structured = self.measure('json-ld', single_walk, trees)
+            self.report('speedup', factor=before / structured)
+
+    def stored(self, trees, page):
+        """
+        Number and characters of the non-empty paragraphs and headings found
+        in all pages, by the per tag walk and by Webpage.parse.
+        """
+        values = dict(all=0, all_kb=0, main=0, main_kb=0)
+        for i, tree in enumerate(trees):
+            # every page another url, as pages of one host are learned from
+            page.url = 'http://www.nu.nl/artikel/{}'.format(i)
+            page._base_tree = tree
+            page.parse()
+            for key, texts in (
+                    ('all', sum(per_tag_walk(tree, page.tag), [])),
+                    ('main', [text for _, _, text in page.records()])):
+                texts = [text.strip() for text in texts if text.strip()]
+                values[key] += len(texts)
+                values[key + '_kb'] += sum(len(text) for text in texts)
+        values['all_kb'] //= 1024
+        values['main_kb'] //= 1024
+        return values
+
+
+def main(arguments=None):
+    parser = common.parser(__doc__, repeat=5)
+    parser.add_argument('--pages', help='directory with saved .html pages')
+    parser.add_argument('--generated', type=int, default=200,
+                        help='generated pages when --pages is not given')
+    args = parser.parse_args(arguments)
+    structured_pages = None
+    if args.pages:
+        pages = load_pages(args.pages)
+    else:
+        pages = [generated_page(i) for i in range(args.generated)]
+        structured_pages = [generated_page(i, structured=True)
+                            for i in range(args.generated)]
+    kb = sum(len(page) for page in pages) // len(pages) // 1024
+    with common.working_directory('bench_parse_'):
+        common.header(pages=len(pages), **{'kb/page': kb})
+        benchmark = Benchmark(pages, args.repeat, structured_pages)
+        benchmark.run()
+    common.write_json(args.json, benchmark)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""
+Benchmark for parsing XML sitemaps.
+
+Writes a urlset of --urls urls (plain, gzipped and as Google News sitemap) to
+a temporary directory and reads it as the crawler does for a sitemap from
+robots.txt: as XmlSitemapIndex, without downloading.
+"""
+__author__ = 'roelvdberg@gmail.com'
+
+import gzip
+import os
+import time
+
+from benchmark import common
+
+URLSET = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+          '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9" '
+          'xmlns:news="http://www.google.com/schemas/sitemap-news/0.9">\n')
+URL = ('  <url>\n'
+       '    <loc>http://www.nu.nl/binnenland/{0}/artikel.html</loc>\n'
+       '    <lastmod>2015-07-25T18:10:32+00:00</lastmod>\n'
+       '    <changefreq>daily</changefreq>\n'
+       '  </url>\n')
+NEWS_URL = ('  <url>\n'
+            '    <loc>http://www.nu.nl/binnenland/{0}/artikel.html</loc>\n'
+            '    <news:news>\n'
+            '      <news:publication><news:name>NU.nl</news:name>'
+            '<news:language>nl</news:language></news:publication>\n'
+            '      <news:publication_date>2015-07-25T18:10:32+02:00'
+            '</news:publication_date>\n'
+            '      <news:title>Artikel {0}</news:title>\n'
+            '    </news:news>\n'
+            '  </url>\n')
+
+
+def write_sitemap(filename, urls, template, compress=False):
+    content = URLSET + ''.join(template.format(i) for i in range(urls)) + \
+        '</urlset>\n'
+    content = content.encode('utf-8')
+    if compress:
+        content = gzip.compress(content)
+    with open(filename, 'wb') as f:
+        f.write(content)
+    return len(content)
+
+
+class Benchmark(common.Benchmark):
+    """
+    Benchmarks of sitemaps written to directory.
+    """
+    width = 26
+
+    def __init__(self, directory, repeat):
+        super().__init__(repeat)
+        self.directory = directory
+        self.run = 0
+
+    def parse(self, name, urls, template=URL, compress=False):
+        """
+        Time to read all entries of a sitemap of urls urls.
+        """
+        import sitemap
+        filename = os.path.join(self.directory, name + '.data')
+        timings = []
+        for _ in range(self.repeat):
+            # sitemaps remove their file when they are garbage collected
+            size = write_sitemap(filename, urls, template, compress)
+            # a new url each run, so that no entries are filtered as unchanged
+            self.run += 1
+            url = 'http://www.nu.nl/{}/{}.xml'.format(name, self.run)
+            start = time.perf_counter()
+            parsed = sitemap.XmlSitemapIndex(
+                url=url, base='http://www.nu.nl', filename=filename,
+                download=False)
+            entries = sum(1 for _ in parsed)
+            timings.append(time.perf_counter() - start)
+            del parsed
+        best = min(timings)
+        self.report(name, urls=urls, entries=entries, file_kb=size // 1024,
+                    best_ms=best * 1e3, urls_per_s=urls / best)
+
+
+def main(arguments=None):
+    parser = common.parser(__doc__, repeat=3)
+    parser.add_argument('--urls', type=int, default=50000,
+                        help='urls in the sitemap')
+    args = parser.parse_args(arguments)
+    with common.working_directory('bench_sitemap_') as directory:
+        common.header(urls=args.urls)
+        benchmark = Benchmark(directory, args.repeat)
+        benchmark.parse('urlset', args.urls)
+        benchmark.parse('urlset gzipped', args.urls, compress=True)
+        benchmark.parse('news urlset', args.urls, template=NEWS_URL)
+    common.write_json(args.json, benchmark)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+"""
+Micro-benchmark for HeadingText.store.
+
+Parses and stores generated live blogs of a growing number of updates (a
+heading and a paragraph each) in a database in a temporary directory. The
+store of before, which kept a list per tag on the page and created the
+database objects of all paragraphs before committing them at once, is
+measured next to the current store, which streams the records of the page
+(see Webpage.records) to the database in batches of STORE_BATCH_SIZE. The
+peak of memory allocated by Python while parsing and storing a page is
+reported (the element tree itself is allocated by libxml2, outside of it),
+with the time taken and the rows stored: the current store also stores the
+headings of the paragraphs.
+"""
+__author__ = 'roelvdberg@gmail.com'
+
+import os
+import time
+import tracemalloc
+
+from benchmark import common
+
+BASE = 'http://www.nu.nl'
+
+UPDATE = ('<div class="update"><h2>{0:02d}:{1:02d} uur</h2>'
+          '<p>Update {2}: het kabinet heeft opnieuw vergaderd over de regels '
+          'voor huurwoningen, meldt onze verslaggever in Den Haag.</p></div>')
+
+
+def live_blog(updates):
+    """
+    Returns a live blog page with the given number of updates.
+    """
+    return (
+        '<html><head><title>Liveblog</title></head><body>'
+        '<ul class="nav"><li><a href="/">Home</a></li></ul>'
+        '<div class="article"><h1>Liveblog kabinet</h1>{}</div>'
+        '<footer><p>Copyright</p></footer></body></html>'
+    ).format(''.join(UPDATE.format(i // 60 % 24, i % 60, i)
+                     for i in range(updates))).encode('utf-8')
+
+
+def store_before(page, model):
+    """
+    HeadingText.store before the records were streamed: the paragraphs of
+    the lists on the page are all added to the webpage entry and committed
+    at once.
+    """
+    page.store_page()
+    with page.database_lock:
+        webpage = page.last_webpage_entry
+        for tag in page.paragraph_tags:
+            for item in getattr(page, tag):
+                item = item.strip(' \t\n\r')
+                if item:
+                    webpage.paragraphs.append(
+                        model.Paragraph(paragraph=item))
+        page.store_model(item=webpage)
+
+
+class Benchmark(common.Benchmark):
+    """
+    Benchmarks of storing live blogs of each number of updates.
+    """
+
+    def __init__(self, updates):
+        super().__init__()
+        self.updates = updates
+
+    def measure(self, name, klass, store, html):
+        import model
+        # the page is saved to disk, as by the crawler
+        filename = os.path.abspath('page.html')
+        with open(filename, 'wb') as f:
+            f.write(html)
+        # timed once without tracing, which slows down allocations
+        for traced in (False, True):
+            if traced:
+                tracemalloc.start()
+            start = time.perf_counter()
+            page = klass(url=BASE + '/liveblog', base=BASE, download=False,
+                         save_file=True, filename=filename, persistent=True)
+            page.parse()
+            store(page)
+            if traced:
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+            else:
+                seconds = time.perf_counter() - start
+            del page
+            session = model.Session()
+            rows = (session.query(model.Paragraph).count() +
+                    session.query(model.Heading).count())
+            session.query(model.Paragraph).delete()
+            session.query(model.Heading).delete()
+            session.commit()
+            session.close()
+        self.report(name, rows=rows, ms=seconds * 1e3,
+                    peak_python_kb=peak // 1024)
+
+    def run(self):
+        import content
+        import model
+        import template
+        import webpage
+
+        class ListsHeadingText(webpage.HeadingText):
+            stream = False
+
+        model.create_all()
+        session = model.Session()
+        session.add(model.Website(url=BASE))
+        session.commit()
+        session.close()
+        for updates in self.updates:
+            html = live_blog(updates)
+            for name, klass, store in (
+                    ('lists', ListsHeadingText,
+                     lambda page: store_before(page, model)),
+                    ('stream', webpage.HeadingText,
+                     lambda page: page.store())):
+                # every page starts without what was learned of the host
+                content.fingerprints = content.Fingerprints()
+                webpage.templates = template.TemplateStore(persistent=False)
+                self.measure('{} {}'.format(name, updates), klass, store,
+                             html)
+
+
+def main(arguments=None):
+    parser = common.parser(__doc__)
+    parser.add_argument('--updates', type=int, nargs='+',
+                        default=[1000, 4000, 16000],
+                        help='updates of the generated live blogs')
+    args = parser.parse_args(arguments)
+    with common.working_directory('bench_store_'):
+        common.header()
+        benchmark = Benchmark(args.updates)
+        benchmark.run()
+    common.write_json(args.json, benchmark)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""
+Micro-benchmark for validate.url_explicit.
+
+Filters generated links as found on Dutch news pages and in sitemaps:
+articles and sections of the site, links to other news sites, social media
+and files. The checks url_explicit made before, the Django url regex plus a
+scan of NOFOLLOW and of the last characters of the url, are measured next to
+the current url_explicit (see validate.UrlFilter) and UrlFilter.filter_many,
+and the number of links each follows is reported.
+"""
+__author__ = 'roelvdberg@gmail.com'
+
+import re
+
+from benchmark import common
+
+LINKS = (
+    'http://www.nu.nl/politiek/{0}/kabinet-wil-regels-aanpassen.html',
+    'http://www.nu.nl/economie/{0}',
+    'https://nos.nl/artikel/{0}-huren-stijgen-minder-hard',
+    'http://www.nu.nl/zoeken?q=kabinet&page={0}',
+    'https://www.facebook.com/sharer.php?u=http://www.nu.nl/{0}',
+    'https://twitter.com/intent/tweet?url=http://www.nu.nl/{0}',
+    'http://media.nu.nl/m/{0}/foto.jpg',
+    'http://www.rijksoverheid.nl/documenten/{0}/rapport.pdf',
+    'http://www.bbc.com',
+    'https://www.youtube.com/watch?v={0}',
+)
+
+# the regex taken from Django that url_explicit used before
+URL_REGEX = re.compile(
+    r'^(?:http|ftp)s?://'  # http:// or https://
+    r'(?:(?:[A-Z0-9](?:[A-Z0-9-]{0,61}[A-Z0-9])?\.)+'  # domain...
+    r'(?:[A-Z]{2,6}\.?|[A-Z0-9-]{2,}\.?)|'
+    r'localhost|'  # localhost...
+    r'\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})'  # ...or ip
+    r'(?::\d+)?'  # optional port
+    r'(?:/?|[/?]\S+)$', re.IGNORECASE)
+
+
+def url_explicit_before(url_, nofollow):
+    """
+    url_explicit and url before the UrlFilter.
+    """
+    if not URL_REGEX.search(url_):
+        return False
+    url_extensions = ["htm", "com", "org", "edu", "gov"]
+    url_ = url_.strip(r'/')
+    try:
+        docxtest = not (url_[-1] == 'x' and url_[-5] == ".")
+    except IndexError:
+        docxtest = True
+    try:
+        match = (url_[-3] in url_extensions or not url_[-4] == ".") \
+                and docxtest \
+                and not any(nofollowtxt in url_ for nofollowtxt in nofollow)
+    except IndexError:
+        return True
+    return match
+
+
+class Benchmark(common.Benchmark):
+    """
+    Benchmarks of filtering urls.
+    """
+
+    def __init__(self, urls, repeat):
+        super().__init__(repeat)
+        self.urls = urls
+
+    def measure(self, name, function):
+        best, followed = self.best(lambda: function(self.urls))
+        self.report(name, urls=len(self.urls), followed=len(followed),
+                    best_ms=best * 1e3, urls_per_s=len(self.urls) / best)
+        return best
+
+    def run(self):
+        import settings
+        import validate
+        before = self.measure('before', lambda urls: [
+            url_ for url_ in urls
+            if url_explicit_before(url_, settings.NOFOLLOW)])
+        after = self.measure('url_explicit', lambda urls: [
+            url_ for url_ in urls if validate.url_explicit(url_)])
+        self.report('speedup', factor=before / after)
+        many = self.measure('filter_many', validate.url_filter.filter_many)
+        self.report('speedup', factor=before / many)
+
+
+def main(arguments=None):
+    parser = common.parser(__doc__, repeat=5)
+    parser.add_argument('--urls', type=int, default=100000,
+                        help='generated links')
+    args = parser.parse_args(arguments)
+    urls = [LINKS[i % len(LINKS)].format(i) for i in range(args.urls)]
+    common.header(urls=len(urls))
+    benchmark = Benchmark(urls, args.repeat)
+    benchmark.run()
+    common.write_json(args.json, benchmark)
+
+
+if __name__ == '__main__':
+    main()
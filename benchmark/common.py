@@ -0,0 +1,154 @@
+"""
+Shared parts of the benchmarks.
+
+Every benchmark runs offline, prints the commit it runs on and one line per
+measurement, so that the output of two commits can be compared, and with
+--json FILE also writes its results to FILE. Run them from the repository
+root, e.g.:
+
+    python -m benchmark.bench_filequeue --json before.json
+
+Importing this module puts crawler/ on the path, as the crawler modules
+import each other by their plain names.
+"""
+__author__ = 'roelvdberg@gmail.com'
+
+import argparse
+from contextlib import contextmanager
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'crawler'))
+
+
+def peak_rss():
+    """
+    Peak resident set size of this process in MB.
+    """
+    if resource is None:
+        return float('nan')
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kB on Linux and in bytes on macOS
+    return rss / (1 << 20) if sys.platform == 'darwin' else rss / 1024
+
+
+def commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+class Benchmark(object):
+    """
+    Collects and prints benchmark results.
+    """
+    # width of the names of the measurements in the output
+    width = 22
+
+    def __init__(self, repeat=1):
+        """
+        :param repeat: runs per measurement, the best one is reported.
+        """
+        self.repeat = repeat
+        self.results = []
+
+    def report(self, name, **values):
+        values['peak_rss_mb'] = peak_rss()
+        self.results.append(dict(name=name, **values))
+        print('{:<{}} '.format(name, self.width) + '  '.join(
+            '{}={:.1f}'.format(key, value) if isinstance(value, float) else
+            '{}={}'.format(key, value) for key, value in sorted(values.items())
+        ))
+
+    def best(self, function, before=None):
+        """
+        Runs function self.repeat times.
+
+        :param function: function without arguments that is timed.
+        :param before: (optional) function that is called before each run,
+            outside of the time taken.
+        :return: shortest time taken in seconds and the result of the last
+            run.
+        """
+        best = float('inf')
+        result = None
+        for _ in range(self.repeat):
+            if before is not None:
+                before()
+            start = time.perf_counter()
+            result = function()
+            best = min(best, time.perf_counter() - start)
+        return best, result
+
+
+def parser(doc, repeat=None):
+    """
+    Returns the argument parser of a benchmark, with --json and, when repeat
+    is given, --repeat.
+
+    :param doc: docstring of the benchmark; its first line describes it.
+    :param repeat: default number of runs per measurement.
+    """
+    parser = argparse.ArgumentParser(description=doc.split('\n\n')[0])
+    if repeat is not None:
+        parser.add_argument(
+            '--repeat', type=int, default=repeat,
+            help='runs per measurement, the best one is reported')
+    # absolute, as benchmarks may run in a temporary directory
+    parser.add_argument('--json', type=os.path.abspath,
+                        help='also write results to this file')
+    return parser
+
+
+def header(**values):
+    """
+    Prints the commit, the python version and values, e.g. the size of the
+    workload.
+    """
+    print('  '.join(['commit {}'.format(commit()),
+                     'python {}'.format(sys.version.split()[0])] +
+                    ['{} {}'.format(key, value)
+                     for key, value in values.items()]))
+
+
+@contextmanager
+def working_directory(prefix):
+    """
+    Runs in a new temporary directory, which is removed afterwards: the
+    crawler creates its log and database in the working directory.
+
+    :param prefix: prefix of the name of the directory.
+    :return: path of the directory.
+    """
+    directory = tempfile.mkdtemp(prefix=prefix)
+    cwd = os.getcwd()
+    os.chdir(directory)
+    try:
+        yield directory
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(directory)
+
+
+def write_json(filename, benchmark):
+    """
+    Writes the results of benchmark to filename, when it is given.
+    """
+    if filename:
+        with open(filename, 'w') as f:
+            json.dump({'commit': commit(), 'results': benchmark.results}, f,
+                      indent=2)
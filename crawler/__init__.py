@@ -4,6 +4,7 @@ try:
     import base
     import crawl
     import filequeue
+    import frontier
     import model
     import robot
     import validate
@@ -12,6 +13,7 @@ except ImportError:
     import crawler.crawl as crawl
     import crawler.base as base
     import crawler.filequeue as filequeue
+    import crawler.frontier as frontier
     import crawler.model as model
     import crawler.robot as robot
     import crawler.validate as validate
@@ -12,11 +12,13 @@ __author__ = 'roelvdberg@gmail.com'
 
 try:
     from filequeue import FileQueue
+    from frontier import Frontier
     import model
     from settings import *
     import validate
 except ImportError:
     from crawler.filequeue import FileQueue
+    from crawler.frontier import Frontier
     import crawler.model as model
     from crawler.settings import *
     import crawler.validate as validate
@@ -58,6 +60,7 @@ class BaseUrl(list):
     :param lock: The BaseUrl has a lock that is used during threading. This way
         multiple threads can handle the BaseUrl.
     :param base_queue: a queue with websites that have not yet been crawled.
+    :param frontier: store that holds the link queues of all base urls.
 
     Within a BaseUrl Each base url is stored as a list of parameters:
     [0]: the base url string
@@ -87,6 +90,11 @@ class BaseUrl(list):
         self.session = model.Session()
         self += [{} for _ in range(CRAWL_DEPTH + 1)]
         self.lock = threading.RLock()
+        self.frontier = Frontier(
+            FRONTIER_FILENAME,
+            max_items=QUEUE_MEMORY_ITEMS,
+            max_bytes=QUEUE_MEMORY_BYTES
+        )
         self.base_queue = FileQueue(
             directory="../data",
             name='base_url',
@@ -148,15 +156,23 @@ class BaseUrl(list):
         return url.startswith(base)
 
 
-    def add(self, url, current_depth, crawl_url=True):
+    def add(self, url, current_depth, crawl_url=True, batch=None, hints=None):
         """
         Adds a url to self.
 
         :param url: regular url to be added.
         :param current_depth: depth at which the url has been harvested.
+        :param crawl_url: when False the url is only added to the history.
+        :param batch: (optional) dictionary of {link_queue: [url, ...]}. When
+            given the url is collected in batch instead of being put into its
+            link queue, see put_batch.
+        :param hints: (optional) tuple of (publication date, title) known
+            before the url is fetched, e.g. from a news sitemap. The url is
+            then queued as (url, publication date, title).
         """
         with self.lock:
             url = url.strip('/')
+            item = (url,) + tuple(hints) if hints else url
             # iterate over base urls at each depth in self to check if url is
             # in one of the base urls
             for i, base_bundle in enumerate(self):
@@ -166,8 +182,10 @@ class BaseUrl(list):
                         if url not in self.history:
                             # link hasn't been added before, so store it
                             self.add_to_history(url)
-                            if crawl_url:
-                                link_queue.put(url)
+                            if crawl_url and batch is not None:
+                                batch.setdefault(link_queue, []).append(item)
+                            elif crawl_url:
+                                link_queue.put(item)
                         return
             # link has not been matched to any of the base urls, so append it
             # as a base url.
@@ -199,13 +217,7 @@ class BaseUrl(list):
                     queue_name = base.split('//')[1]
                 else:
                     queue_name = base
-                link_queue = FileQueue(
-                    directory="../data",
-                    name=queue_name,
-                    persistent=True,
-                    overwrite=True,
-                    pickled=False
-                )
+                link_queue = self.frontier.queue(queue_name)
                 self.add_to_history(url)
                 link_queue.put(url)
                 # base urls are added to the crawl queue only if set in
@@ -231,7 +243,7 @@ class BaseUrl(list):
         number_of_links = 0
         if not base:
             base = self.base[0]
-        # try:
+        batch = {}
         for url_dict in link_container:
             url = url_dict['links']
             if "#" in url:
@@ -241,11 +253,30 @@ class BaseUrl(list):
             url = urllib.parse.urljoin(base, url)
             if not validate.url_explicit(url):
                 continue
-            self.add(url, depth)
+            hints = None
+            if url_dict.get('publication_date') or url_dict.get('title'):
+                hints = (url_dict.get('publication_date'),
+                         url_dict.get('title'))
+            self.add(url, depth, batch=batch, hints=hints)
             number_of_links += 1
+            if number_of_links % LINK_BATCH_SIZE == 0:
+                self.put_batch(batch)
+        self.put_batch(batch)
         logger.debug('{} links added @base {} .'.format(
             number_of_links, base))
 
+    @staticmethod
+    def put_batch(batch):
+        """
+        Puts the urls collected by add into their link queues and empties
+        the batch.
+
+        :param batch: dictionary of {link_queue: [url, ...]}
+        """
+        for link_queue, urls in batch.items():
+            link_queue.put_many(urls)
+        batch.clear()
+
     def __str__(self):
         return "BaseUrl with at depth 0: " + \
                ", ".join(self.base)
@@ -273,8 +304,5 @@ class BaseUrl(list):
         """
         Indicates whether any of the base urls still has links in their queue.
         """
-        try:
-            return any(any(q.qsize() > 0 for q in l.values()) for l in self)
-        except IndexError:
-            return False
+        return self.frontier.has_content
 
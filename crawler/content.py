@@ -0,0 +1,303 @@
+# -*- coding: utf-8 -*-
+"""
+Tells the main content of a webpage, the text of the article, from
+boilerplate such as navigation, cookie banners, teasers of related articles
+and footers.
+"""
+__author__ = 'roelvdberg@gmail.com'
+
+from collections import OrderedDict
+from functools import lru_cache
+from itertools import islice
+import re
+import threading
+
+from lxml import etree
+
+try:
+    from settings import BOILERPLATE_FINGERPRINTS, BOILERPLATE_MIN_PAGES, \
+        FINGERPRINT_BATCH_SIZE, MAX_LINK_DENSITY, MIN_PARAGRAPH_LENGTH
+except ImportError:
+    from crawler.settings import BOILERPLATE_FINGERPRINTS, \
+        BOILERPLATE_MIN_PAGES, FINGERPRINT_BATCH_SIZE, MAX_LINK_DENSITY, \
+        MIN_PARAGRAPH_LENGTH
+
+# Elements whose content is never part of the article.
+BOILERPLATE_TAGS = ('nav', 'footer', 'aside', 'form', 'noscript', 'button',
+                    'select')
+
+# Class names and ids of elements whose content is never part of the article.
+BOILERPLATE_NAMES = re.compile(
+    r'(?<![a-z])(?:nav(?:igation|bar)?|menu|footer|cookie|consent|banner|'
+    r'breadcrumbs?|share|social|related|teaser|sidebar|comments?|advert\w*|'
+    r'promo|newsletter|popup|modal)(?![a-z])', re.IGNORECASE)
+
+# Class names and ids of the elements of a (part of a) tree that match
+# BOILERPLATE_NAMES. They are tested while the tree is searched, which is
+# cheaper than visiting every element in Python, and only those that match
+# are returned.
+BOILERPLATE_CLASS_AND_ID = etree.XPath(
+    'descendant-or-self::*/@*[name()="class" or name()="id"]'
+    '[re:test(., $names, "i")]',
+    namespaces={'re': 'http://exslt.org/regular-expressions'})
+
+# Elements that wrap the whole page or its main element. Their class names
+# and ids describe the page, e.g. <body class="has-sidebar menu-open">, so
+# they are never boilerplate.
+PAGE_WRAPPERS = etree.XPath(
+    '/html|/html/body|//main/ancestor-or-self::*|'
+    '//*[@role="main"]/ancestor-or-self::*')
+
+
+def element_text(element):
+    """
+    Returns all text of element and its descendants, without its tail.
+
+    Serialised by lxml as text, which is several times faster than joining
+    element.itertext() or walking the children in Python.
+
+    :param element: lxml element.
+    """
+    return etree.tostring(element, method='text', encoding=str,
+                          with_tail=False)
+
+
+@lru_cache()
+def outside(tags):
+    """
+    Returns an XPath that finds the elements with one of tags outside an
+    element: those before, after and around it.
+
+    :param tags: tuple of tags, e.g. ('li', 'p').
+    """
+    tags = ' or '.join('self::' + tag for tag in tags)
+    return etree.XPath('ancestor::*[{0}]|preceding::*[{0}]|'
+                       'following::*[{0}]'.format(tags))
+
+
+class Fingerprints(object):
+    """
+    Texts seen per host, to learn the boilerplate of a site: a text that is
+    found on BOILERPLATE_MIN_PAGES different pages of the same host is
+    boilerplate, e.g. a cookie notice or a newsletter call without
+    recognisable markup.
+
+    For each host at most BOILERPLATE_FINGERPRINTS texts are remembered; the
+    least recently seen ones are forgotten first.
+    """
+
+    def __init__(self, min_pages=BOILERPLATE_MIN_PAGES,
+                 max_fingerprints=BOILERPLATE_FINGERPRINTS):
+        self.min_pages = min_pages
+        self.max_fingerprints = max_fingerprints
+        # {host: OrderedDict({text fingerprint: (page fingerprint, ...)})}
+        self.hosts = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def fingerprint(text):
+        return hash(' '.join(text.split()).lower())
+
+    def boilerplate(self, host, url, texts):
+        """
+        Returns the texts that are known boilerplate for host and learns the
+        texts of this page.
+
+        :param host: base url of the site.
+        :param url: url of the page, so that a page that is crawled again is
+            not counted twice.
+        :param texts: texts found on the page.
+        :return: set of texts that are boilerplate.
+        """
+        page = hash(url)
+        prints = {text: self.fingerprint(text) for text in texts}
+        boilerplate = set()
+        with self.lock:
+            counts = self.hosts.setdefault(host, OrderedDict())
+            for text, fingerprint in prints.items():
+                pages = counts.pop(fingerprint, ())
+                if len(pages) - (page in pages) >= self.min_pages - 1:
+                    boilerplate.add(text)
+                elif page not in pages:
+                    pages += (page,)
+                counts[fingerprint] = pages
+            while len(counts) > self.max_fingerprints:
+                counts.popitem(last=False)
+        return boilerplate
+
+
+# Shared by all pages, so that every page of a host adds to what is learned.
+fingerprints = Fingerprints()
+
+
+class Blocks(object):
+    """
+    Finds the block that holds most paragraph text (see boilerplate).
+
+    Paragraphs are scored in document order, so a block is done once a
+    paragraph outside it is scored. Only the blocks around the last scored
+    paragraph and the best block so far are kept, rather than the score of
+    every block of the page.
+    """
+
+    def __init__(self):
+        # {block: [score, order]} of the blocks around the last scored
+        # paragraph; of blocks with the same score the one that was scored
+        # first wins.
+        self.open = {}
+        self.order = 0
+        self.best = None
+
+    def score(self, paragraph, length):
+        """
+        Scores length for the parent of paragraph and half of that for its
+        grandparent.
+        """
+        parent = paragraph.getparent()
+        if parent is None:
+            return
+        grandparent = parent.getparent()
+        others = [block for block in self.open
+                  if block is not parent and block is not grandparent]
+        if others:
+            ancestors = set(parent.iterancestors())
+            for block in others:
+                if block not in ancestors:
+                    self._done(block, *self.open.pop(block))
+        for block, points in ((parent, length), (grandparent, length / 2)):
+            if block is None:
+                continue
+            entry = self.open.get(block)
+            if entry is None:
+                entry = self.open[block] = [0, self.order]
+                self.order += 1
+            entry[0] += points
+
+    def _done(self, block, score, order):
+        if self.best is None or (score, -order) > self.best[:2]:
+            self.best = (score, -order, block)
+
+    def main(self):
+        """
+        Returns the block with the highest score, or None when no paragraph
+        was scored.
+        """
+        for block, (score, order) in self.open.items():
+            self._done(block, score, order)
+        self.open = {}
+        return self.best and self.best[2]
+
+
+def boilerplate(trees, host, url, tags, paragraph_tags, texts=None,
+                score=True, known=True):
+    """
+    Returns the elements with the given tags that are not part of the main
+    content of a page, and the block that holds the main content.
+
+    Elements are boilerplate when
+    - they are within navigation, footers, forms or elements with class names
+      or ids such as 'menu', 'cookie' or 'related' (BOILERPLATE_TAGS and
+      BOILERPLATE_NAMES), except for the body of the page and the elements
+      that hold its main element (PAGE_WRAPPERS),
+    - they are within a link or are paragraphs that consist for more than
+      MAX_LINK_DENSITY of link text,
+    - they are paragraphs outside the main block, the block that holds most
+      paragraph text, which is scored like readability: each paragraph of at
+      least MIN_PARAGRAPH_LENGTH characters scores its length for its parent
+      and half of that for its grandparent,
+    - their text was found on other pages of the same host (see Fingerprints).
+
+    The texts of the elements are only kept when texts is given or known is
+    True; else only their length is used.
+
+    :param trees: (part of the) element trees of a page.
+    :param host: base url of the site the page belongs to.
+    :param url: url of the page.
+    :param tags: tags of the elements that are sought.
+    :param paragraph_tags: tags in tags that are paragraphs; the others, such
+        as headings, are only removed when they are within boilerplate or
+        links, or are known for host.
+    :param texts: (optional) dictionary that is filled with the text of the
+        elements that are not within boilerplate or links: {element: text}
+    :param score: when False blocks are not scored, e.g. when trees are known
+        to be the main content (see template.Template).
+    :param known: when False the texts found on other pages of host are not
+        skipped; they are left out while the texts are read instead (see
+        unknown_texts).
+    :return: set of boilerplate elements and the main block or None when
+        there is none.
+    """
+    tags = [tag for tag in tags if tag]
+    if not tags:
+        return set(), None
+    paragraph_tags = set(paragraph_tags)
+    skip = set()
+    if texts is None and known:
+        texts = {}
+    blocks = Blocks()
+    for tree in trees:
+        containers = list(tree.iter(*BOILERPLATE_TAGS))
+        wrappers = set(PAGE_WRAPPERS(tree))
+        for value in BOILERPLATE_CLASS_AND_ID(
+                tree, names=BOILERPLATE_NAMES.pattern):
+            container = value.getparent()
+            if container not in wrappers:
+                containers.append(container)
+        for container in containers:
+            skip.update(container.iter(*tags))
+        for element in tree.iter(*tags):
+            if element in skip:
+                continue
+            if any(True for _ in element.iterancestors('a')):
+                skip.add(element)
+                continue
+            if element.tag not in paragraph_tags and texts is None:
+                continue
+            text = element_text(element)
+            if texts is not None:
+                texts[element] = text
+            if element.tag not in paragraph_tags:
+                continue
+            length = len(text.strip())
+            if not length:
+                continue
+            link_text = sum(len(element_text(a).strip())
+                            for a in element.iter('a'))
+            if link_text > MAX_LINK_DENSITY * length:
+                skip.add(element)
+            elif score and length >= MIN_PARAGRAPH_LENGTH:
+                blocks.score(element, length)
+    main = blocks.main()
+    if main is not None:
+        skip.update(outside(tuple(sorted(paragraph_tags)))(main))
+    if known:
+        stripped = {element: text.strip() for element, text in texts.items()
+                    if element not in skip}
+        known_texts = fingerprints.boilerplate(
+            host, url, [text for text in stripped.values() if text])
+        skip.update(element for element, text in stripped.items()
+                    if text in known_texts)
+    return skip, main
+
+
+def unknown_texts(items, host, url, batch_size=FINGERPRINT_BATCH_SIZE):
+    """
+    Leaves the texts that were found on other pages of host (see
+    Fingerprints) out of items. The texts are looked up batch_size at a time,
+    so that the texts of a page are never kept all at once.
+
+    :param items: iterable of (kind, text) of a page, e.g. ('p', 'Tekst.').
+    :param host: base url of the site the page belongs to.
+    :param url: url of the page.
+    :param batch_size: number of texts looked up at once.
+    """
+    items = iter(items)
+    while True:
+        batch = list(islice(items, batch_size))
+        if not batch:
+            return
+        known = fingerprints.boilerplate(
+            host, url, [text.strip() for _, text in batch if text.strip()])
+        for kind, text in batch:
+            if text.strip() not in known:
+                yield kind, text
@@ -1,7 +1,9 @@
 # -*- coding: utf-8 -*-
 __author__ = 'roelvdberg@gmail.com'
 
+from collections import deque
 from datetime import datetime as dt
+import itertools
 import logging
 import threading
 import time
@@ -14,6 +16,7 @@ try:
     import model
     import robot
     from settings import *
+    import sitemap as sitemap_
     import validate
     import webpage
     from webpage import remove_file
@@ -23,6 +26,7 @@ except ImportError:
     import crawler.model as model
     import crawler.robot as robot
     from crawler.settings import *
+    import crawler.sitemap as sitemap_
     import crawler.validate as validate
     import crawler.webpage as webpage
     from crawler.webpage import remove_file
@@ -62,13 +66,17 @@ class Website(object):
     """
 
     def __init__(self, base, link_queue, page=webpage.WebpageRaw,
-                 base_url=None, depth=0, database_lock=None):
+                 base_url=None, depth=0, database_lock=None, crawl_done=None):
         """
         :param base: base url string .
         :param link_queue: queue from base url.
         :param page: WebPage class or one of its children.
         :param base_url: BaseUrl object that at least contains this website.
         :param depth: crawl depth of this website.
+        :param crawl_done: (optional) threading.Event that is set when the
+            crawl is done. Until then the website keeps polling its news
+            sitemaps and feeds, also when it has no links left. Without it
+            the website is done when it has no links left.
         """
         self.encoding = ENCODINGS[:]
         if not database_lock:
@@ -93,14 +101,119 @@ class Website(object):
             logger.exception("Error: {} @webpage with base {}".format(
                 e, self.base))
         self.links = link_queue
+        self.prefetched = deque()
         self.depth = depth
-        self.base_url.add_links(
-            link_container=self.robot_txt.sitemap,
-            depth=self.depth,
-            base=self.base
-        )
-        logger.debug('SITEMAP READ FOR: ' + self.base)
         self.webpage = page
+        self.feeds = set()
+        self.poll_lock = threading.Lock()
+        self.polling = False
+        self.poll_thread = None
+        self.crawl_done = crawl_done
+        # True while the website has no links left
+        self.idle = False
+        # set when the website is done, so that its sitemaps are no longer
+        # read
+        self.stop = threading.Event()
+        self.sitemap_thread = threading.Thread(target=self._ingest_sitemap,
+                                               daemon=True)
+        self.sitemap_thread.start()
+
+    def _ingest_sitemap(self):
+        """
+        Adds the links from the sitemaps in robots.txt to the link queues in
+        batches of LINK_BATCH_SIZE.
+
+        Runs in its own thread, so that crawling starts as soon as robots.txt
+        is read. Pauses while the link queue of this website holds more than
+        SITEMAP_QUEUE_LIMIT links. Stops when the website is done.
+        """
+        try:
+            self._add_sitemap_links(self.robot_txt.sitemap)
+        except Exception as e:
+            logger.exception("Error: {} @sitemap with base {}".format(
+                e, self.base))
+        logger.debug('SITEMAP READ FOR: ' + self.base)
+        self._start_polling()
+
+    def _add_sitemap_links(self, sitemap):
+        sitemap = iter(sitemap)
+        while not self.stop.is_set():
+            batch = list(itertools.islice(sitemap, LINK_BATCH_SIZE))
+            if not batch:
+                break
+            self.base_url.add_links(
+                link_container=batch,
+                depth=self.depth,
+                base=self.base
+            )
+            while len(self.links) > SITEMAP_QUEUE_LIMIT:
+                if self.stop.wait(1):
+                    return
+
+    def _start_polling(self):
+        """
+        Starts polling the news sitemaps and feeds in a thread of its own,
+        unless they are polled already.
+        """
+        with self.poll_lock:
+            if POLL_INTERVAL and not self.polling and not self.stop.is_set():
+                self.polling = True
+                self.poll_thread = threading.Thread(target=self._poll,
+                                                    daemon=True)
+                self.poll_thread.start()
+
+    def _poll(self):
+        """
+        Reads the news sitemaps and feeds of this website every POLL_INTERVAL
+        seconds, so that new articles are found without crawling the pages
+        that link to them. Only articles that are new since the previous read
+        are added (see sitemap.SitemapState.changed).
+
+        Stops when the website has neither news sitemaps nor feeds, or when
+        the website is done (see run).
+        """
+        while True:
+            with self.poll_lock:
+                urls = sitemap_.sitemap_state.news_sitemaps(self.base)
+                feeds = list(self.feeds)
+                if not POLL_INTERVAL or not (urls or feeds) or \
+                        self.stop.is_set():
+                    self.polling = False
+                    return
+            if self.stop.wait(POLL_INTERVAL):
+                continue
+            logger.debug('NEWS SITEMAPS AND FEEDS POLLED FOR: ' + self.base)
+            if urls:
+                try:
+                    self._add_sitemap_links(
+                        sitemap_.Sitemap(urls=urls, base=self.base))
+                except Exception as e:
+                    logger.exception(
+                        "Error: {} @news sitemap with base {}".format(
+                            e, self.base))
+            for feed in feeds:
+                try:
+                    self._add_sitemap_links(
+                        sitemap_.Feed(url=feed, base=self.base))
+                except urllib.error.HTTPError as e:
+                    logger.debug('WEBSITE: feed {} not read: {}'.format(
+                        feed, e))
+                except Exception as e:
+                    logger.exception("Error: {} @feed {}".format(e, feed))
+
+    def _add_feeds(self, url, page):
+        """
+        Adds the feeds found in the head of page to the feeds that are polled.
+
+        :param url: url of page.
+        :param page: WebpageRaw object.
+        """
+        feeds = getattr(page.head, 'feeds', ())
+        with self.poll_lock:
+            for feed in feeds:
+                self.feeds.add(urllib.parse.urljoin(url, feed))
+        if feeds:
+            self._start_polling()
 
     def _can_fetch(self, url_):
         """
@@ -111,13 +224,26 @@ class Website(object):
         return self.robot_txt.can_fetch(USER_AGENT, url_)
 
     def run(self):
-        """Runs a website crawler."""
+        """
+        Runs a website crawler.
+
+        Runs until the website has no links left, the sitemaps in robots.txt
+        are read and, when polling, the crawl is done.
+        """
+        try:
+            self._run()
+        finally:
+            self.stop.set()
+
+    def _run(self):
         while self.has_content:
             start_time = time.time()
             try:
                 self._run_once()
+                self.idle = False
             except Empty:
-                self.has_content = False
+                self.idle = True
+                self.has_content = self._expects_links()
             except Exception as e:
                 logger.exception("Error: {} @webpage with base {}".format(
                     e, self.base))
@@ -131,11 +257,40 @@ class Website(object):
                     wait_time_left = self.robot_txt.crawl_delay + start_time - \
                              time.time()
 
+    def _expects_links(self):
+        """
+        Whether links may still come from the sitemaps in robots.txt or, until
+        the crawl is done, from polling.
+        """
+        if self.sitemap_thread.is_alive():
+            return True
+        with self.poll_lock:
+            polling = self.polling
+        return polling and self.crawl_done is not None and \
+            not self.crawl_done.is_set()
+
+    def _next_link(self):
+        """
+        Returns the next link from a batch of links taken from the link queue.
+
+        Waits at most HOST_IDLE_TIMEOUT seconds for new links to be added to
+        the link queue. Raises Empty when none are added in that time.
+        """
+        if not self.prefetched:
+            self.prefetched.extend(self.links.get_many(
+                LINK_PREFETCH, block=True, timeout=HOST_IDLE_TIMEOUT))
+        return self.prefetched.popleft()
+
     def _run_once(self):
         """Runs one webpage of a website crawler."""
         logger.debug('WEBSITE: Running webpage: {url}'
                      .format(url=str(self.base)))
-        link = self.links.get()
+        link = self._next_link()
+        hints = {}
+        if isinstance(link, tuple):
+            # (url, publication date, title) from a news sitemap
+            link, published_time, title = link
+            hints = {'published_time': published_time, 'title': title}
         if not self._can_fetch(link):
             logger.debug('WEBSITE: webpage {} cannot be fetched.'
                          .format(link))
@@ -153,11 +308,13 @@ class Website(object):
                     filename=filename,
                     persistent=True
                 )
+                page.hints = hints
+                self._add_feeds(link, page)
                 if page.followable:
                     urlfetcher = webpage.Links(
                         url=link,
                         base=self.base,
-                        html=page.html,
+                        tree=page.base_tree,
                         download=False,
                         save_file=True,
                         filename=page.filename,
@@ -208,31 +365,84 @@ class Crawler(object):
         self.database_lock = threading.RLock()
         self.base_url = base_.BaseUrl(sitelist, self.database_lock)
         self.websites = []
+        self.active = set()
+        # websites of the active website threads
+        self.running = {}
+        # live website threads; notified when one of them stops
+        self.threads = set()
+        self.threads_changed = threading.Condition()
+        # set when the active websites only poll, see end_polling
+        self.done = threading.Event()
         self.webpage = page
 
     def run(self):
         """Run crawler"""
-        number_of_website_threads = 1
-        # Run while there are still active website-threads left.
-        while number_of_website_threads > 0:
-            # Run as much threads as MAX_THREADS (from settings) sets.
-            while 0 < number_of_website_threads <= MAX_THREADS:
+        # Run while there are still active website-threads or websites left.
+        while True:
+            # Run as much website threads as MAX_THREADS (from settings)
+            # sets.
+            with self.threads_changed:
+                full = not self.threads_changed.wait_for(
+                    lambda: len(self.threads) < MAX_THREADS, timeout=1)
+            if full:
+                self.end_polling()
+            else:
                 # start a new website thread:
                 self.run_once()
-                number_of_website_threads = threading.activeCount() - 1
+            with self.threads_changed:
+                if not self.threads and self.base_url.base_queue.empty():
+                    break
         logger.debug("CRAWLER: Finished")
         logger.debug("CRAWLER:\n" + repr(self.base_url))
 
     def run_once(self):
         try:
-            base_url_queue_item = self.base_url.base_queue.get()
+            base_url_queue_item = self.base_url.base_queue.get(
+                block=True, timeout=1)
             thread = threading.Thread(
-                target=self._website_worker,
+                target=self._website_thread,
                 args=(base_url_queue_item,)
             )
+            with self.threads_changed:
+                self.threads.add(thread)
             thread.start()
         except Empty:
-            pass #logger.debug("Queue of base urls is empty.")
+            self.requeue_stranded()
+            self.end_polling()
+
+    def requeue_stranded(self):
+        """
+        Puts base urls back in the base queue when links were added to their
+        link queue after their website thread stopped.
+        """
+        with self.base_url.lock:
+            for depth, layer in enumerate(self.base_url):
+                for base, link_queue in layer.items():
+                    if base not in self.active and not link_queue.empty():
+                        self.active.add(base)
+                        self.base_url.base_queue.put((base, depth))
+
+    def end_polling(self):
+        """
+        Ends the crawl when the websites that are still active have no links
+        left and only poll their news sitemaps and feeds, so that their
+        threads stop.
+        """
+        with self.base_url.lock:
+            running = dict(self.running)
+            if running and set(running) == self.active and \
+                    self.base_url.base_queue.empty() and \
+                    all(website.idle for website in running.values()):
+                logger.debug("CRAWLER: polling ended")
+                self.done.set()
+
+    def _website_thread(self, base_url_queue_item):
+        try:
+            self._website_worker(base_url_queue_item)
+        finally:
+            with self.threads_changed:
+                self.threads.discard(threading.current_thread())
+                self.threads_changed.notify_all()
 
     def _website_worker(self, base_url_queue_item):
         """
@@ -242,16 +452,23 @@ class Crawler(object):
         base, depth = base_url_queue_item
         link_queue = self.base_url[depth][base]
         logger.debug("CRAWLER: run for {} depth: {}".format(base, depth))
-        website = Website(
-            base=base,
-            link_queue=link_queue,
-            page=self.webpage,
-            base_url=self.base_url,
-            depth=depth,
-            database_lock=self.database_lock
-        )
-        website.run()
-        self.websites.append(website)
+        self.active.add(base)
+        try:
+            website = Website(
+                base=base,
+                link_queue=link_queue,
+                page=self.webpage,
+                base_url=self.base_url,
+                depth=depth,
+                database_lock=self.database_lock,
+                crawl_done=self.done
+            )
+            self.running[base] = website
+            website.run()
+            self.websites.append(website)
+        finally:
+            self.running.pop(base, None)
+            self.active.discard(base)
 
 
 if __name__ == "__main__":
@@ -1,14 +1,19 @@
 __author__ = 'roelvdberg@gmail.com'
 
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
 import re
+import threading
 
 import dateutil.parser
 from lxml import etree
 
 try:
     from settings import DATE_TIME_DISTANCE
+    from template import element_xpath
 except ImportError:
     from crawler.settings import DATE_TIME_DISTANCE
+    from crawler.template import element_xpath
 
 MONTHS = {
     'januari': 1,
@@ -36,81 +41,209 @@ MONTHS = {
     'dec': 12
 }
 
+# Month names alternated longest first, so that e.g. 'sept' is not read as
+# 'sep' followed by 't'.
+MONTH_NAMES = '|'.join(sorted(MONTHS, key=len, reverse=True))
+DAY_NAMES = ('maandag|dinsdag|woensdag|donderdag|vrijdag|zaterdag|zondag|'
+             'ma|di|wo|do|vr|za|zo')
+
+# Separator between a date and its time: up to DATE_TIME_DISTANCE characters
+# of punctuation or 'om'.
+SEPARATOR = r'(?:[T\s,.;:|<>_-]{1,%d}|\s+om\s+)' % DATE_TIME_DISTANCE
+TIME = r'(\d{1,2})[:.](\d\d)(?::(\d\d))?(?:\s*uur)?'
+
+# ISO 8601: 2016-03-03, 2016-03-03T14:05, 2016-03-03 14:05:00.123+01:00
+ISO_DATE = re.compile(
+    r'\s*(\d{4})-(\d\d?)-(\d\d?)(?:[T\s](\d\d):(\d\d)(?::(\d\d)'
+    r'(?:[.,](\d{1,6})\d*)?)?\s*(Z|[+-]\d\d(?::?\d\d)?)?)?\s*$')
+# Day first: 03-03-2016, 3/3/2016 om 14.05, 03.03.2016, 14:05:30
+NUMERIC_DATE = re.compile(
+    r'\s*(\d{1,2})([-/.])(\d{1,2})\2(\d{4})(?:%s%s)?\s*$'
+    % (SEPARATOR, TIME))
+# Dutch: 3 mrt 2016 14:05, donderdag 3 maart 2016, 14:05 uur
+TEXTUAL_DATE = re.compile(
+    r'\s*(?:(?:%s)\.?,?\s+)?(\d{1,2})\s+(%s)\.?,?\s+(\d{4})(?:%s%s)?\s*$'
+    % (DAY_NAMES, MONTH_NAMES, SEPARATOR, TIME), re.IGNORECASE)
+
+YEAR_FIRST = re.compile(r'\s*\d{4}')
+
+# A date in a text, in one of the forms above, optionally followed by a time.
+# The lookahead for a digit makes that the lookbehind is only tried where a
+# date can start.
+DATETIME = re.compile(
+    r'(?=\d)(?<![\d.:/-])(?:\d{4}-\d{1,2}-\d{1,2}|'
+    r'\d{1,2}(?P<separator>[-/.])\d{1,2}(?P=separator)\d{4}|'
+    r'\d{1,2}\s+(?:%s)\.?,?\s+\d{4})'
+    r'(?:%s\d{1,2}[:.]\d{2}(?::\d{2})?)?(?!\d)'
+    % (MONTH_NAMES, SEPARATOR), re.IGNORECASE
+)
+
+# Cheap test for text that may hold a date, before DATETIME is tried.
+DATE_LIKE = re.compile(r'\d[-/.]\d|\d\s+(?:%s)' % MONTH_NAMES, re.IGNORECASE)
+
+# Text nodes and <time> elements of a (part of a) tree.
+TEXTS = etree.XPath('descendant-or-self::text()')
+TIMES = etree.XPath('descendant-or-self::time')
+
+# Text of these elements is never shown.
+HIDDEN = ('script', 'style')
+
+
+def _timezone(zone):
+    if zone is None:
+        return None
+    if zone == 'Z':
+        return timezone.utc
+    offset = timedelta(hours=int(zone[1:3]), minutes=int(zone[-2:])
+                       if len(zone) > 3 else 0)
+    return timezone(-offset if zone[0] == '-' else offset)
+
+
+@lru_cache(maxsize=1 << 12)
+def parse_date(string):
+    """
+    Returns the datetime of a date string, or None when it is not a valid
+    date.
+
+    Reads ISO 8601 ('2016-03-03T14:05:00+01:00'), day-month-year with an
+    optional time ('03-03-2016 14:05', '3/3/2016 om 14.05') and Dutch dates
+    ('3 mrt 2016 14:05', 'donderdag 3 maart 2016, 14:05 uur'). Other strings
+    are left to dateutil, day first unless they start with the year. Results
+    are memoised, as the same dates occur on many pages.
+
+    :param string: date(time) string.
+    """
+    zone = None
+    match = ISO_DATE.match(string)
+    if match:
+        year, month, day, hour, minute, second, fraction, zone = \
+            match.groups()
+    else:
+        fraction = None
+        match = NUMERIC_DATE.match(string)
+        if match:
+            day, _, month, year, hour, minute, second = match.groups()
+        else:
+            match = TEXTUAL_DATE.match(string)
+            if not match:
+                try:
+                    return dateutil.parser.parse(
+                        string, dayfirst=not YEAR_FIRST.match(string))
+                except (ValueError, OverflowError):
+                    return None
+            day, month, year, hour, minute, second = match.groups()
+            month = MONTHS[month.lower()]
+    try:
+        return datetime(int(year), int(month), int(day), int(hour or 0),
+                        int(minute or 0), int(second or 0),
+                        int(fraction.ljust(6, '0')) if fraction else 0,
+                        _timezone(zone))
+    except ValueError:
+        return None
+
+
+def find_datetime(string):
+    """
+    Returns the first datetime in string or None.
+    """
+    for match in DATETIME.finditer(string):
+        date = parse_date(match.group(0))
+        if date is not None:
+            return date
+    return None
+
 
 class WebPageDateTime(object):
-    datetime_regex = re.compile(
-        r"\d{1,4}-\d{1,2}-\d{1,4}[T\s,.;:|<>-_]{0,%d}\d{1,2}:\d{1,2}"
-        % DATE_TIME_DISTANCE
-    )
+    """
+    Finds the publication date and time of a webpage in its parsed tree.
+
+    The datetime attribute or text of the first <time> element is used, else
+    the first date in the text of the page. The location where it was found
+    is cached per host as an XPath expression (see date_xpaths), so that for
+    later pages of the host it is looked up directly.
+    """
+    # {host: compiled XPath expression of the date}
+    date_xpaths = {}
+    lock = threading.Lock()
 
     def __init__(self):
         self.method = self.parse
         self.default_args = []
         self.default_kwargs = {}
+        self.time = None
+        self.xpath = None
+
+    def parse(self, html, htmltree=None, host=None):
+        """
+        Finds the date and time in a webpage.
+
+        :param html: html of the webpage, only parsed when htmltree is not
+            given.
+        :param htmltree: lxml element tree of the webpage.
+        :param host: (optional) base url of the site of the webpage, for
+            which the location of the date is cached.
+        :return: datetime or None when no date was found. It is also stored
+            in self.time and its location in self.xpath.
+        """
+        if htmltree is None:
+            htmltree = etree.HTML(html)
+        self.time = None
+        self.xpath = None
+        if host is not None:
+            with self.lock:
+                self.xpath = self.date_xpaths.get(host)
+            if self.xpath is not None:
+                self.time = self.lookup(htmltree, self.xpath)
+                if self.time is not None:
+                    return self.time
+        self.time, expression = self.scan(htmltree)
+        if expression is not None:
+            self.xpath = etree.XPath(expression)
+            if host is not None:
+                with self.lock:
+                    self.date_xpaths[host] = self.xpath
+        elif host is not None:
+            with self.lock:
+                self.date_xpaths.pop(host, None)
+        return self.time
+
+    def lookup(self, htmltree, xpath):
+        """
+        Returns the first datetime at xpath in htmltree, or None.
+        """
+        for value in xpath(htmltree):
+            if isinstance(value, etree._Element):
+                date = find_datetime(etree.tostring(
+                    value, method='text', encoding=str, with_tail=False))
+            else:
+                # an attribute, e.g. the datetime of a <time> element
+                date = parse_date(str(value)) or find_datetime(str(value))
+            if date is not None:
+                return date
+        return None
 
-    def time_tag(self):
-        pass
-
-    def parse(self, html, htmltree):
-        self.html = html
-        self.htmltree = htmltree
-        try:
-            self.time = self.htmltree.xpath(r'.//time')[0]
-        except IndexError:
-            self.parse_time_regex()
-
-    def parse_time_regex(self):
-        datetime = self.datetime_regex.findall(self.html)
-        datetimes = []
-        for dt_ in datetime:
-            try:
-                dt_try = dateutil.parser.parse(dt_, fuzzy=True, dayfirst=True)
-                datetimes.append(dt_try)
-            except ValueError:
-                pass
-        self.find_xpath_for_datetime(datetime)
-        return datetimes
-
-    def in_tag(self, x):
-        return re.compile(
-            r'''<\s*\w+[\w\s="':;]*''' + x +
-            r'''[\w\s="':;]*>.*</\s*\w+\s*>'''
-        )
-
-    def in_between_tag(self, x):
-        return re.compile(
-            r'''<\s*\w+[\w\s="':;]*>.*''' + x +
-            r'''.*</\s*\w+\s*>'''
-        )
-
-    def shorten_xpath(self, xpath):
-        splitted_xpath = xpath.split('/')
-        current = ''
-        while True:
-            current = '/'.join([current, splitted_xpath.pop()]).strip('/')
-            length = len(self.htmltree.findall(current))
-            if length == 1:
-                return current
-            if length == 0:
-                raise IndexError
-
-    def find_xpath_for_datetime(self, datetime):
-        # methods =
-        print(datetime)
-        for dt_ in datetime:
-            element = self.in_tag(dt_).findall(self.html)
-            attribute = None
-
-            if not element:
-                element = self.in_between_tag(dt_).findall(self.html)
-                attribute = True
-            if not element:
-                element = self.datetime_regex.findall(self.html)
-                attribute = False
-            print(dt_, element, attribute)
-            el = etree.HTML(element[0]).getchildren()[
-                0].getchildren()[0]
-            xpath = etree.ElementTree(self.htmltree).getpath(el)
-            shortest_xpath = self.shorten_xpath(xpath)
-            if attribute:
-                pass
+    def scan(self, htmltree):
+        """
+        Returns the first datetime in htmltree and an XPath expression for
+        its location, or (None, None).
+        """
+        for time in TIMES(htmltree):
+            date = parse_date(time.get('datetime', '')) or \
+                find_datetime(time.get('datetime', ''))
+            if date is not None:
+                return date, element_xpath(time) + '/@datetime'
+            date = find_datetime(time.text or '')
+            if date is not None:
+                return date, element_xpath(time)
+        for text in TEXTS(htmltree):
+            if not DATE_LIKE.search(text) or not DATETIME.search(text):
+                continue
+            element = text.getparent()
+            if text.is_tail:
+                element = element.getparent()
+            if element is None or element.tag in HIDDEN:
+                continue
+            date = find_datetime(text)
+            if date is not None:
+                return date, element_xpath(element)
+        return None, None
@@ -1,10 +1,32 @@
+from collections import deque
+import mmap
 import pickle
 import os
+import struct
+import sys
 import threading
+import time
+import uuid
 import weakref
+import zlib
 
 __author__ = 'roelvdberg@gmail.com'
 
+SEGMENT_SIZE = 1 << 20  # bytes written to a segment before a new one starts
+RECORD_FORMAT = 1       # version of the record format stored in the pos file
+POS_SYNC_OPERATIONS = 1000  # puts and gets after which the pos file is written
+POS_SYNC_INTERVAL = 1   # seconds after which the pos file is written
+
+# A record is a 4 byte length followed by a payload of that length. The first
+# byte of a payload gives the type of the item that follows:
+_LENGTH = struct.Struct('<I')
+_INT = struct.Struct('<q')
+_STR = ord('s')         # utf-8 encoded string
+_TUPLE = ord('t')       # records of the tuple items
+_INTEGER = ord('i')     # 8 byte signed integer
+_NONE = ord('n')        # None
+_PICKLE = ord('p')      # pickled Python object
+
 
 def _file_method(method, pickled=False):
     return method + 'b' if pickled else method
@@ -24,39 +46,133 @@ def del_file(filename):
         pass
 
 
-def _remove(put_queue_name, get_queue_name, pos_name):
-    del_file(pos_name)
-    del_file(put_queue_name)
-    del_file(get_queue_name)
+def _remove(fq):
+    fq.close()
+    for segment in range(fq.head, fq.tail + 1):
+        fq.remove_segment(segment)
+    del_file(fq.pos_name)
 
 
-def _remove_persistent(put_queue_name, get_queue_name, pickled, pos_name):
-    try:
-        try:
-            with open(pos_name, 'r') as pn:
-                get_pos = int(pn.read())
-        except FileNotFoundError:
-            get_pos = 0
-        os.remove(pos_name)
-        method = 'ab' if pickled else 'a'
-        with open(put_queue_name, method) as put_queue, \
-                open(get_queue_name, _file_method('r', pickled)) as f:
-            if pickled:
-                for _ in range(get_pos):
-                    pickle.load(f)
-                while True:
-                    try:
-                        pickle.dump(pickle.load(f), put_queue)
-                    except EOFError:
-                        break
-            else:
-                for _ in range(get_pos):
-                    next(f)
-                for line in f:
-                    put_queue.write(line.strip('\n') + '\n')
-        _touch(get_queue_name, pickled=pickled)
-    except (Empty, FileNotFoundError):
-        pass
+def _remove_persistent(fq):
+    """
+    Closes the queue files but keeps them on disk.
+
+    Closing writes the read position and queue length to the pos file, so
+    nothing needs to be rewritten: reopening the queue seeks straight to the
+    stored byte offset.
+    """
+    fq.close()
+
+
+def _flush(hq):
+    """
+    Writes the items that are still in memory to disk for a persistent
+    hybrid queue and closes or removes its disk queue.
+    """
+    with hq.lock:
+        if hq.persistent and hq.memory:
+            hq.spill()
+        if hq.disk is not None:
+            hq.disk.remove()
+
+
+def _item_size(item):
+    if isinstance(item, (str, bytes)):
+        return len(item)
+    return sys.getsizeof(item)
+
+
+def _deadline(block, timeout):
+    if block and timeout is not None:
+        return time.monotonic() + timeout
+    return None
+
+
+def _wait(condition, block, deadline):
+    """
+    Waits until condition is notified or the deadline has passed.
+
+    :param condition: threading.Condition that is held by the caller.
+    :param block: when False returns immediately.
+    :param deadline: time.monotonic() value or None to wait without limit.
+    :return: False when not blocking or when the deadline has passed.
+    """
+    if not block:
+        return False
+    if deadline is None:
+        condition.wait()
+        return True
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        return False
+    condition.wait(remaining)
+    return True
+
+
+def _compact_worker(fq_ref, interval, stop):
+    while not stop.wait(interval):
+        fq = fq_ref()
+        if fq is None:
+            return
+        fq.compact()
+        del fq
+
+
+def encode(item, pickled=True):
+    """
+    Encodes item into a record payload.
+
+    Strings, integers, None and tuples of these are encoded without pickle.
+
+    :param item: item to encode.
+    :param pickled: when True other Python objects are pickled, else they
+        raise a FileQueueError.
+    :return: payload bytes.
+    """
+    if isinstance(item, str):
+        return b's' + item.encode('utf-8')
+    if isinstance(item, tuple):
+        return b't' + b''.join(frame(encode(x, pickled)) for x in item)
+    if item is None:
+        return b'n'
+    if type(item) is int and -1 << 63 <= item < 1 << 63:
+        return b'i' + _INT.pack(item)
+    if pickled:
+        return b'p' + pickle.dumps(item, pickle.HIGHEST_PROTOCOL)
+    raise FileQueueError('Cannot store {} in a queue that is not pickled.'
+                         ''.format(type(item).__name__))
+
+
+def decode(payload):
+    """
+    Decodes a record payload (bytes or memoryview) created by encode.
+    """
+    kind = payload[0]
+    if kind == _STR:
+        return str(payload[1:], 'utf-8')
+    if kind == _TUPLE:
+        items = []
+        pos = 1
+        while pos < len(payload):
+            length, = _LENGTH.unpack_from(payload, pos)
+            pos += _LENGTH.size
+            items.append(decode(payload[pos:pos + length]))
+            pos += length
+        return tuple(items)
+    if kind == _NONE:
+        return None
+    if kind == _INTEGER:
+        return _INT.unpack_from(payload, 1)[0]
+    if kind == _PICKLE:
+        return pickle.loads(payload[1:])
+    raise FileQueueError('Unknown record type {!r}.'.format(chr(kind)))
+
+
+def frame(payload):
+    """
+    Prefixes a payload with its length.
+    """
+    return _LENGTH.pack(len(payload)) + payload
 
 
 class FileQueueError(Exception):
@@ -72,24 +188,33 @@ class FileQueue(object):
     Low memory FIFO* queue that keeps queue on disk instead of in memory.
 
     * FIFO: First In First Out. When a queue is made persistent and reused,
-    this FIFO is broken in a sense that when a queue is deleted (but the
-    files still persist) the items still in the get file are put into the put
-    file and thus these items in front of the queue are put in the back.
+    reading resumes at the byte offset stored in the pos file, so the order
+    of the items is kept.
     """
 
     def __init__(self, directory="", name=None, persistent=False,
-                 overwrite=False, id_=0, pickled=True):
+                 overwrite=False, id_=0, pickled=True,
+                 segment_size=SEGMENT_SIZE, compact_interval=None,
+                 compress=False):
         """
         Low memory FIFO queue that keeps queue on disk.
 
-        Queue is stored in three files:
-        'get_thread_[thread-id or given name]_[id].queue'
-        'put_thread_[thread-id or given name]_[id].queue'
+        Queue is stored as a log of numbered segment files and a pos file:
+        'seg_thread_[thread-id or given name]_[id]_[segment].queue'
         'pos_thread_[thread-id or given name]_[id].queue'
 
-        The former (read) is used for reading the queue and gets filled with the
-        latter (put) when empty. The latter (put) is used to put new items into
-        the queue.
+        New items are appended to the last segment, which is closed once it
+        holds segment_size bytes. Items are read from the first segment
+        through a memory map; fully read segments are deleted, so disk usage
+        follows the actual backlog. The pos file stores the first segment and
+        the byte offset of the read position, the last segment and its size
+        and the queue length, so that a persistent queue can be reopened
+        without reading its items. It is written every POS_SYNC_OPERATIONS
+        puts and gets or POS_SYNC_INTERVAL seconds and when the queue is
+        closed. After a crash the items read since are read again.
+
+        Items are stored as records: a 4 byte length followed by the encoded
+        item (see encode). Records can thus be skipped without decoding them.
 
         :param directory: Directory where the queue files are stored.
         :param name: Base name of the files. Default: Thread id.
@@ -101,22 +226,27 @@ class FileQueue(object):
         :param id_: id of the file, when overwrite is True this is increased
             when file allready exists with that id until an unused id is
             found. Default: 0
-        :param pickled: uses pickle by default to serialize the items. When
-            the items are strings only, pickled can be set to False.
+        :param pickled: strings, integers, None and tuples of these are
+            encoded without pickle. Other items are pickled when pickled is
+            True, else they raise a FileQueueError. Default: True
+        :param segment_size: size in bytes after which a new segment file is
+            started. Default: SEGMENT_SIZE.
+        :param compact_interval: when given, a background thread compacts the
+            segment that is being read every compact_interval seconds (see
+            compact). Default: None (no background compaction).
+        :param compress: when True segments are compressed with zlib once
+            they are full. A compressed segment is decompressed in memory when
+            it is read. Default: False
         """
         self.fq = _PersistentFileQueue(
-                directory, name, persistent, overwrite, id_, pickled
+                directory, name, persistent, overwrite, id_, pickled,
+                segment_size, compact_interval, compress
             )
         if persistent:
             self._finalizer = weakref.finalize(
-                self, _remove_persistent, self.fq.put_queue_name,
-                self.fq.get_queue_name, pickled, self.fq.pos_name
-            )
+                self, _remove_persistent, self.fq)
         else:
-            self._finalizer = weakref.finalize(
-                self, _remove, self.fq.put_queue_name, self.fq.get_queue_name,
-                self.fq.pos_name
-            )
+            self._finalizer = weakref.finalize(self, _remove, self.fq)
 
     def put(self, x):
         """
@@ -126,16 +256,43 @@ class FileQueue(object):
         """
         self.fq.put(x)
 
-    def get(self):
+    def get(self, block=False, timeout=None):
         """
         Remove and return an item from the queue.
 
         Raises Empty when empty.
 
-        :return: item (string or other python object) if one is immediately
-            available, else raise the Empty exception
+        :param block: when True waits until an item is put into the queue.
+            Default: False
+        :param timeout: when blocking, the maximum number of seconds to wait.
+            Default: None (wait until an item is available)
+        :return: item (string or other python object) if one is available,
+            else raise the Empty exception
+        """
+        return self.fq.get_many(1, block, timeout)[0]
+
+    def put_many(self, items):
         """
-        return self.fq.get()
+        Put all items into the queue at once.
+
+        The items are written as one block while the queue is locked once.
+
+        :param items: iterable of strings or other Python objects.
+        """
+        self.fq.put_many(items)
+
+    def get_many(self, n, block=False, timeout=None):
+        """
+        Remove and return up to n items from the queue at once.
+
+        Raises Empty when empty.
+
+        :param n: maximum number of items returned.
+        :param block: see get. Default: False
+        :param timeout: see get. Default: None
+        :return: list with at least one and at most n items.
+        """
+        return self.fq.get_many(n, block, timeout)
 
     def qsize(self):
         """
@@ -160,6 +317,15 @@ class FileQueue(object):
         """
         return self.fq.empty()
 
+    def compact(self):
+        """
+        Rewrites the unread part of the segment that is being read.
+
+        Only a segment that is no longer written to is compacted. This frees
+        the disk space of items that have been read from it.
+        """
+        self.fq.compact()
+
     def remove(self):
         self._finalizer()
 
@@ -173,12 +339,231 @@ class FileQueue(object):
         return repr(self.fq)
 
 
+class HybridQueue(object):
+    """
+    FIFO queue that is kept in memory and only spills to a FileQueue on disk
+    when it grows beyond max_items items or max_bytes bytes.
+
+    Once spilled, all items are on disk: the items in memory are written in
+    front of the new items and every following item is put on disk as well,
+    until the FileQueue is emptied. Its files are then removed and the queue
+    returns to memory. Small queues therefore use no files at all.
+    """
+
+    def __init__(self, directory="", name=None, persistent=False,
+                 overwrite=False, id_=0, pickled=True, max_items=1000,
+                 max_bytes=1 << 18, disk=None):
+        """
+        In memory queue that spills to a FileQueue on disk.
+
+        :param directory: Directory where the queue files are stored.
+        :param name: Base name of the files. Default: a name of its own, so
+            that unnamed queues in a directory do not share files.
+        :param persistent: When True items are written to disk on shutdown or
+            deletion and files are not removed. When files of the queue exist
+            on disk, the queue starts on disk. Default: False.
+        :param overwrite: see FileQueue. Default: False
+        :param id_: see FileQueue. Default: 0
+        :param pickled: see FileQueue. Default: True
+        :param max_items: number of items above which the queue spills to
+            disk. Default: 1000
+        :param max_bytes: approximate size in bytes of the items above which
+            the queue spills to disk. Default: 256 kB
+        :param disk: (optional) queue the items spill to instead of a
+            FileQueue, for example a frontier.Frontier host queue. It should
+            offer put_many, get_many, empty, remove and __len__. Default: None
+        """
+        self.hq = _HybridQueue(directory, name, persistent, overwrite, id_,
+                               pickled, max_items, max_bytes, disk)
+        self._finalizer = weakref.finalize(self, _flush, self.hq)
+
+    def put(self, x):
+        """
+        Put item into the queue.
+
+        :param item: string or other Python object to put in queue.
+        """
+        self.hq.put_many((x,))
+
+    def get(self, block=False, timeout=None):
+        """
+        Remove and return an item from the queue.
+
+        Raises Empty when empty.
+
+        :param block: when True waits until an item is put into the queue.
+            Default: False
+        :param timeout: when blocking, the maximum number of seconds to wait.
+            Default: None (wait until an item is available)
+        :return: item (string or other python object) if one is available,
+            else raise the Empty exception
+        """
+        return self.hq.get_many(1, block, timeout)[0]
+
+    def put_many(self, items):
+        """
+        Put all items into the queue at once.
+
+        :param items: iterable of strings or other Python objects.
+        """
+        self.hq.put_many(items)
+
+    def get_many(self, n, block=False, timeout=None):
+        """
+        Remove and return up to n items from the queue at once.
+
+        Raises Empty when empty.
+
+        :param n: maximum number of items returned.
+        :param block: see get. Default: False
+        :param timeout: see get. Default: None
+        :return: list with at least one and at most n items.
+        """
+        return self.hq.get_many(n, block, timeout)
+
+    def qsize(self):
+        """
+        Approximate size of the queue.
+
+        :return: the approximate size of the queue
+        """
+        return len(self.hq)
+
+    def empty(self):
+        """
+        Returns True if the queue is empty, False otherwise.
+        """
+        return len(self.hq) == 0
+
+    @property
+    def on_disk(self):
+        """
+        True when the items of the queue are stored on disk.
+        """
+        return self.hq.spilled
+
+    def remove(self):
+        self._finalizer()
+
+    def __len__(self):
+        return len(self.hq)
+
+    def __str__(self):
+        return str(self.hq)
+
+    def __repr__(self):
+        return repr(self.hq)
+
+
+class _HybridQueue(object):
+
+    def __init__(self, directory="", name=None, persistent=False,
+                 overwrite=False, id_=0, pickled=True, max_items=1000,
+                 max_bytes=1 << 18, disk=None):
+        if name is None:
+            name = uuid.uuid4().hex
+        self.file_queue_kwargs = {
+            'directory': directory,
+            'name': name,
+            'persistent': persistent,
+            'overwrite': overwrite,
+            'id_': id_,
+            'pickled': pickled
+        }
+        self.persistent = persistent
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.memory = deque()
+        self.bytes = 0
+        self.own_disk = disk is None
+        self.disk = disk
+        self.lock = threading.Lock()
+        self.not_empty = threading.Condition(self.lock)
+        pos_name = os.path.join(directory, 'pos_thread_{}_{}.queue'.format(
+            name, id_))
+        if self.own_disk and persistent and overwrite and \
+                os.path.exists(pos_name):
+            self.disk = FileQueue(**self.file_queue_kwargs)
+        self.spilled = self.disk is not None and not self.disk.empty()
+        if self.disk is not None and not self.spilled:
+            self._drop_disk()
+
+    def spill(self):
+        if self.disk is None:
+            self.disk = FileQueue(**self.file_queue_kwargs)
+        self.disk.put_many(self.memory)
+        self.spilled = True
+        self.memory.clear()
+        self.bytes = 0
+
+    def _drop_disk(self):
+        self.spilled = False
+        if self.own_disk:
+            self.disk._finalizer.detach()
+            _remove(self.disk.fq)
+            self.disk = None
+
+    def put_many(self, items):
+        with self.lock:
+            items = iter(items)
+            if not self.spilled:
+                for item in items:
+                    self.memory.append(item)
+                    self.bytes += _item_size(item)
+                    if len(self.memory) > self.max_items or \
+                            self.bytes > self.max_bytes:
+                        self.spill()
+                        break
+            if self.spilled:
+                self.disk.put_many(items)
+            self.not_empty.notify_all()
+
+    def get_many(self, n, block=False, timeout=None):
+        deadline = _deadline(block, timeout)
+        with self.not_empty:
+            while True:
+                if self.spilled:
+                    try:
+                        items = self.disk.get_many(n)
+                        if self.disk.empty():
+                            self._drop_disk()
+                        return items
+                    except Empty:
+                        self._drop_disk()
+                if self.memory:
+                    break
+                if not _wait(self.not_empty, block, deadline):
+                    raise Empty('Queue is empty.')
+            items = [self.memory.popleft()
+                     for _ in range(min(n, len(self.memory)))]
+            self.bytes -= sum(_item_size(item) for item in items)
+            return items
+
+    def __len__(self):
+        if self.spilled:
+            return len(self.memory) + len(self.disk)
+        return len(self.memory)
+
+    def __str__(self):
+        return 'HybridQueue {} with length {}.'.format(
+            self.file_queue_kwargs['name'], len(self))
+
+    def __repr__(self):
+        if self.spilled:
+            return str(self) + ' On disk: ' + repr(self.disk)
+        return str(self) + ' In memory: {} bytes'.format(self.bytes)
+
+
 class _PersistentFileQueue(object):
 
     def __init__(self, directory="", name=None, persistent=False,
-                 overwrite=False, id_=0, pickled=True):
+                 overwrite=False, id_=0, pickled=True,
+                 segment_size=SEGMENT_SIZE, compact_interval=None,
+                 compress=False):
         self.pickled = pickled
         self.persistent = persistent
+        self.segment_size = segment_size
+        self.compress = compress
         if name:
             self.name_base = name
         else:
@@ -188,47 +573,430 @@ class _PersistentFileQueue(object):
         self.directory = directory.rstrip('/') + '/' if len(directory) else ""
         if not os.path.exists(self.directory) and self.directory:
             os.makedirs(self.directory)
-        self.put_queue_name = self._filename('put')
-        self.get_queue_name = self._filename('get')
         self.pos_name = self._filename('pos')
-        self._update_pos(0)
+        directory, pos_name = os.path.split(self.pos_name)
+        self.segment_base = os.path.join(
+            directory, 'seg' + pos_name[3:-len('.queue')])
         self.put_lock = threading.Lock()
         self.get_lock = threading.Lock()
-        self.get_queue_length = 0
-        self.put_queue_length = 0
-        self._puttable = True
-        self.iterator = self._iterator()
+        self.not_empty = threading.Condition(self.get_lock)
+        self.pos_lock = threading.Lock()
+        self.head = 0
+        self.tail = 0
+        self.get_pos = 0
+        self.length = 0
+        self._map = None
+        if persistent:
+            self._recover()
+        else:
+            self._clear()
+        # the state of the put and of the get side, each taken under its own
+        # lock, that is written to the pos file
+        self.put_state = (self.tail, self._size(self.tail))
+        self.get_state = (self.head, self.get_pos)
+        self.changes = 0
+        self._update_pos()
+        self._stop_compacting = threading.Event()
+        if compact_interval:
+            threading.Thread(
+                target=_compact_worker,
+                args=(weakref.ref(self), compact_interval,
+                      self._stop_compacting),
+                daemon=True
+            ).start()
+
+    def segment_name(self, segment):
+        return '{}_{}.queue'.format(self.segment_base, segment)
+
+    def _size(self, segment):
+        try:
+            return os.path.getsize(self.segment_name(segment))
+        except FileNotFoundError:
+            return 0
+
+    def _exists(self, segment):
+        name = self.segment_name(segment)
+        return os.path.exists(name) or os.path.exists(name + '.z')
+
+    def remove_segment(self, segment):
+        del_file(self.segment_name(segment))
+        del_file(self.segment_name(segment) + '.z')
+        del_file(self.segment_name(segment) + '.compact')
+
+    def _clear(self):
+        segment = 0
+        while self._exists(segment):
+            self.remove_segment(segment)
+            segment += 1
+
+    def _recover(self):
+        """
+        Restores segments, read position and queue length from the pos file.
+
+        The pos file holds: '[first segment] [byte offset] [last segment]
+        [size of the last segment] [length] [record format]'. Queues written
+        by older versions, as a get, a put and a pos file, are converted (see
+        _migrate).
+        """
+        try:
+            with open(self.pos_name, 'r') as pn:
+                state = [int(x) for x in pn.read().split()]
+        except ValueError:
+            state = []
+        if len(state) == 6:
+            self.head, self.get_pos, tail, put_pos, self.length, _ = state
+            self._finish_compact()
+            self._catch_up(tail, put_pos)
+            return
+        if self._migrate(state):
+            self._convert()
+
+    def _catch_up(self, tail, put_pos):
+        """
+        Brings the stored state up to date with the segments on disk, when
+        items were put or read after the pos file was last written.
+
+        :param tail: last segment in the pos file.
+        :param put_pos: size of the last segment in the pos file.
+        """
+        segments = self._segments()
+        if not segments:
+            self.head = self.tail = max(self.head, tail)
+            self.get_pos = self.length = 0
+            return
+        self.tail = segments[-1]
+        if self.head in segments and tail in segments and \
+                segments == list(range(self.head, self.tail + 1)):
+            if self.get_pos > self._size(self.head):
+                self.get_pos = 0
+            # the stored length runs up to the stored end of the last segment
+            self.length += sum(
+                self._count(segment, put_pos if segment == tail else 0)
+                for segment in range(tail, self.tail + 1))
+            return
+        # segments were read completely after the pos file was written
+        if self.head not in segments:
+            self.head = min([segment for segment in segments
+                             if segment > self.head] or [self.tail])
+            self.get_pos = 0
+        self.length = sum(
+            self._count(segment, self.get_pos if segment == self.head else 0)
+            for segment in segments if segment >= self.head)
+
+    def _segments(self):
+        """
+        Returns the numbers of the segments of this queue on disk, in order.
+        """
+        directory, base = os.path.split(self.segment_base)
+        prefix = base + '_'
+        segments = set()
+        for name in os.listdir(directory or '.'):
+            if not name.startswith(prefix):
+                continue
+            number, _, extension = name[len(prefix):].partition('.')
+            if number.isdigit() and extension in ('queue', 'queue.z'):
+                segments.add(int(number))
+        return sorted(segments)
+
+    def _count(self, segment, start=0):
+        """
+        Returns the number of complete records in segment from byte offset
+        start on.
+        """
+        name = self.segment_name(segment)
+        try:
+            if os.path.exists(name + '.z'):
+                with open(name + '.z', 'rb') as f:
+                    data = zlib.decompress(f.read())
+            else:
+                with open(name, 'rb') as f:
+                    data = f.read()
+        except FileNotFoundError:
+            return 0
+        count = 0
+        pos = start
+        while pos + _LENGTH.size <= len(data):
+            pos += _LENGTH.size + _LENGTH.unpack_from(data, pos)[0]
+            if pos > len(data):
+                break
+            count += 1
+        return count
+
+    def _migrate(self, state):
+        """
+        Converts the get, put and pos files of older versions to segments: the
+        get file becomes the first and the put file the last segment.
 
-    def _update_pos(self, i):
-        self.get_pos = i
+        :param state: contents of the old pos file: the number of items read
+            from the get file.
+        """
+        names = [self._old_filename(file_type) for file_type in ('get', 'put')]
+        if not any(os.path.exists(name) for name in names):
+            return False
+        self._clear()
+        for segment, name in enumerate(names):
+            if os.path.exists(name):
+                os.replace(name, self.segment_name(segment))
+        self.tail = 1
+        skip = state[0] if state else 0
+        try:
+            with open(self.segment_name(0), 'rb') as f:
+                for _ in range(skip):
+                    self._load_file(f)
+                self.get_pos = f.tell()
+        except FileNotFoundError:
+            pass
+        return True
+
+    def _convert(self):
+        """
+        Rewrites the migrated segments, which hold pickles or lines, from the
+        read position onwards as records and counts the queue length.
+        """
+        self.length = 0
+        for segment in range(self.head, self.tail + 1):
+            name = self.segment_name(segment)
+            if not os.path.exists(name):
+                continue
+            with open(name, 'rb') as old, open(name + '.convert', 'wb') as new:
+                if segment == self.head:
+                    old.seek(self.get_pos)
+                while True:
+                    try:
+                        item = self._load_file(old)
+                    except EOFError:
+                        break
+                    self._dump(item, new)
+                    self.length += 1
+            os.replace(name + '.convert', name)
+        self.get_pos = 0
+
+    def _old_filename(self, file_type):
+        directory, pos_name = os.path.split(self.pos_name)
+        return os.path.join(directory, file_type + pos_name[3:])
+
+    def _load_file(self, f):
+        """
+        Loads an item stored by older versions as pickle or line.
+        """
+        if self.pickled:
+            try:
+                return pickle.load(f)
+            except pickle.UnpicklingError:
+                raise EOFError
+        line = f.readline()
+        if not line.endswith(b'\n'):
+            raise EOFError
+        return line[:-1].decode('utf-8')
+
+    def _update_pos(self):
+        """
+        Writes the pos file now. The caller holds get_lock, or no other
+        thread uses the queue, so that the read position is current.
+        """
+        with self.pos_lock:
+            self.get_state = (self.head, self.get_pos)
+            self._write_pos()
+
+    def _changed(self, change, get_state=None, put_state=None):
+        """
+        Updates the queue length with the state of the get or the put side,
+        as taken by the caller under get_lock or put_lock. Writes the pos file
+        every POS_SYNC_OPERATIONS changes or POS_SYNC_INTERVAL seconds.
+
+        :param change: number of items put (positive) or read (negative).
+        :param get_state: (first segment, byte offset of read position)
+        :param put_state: (last segment, size of last segment)
+        """
+        with self.pos_lock:
+            self.length += change
+            if get_state is not None:
+                self.get_state = get_state
+            if put_state is not None:
+                self.put_state = put_state
+            self.changes += 1
+            if self.changes >= POS_SYNC_OPERATIONS or \
+                    time.monotonic() >= self.sync_deadline:
+                self._write_pos()
+
+    def _write_pos(self):
         with open(self.pos_name, 'w') as pn:
-            pn.write(str(self.get_pos))
+            pn.write('{} {} {} {} {} {}'.format(
+                *(self.get_state + self.put_state +
+                  (self.length, RECORD_FORMAT))))
+        self.changes = 0
+        self.sync_deadline = time.monotonic() + POS_SYNC_INTERVAL
+
+    def _dump(self, item, f):
+        f.write(frame(encode(item, self.pickled)))
 
     def put(self, item):
-        if not self._puttable:
-            raise Empty('Putting to emptied queue is not allowed.')
+        self.put_many((item,))
+
+    def put_many(self, items):
         with self.put_lock:
-            with open(self.put_queue_name, self._file_method('a')) as f:
-                if self.pickled:
-                    pickle.dump(item, f)
-                else:
-                    f.write(item + '\n')
-            self.put_queue_length += 1
+            count = 0
+            f = open(self.segment_name(self.tail), 'ab')
+            try:
+                for item in items:
+                    self._dump(item, f)
+                    count += 1
+                    if f.tell() >= self.segment_size:
+                        f.close()
+                        self.tail += 1
+                        if self.compress:
+                            self._compress(self.tail - 1)
+                        f = open(self.segment_name(self.tail), 'ab')
+            finally:
+                put_state = (self.tail, f.tell())
+                f.close()
+                self._changed(count, put_state=put_state)
+        with self.not_empty:
+            self.not_empty.notify_all()
 
-    def get(self):
+    def _compress(self, segment):
+        """
+        Compresses a sealed segment with zlib, unless it is being read.
+        """
         with self.get_lock:
+            if segment <= self.head:
+                return
+            name = self.segment_name(segment)
+            with open(name, 'rb') as f, open(name + '.z', 'wb') as z:
+                z.write(zlib.compress(f.read()))
+            os.remove(name)
+
+    def get(self, block=False, timeout=None):
+        return self.get_many(1, block, timeout)[0]
+
+    def get_many(self, n, block=False, timeout=None):
+        deadline = _deadline(block, timeout)
+        with self.not_empty:
+            items = []
+            while not items:
+                try:
+                    while len(items) < n:
+                        items.append(self._read())
+                except EOFError:
+                    if not items and \
+                            not _wait(self.not_empty, block, deadline):
+                        raise Empty('File queue is empty.')
+            self._changed(-len(items), get_state=(self.head, self.get_pos))
+            return items
+
+    def _read(self):
+        """
+        Reads the item at the current byte offset of the first segment.
+
+        :raises EOFError: when all segments are exhausted.
+        """
+        while True:
+            # Segments before the last one are complete, so a segment is
+            # finished when it was sealed before its size is checked.
+            sealed = self.head < self.tail
+            if self._map is None and not self._map_head():
+                if not sealed:
+                    raise EOFError
+                self._next_segment()
+                continue
             try:
-                get_pos, item = next(self.iterator)
-                if get_pos == 0:
-                    self.get_queue_length = self.put_queue_length
-                    self.put_queue_length = 0
+                return self._load()
+            except EOFError:
+                if self._size(self.head) > len(self._map):
+                    self._unmap()
+                elif sealed:
+                    self._next_segment()
                 else:
-                    self.get_queue_length -= 1
-                self._update_pos(get_pos)
-                return item
-            except StopIteration:
-                self._puttable = False
-                raise Empty('File queue is empty.')
+                    raise
+
+    def _next_segment(self):
+        self._unmap()
+        self.remove_segment(self.head)
+        self.head += 1
+        self.get_pos = 0
+
+    def _skip(self):
+        """
+        Returns the start and end of the payload of the record at the read
+        position without decoding it.
+        """
+        start = self.get_pos + _LENGTH.size
+        if start > len(self._map):
+            raise EOFError
+        end = start + _LENGTH.unpack_from(self._map, self.get_pos)[0]
+        if end > len(self._map):
+            raise EOFError
+        self.get_pos = end
+        return start, end
+
+    def _load(self):
+        start, end = self._skip()
+        return decode(self._view[start:end])
+
+    def _map_head(self):
+        name = self.segment_name(self.head)
+        try:
+            if os.path.exists(name + '.z'):
+                with open(name + '.z', 'rb') as f:
+                    self._map = zlib.decompress(f.read())
+            else:
+                with open(name, 'rb') as f:
+                    self._map = mmap.mmap(f.fileno(), 0,
+                                          access=mmap.ACCESS_READ)
+        except (FileNotFoundError, ValueError):
+            # ValueError: an empty file cannot be mapped.
+            return False
+        self._view = memoryview(self._map)
+        return True
+
+    def _unmap(self):
+        if self._map is not None:
+            self._view.release()
+            if isinstance(self._map, mmap.mmap):
+                self._map.close()
+            self._map = None
+
+    def compact(self):
+        with self.get_lock:
+            name = self.segment_name(self.head)
+            if self.head == self.tail or self.get_pos == 0 or \
+                    not os.path.exists(name):
+                return
+            self._unmap()
+            with open(name, 'rb') as f, open(name + '.compact', 'wb') as new:
+                f.seek(self.get_pos)
+                while True:
+                    block = f.read(1 << 16)
+                    if not block:
+                        break
+                    new.write(block)
+            # The read position of the compacted segment is stored before it
+            # replaces the segment, see _finish_compact.
+            self.get_pos = 0
+            self._update_pos()
+            os.replace(name + '.compact', name)
+
+    def _finish_compact(self):
+        """
+        Completes or discards a compaction of the first segment that was
+        interrupted. A read position of 0 was stored for the compacted
+        segment before it replaced the segment, so the compacted segment is
+        complete when the stored read position is 0. Otherwise the stored
+        position still belongs to the segment.
+        """
+        name = self.segment_name(self.head)
+        if not os.path.exists(name + '.compact'):
+            return
+        if self.get_pos == 0:
+            os.replace(name + '.compact', name)
+        else:
+            os.remove(name + '.compact')
+
+    def close(self):
+        self._stop_compacting.set()
+        with self.get_lock:
+            self._unmap()
+            self._update_pos()
 
     def qsize(self):
         return len(self)
@@ -248,50 +1016,8 @@ class _PersistentFileQueue(object):
         _touch(file_name=name, pickled=self.pickled, keep=self.persistent)
         return name
 
-    def _file_method(self, method):
-        return _file_method(method, self.pickled)
-
-    def _iterator(self):
-        def iterator(put_queue_name, get_queue_name, pos_name, file_method,
-                     pickled, put_lock):
-            get_pos = 0
-            try_again = 0
-            while try_again < 2:
-                try_again += 1
-                with open(get_queue_name, file_method) as f:
-                    if pickled:
-                        while True:
-                            try:
-                                unpickled = pickle.load(f)
-                            except EOFError:
-                                break
-                            try_again = 0
-                            get_pos += 1
-                            yield get_pos, unpickled
-                    else:
-                        for line in f:
-                            get_pos += 1
-                            yield get_pos, line.strip('\n')
-                            try_again = 0
-                with put_lock:
-                    os.rename(put_queue_name, get_queue_name)
-                    _touch(put_queue_name, pickled=self.pickled)
-                    get_pos = 0
-            os.remove(put_queue_name)
-            os.remove(get_queue_name)
-            os.remove(pos_name)
-
-        pos_name = self.pos_name
-        put_queue_name = self.put_queue_name
-        get_queue_name = self.get_queue_name
-        file_method = self._file_method('r')
-        pickled = self.pickled
-        put_lock = self.put_lock
-        return iterator(put_queue_name, get_queue_name, pos_name,
-                        file_method, pickled, put_lock)
-
     def __add__(self, other):
-        length = other.get_queue_length
+        length = len(other)
         temp = FileQueue()
         for _ in range(length):
             other.put(other.get())
@@ -303,15 +1029,13 @@ class _PersistentFileQueue(object):
         return self
 
     def __len__(self):
-        return self.get_queue_length + self.put_queue_length
+        return self.length
 
     def __str__(self):
         return 'FileQueue for thread {} with length {}.'.format(
             threading.get_ident(), len(self))
 
     def __repr__(self):
-        get_queue_name = os.path.join(os.getcwd(), self.get_queue_name)
-        put_queue_name = os.path.join(os.getcwd(), self.put_queue_name)
-        return str(self) + 'Files: Read: {} [len {}]; Add: {} [len {}]' \
-            ''.format(get_queue_name, self.get_queue_length,
-                      put_queue_name, self.put_queue_length)
+        segment_base = os.path.join(os.getcwd(), self.segment_base)
+        return str(self) + 'Files: {}_[{}-{}].queue; Read position: {}' \
+            ''.format(segment_base, self.head, self.tail, self.get_pos)
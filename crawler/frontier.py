@@ -0,0 +1,226 @@
+__author__ = 'roelvdberg@gmail.com'
+
+import os
+import sqlite3
+import threading
+import weakref
+
+try:
+    from filequeue import Empty, HybridQueue, encode, decode
+except ImportError:
+    from crawler.filequeue import Empty, HybridQueue, encode, decode
+
+
+def _close(store, queues):
+    # persistent host queues write the links they hold in memory to the
+    # database before it is closed.
+    for queue in list(queues.values()):
+        queue.remove()
+    store.close()
+
+
+class Frontier(object):
+    """
+    Store for the link queues of all hosts in a single SQLite database.
+
+    Instead of a set of files per host, links of all hosts are stored as rows
+    in one table with an index on (host, id). Strings are stored as text,
+    other items as filequeue records (see filequeue.encode). Each host gets
+    a HybridQueue (see queue) that keeps its links in memory and only spills
+    to this store when it grows large. The number of stored links per host
+    is kept in memory, so that non-empty hosts can be listed without
+    querying the database.
+    """
+
+    def __init__(self, filename, persistent=True, max_items=1000,
+                 max_bytes=1 << 18):
+        """
+        :param filename: filename of the SQLite database.
+        :param persistent: When True stored links are kept on shutdown and
+            loaded again on start. Default: True
+        :param max_items: see filequeue.HybridQueue. Default: 1000
+        :param max_bytes: see filequeue.HybridQueue. Default: 256 kB
+        """
+        self.persistent = persistent
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        # the host queues refer to the store, not to the frontier, so that
+        # the frontier is closed when it is garbage collected.
+        self.store = _Store(filename, persistent)
+        self.lock = threading.Lock()
+        self.queues = {}
+        self._finalizer = weakref.finalize(self, _close, self.store,
+                                           self.queues)
+
+    def queue(self, host):
+        """
+        Returns the link queue for host.
+
+        The same queue is returned for every call with the same host.
+
+        :param host: name of the host, e.g. 'www.nu.nl'.
+        :return: filequeue.HybridQueue that spills to this store.
+        """
+        with self.lock:
+            try:
+                return self.queues[host]
+            except KeyError:
+                queue = HybridQueue(
+                    name=host,
+                    persistent=self.persistent,
+                    max_items=self.max_items,
+                    max_bytes=self.max_bytes,
+                    disk=HostQueue(self.store, host)
+                )
+                self.queues[host] = queue
+                return queue
+
+    def non_empty_hosts(self):
+        """
+        Iterates over the hosts that have links in their queue.
+        """
+        for host, queue in list(self.queues.items()):
+            if len(queue):
+                yield host
+        for host, size in list(self.store.stored.items()):
+            if size and host not in self.queues:
+                yield host
+
+    @property
+    def has_content(self):
+        """
+        Indicates whether any of the hosts still has links in its queue.
+        """
+        return any(True for _ in self.non_empty_hosts())
+
+    def put_many(self, host, items):
+        self.store.put_many(host, items)
+
+    def get_many(self, host, n):
+        return self.store.get_many(host, n)
+
+    def clear(self, host):
+        self.store.clear(host)
+
+    def size(self, host):
+        return self.store.size(host)
+
+    def close(self):
+        self._finalizer()
+
+
+class _Store(object):
+    """
+    The SQLite database of a Frontier.
+    """
+
+    def __init__(self, filename, persistent):
+        directory = os.path.dirname(filename)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        if not persistent and os.path.exists(filename):
+            os.remove(filename)
+        self.persistent = persistent
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(filename, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS frontier ('
+            'id INTEGER PRIMARY KEY AUTOINCREMENT, '
+            'host TEXT NOT NULL, '
+            'item)'
+        )
+        self.connection.execute(
+            'CREATE INDEX IF NOT EXISTS frontier_host ON frontier (host, id)')
+        self.connection.commit()
+        self.stored = dict(self.connection.execute(
+            'SELECT host, COUNT(*) FROM frontier GROUP BY host'))
+
+    def put_many(self, host, items):
+        rows = [(host, item if isinstance(item, str) else encode(item))
+                for item in items]
+        if not rows:
+            return
+        with self.lock:
+            self.connection.executemany(
+                'INSERT INTO frontier (host, item) VALUES (?, ?)', rows)
+            self.connection.commit()
+            self.stored[host] = self.stored.get(host, 0) + len(rows)
+
+    def get_many(self, host, n):
+        with self.lock:
+            rows = self.connection.execute(
+                'SELECT id, item FROM frontier WHERE host = ? ORDER BY id '
+                'LIMIT ?', (host, n)).fetchall()
+            if not rows:
+                raise Empty('Frontier queue for {} is empty.'.format(host))
+            self.connection.execute(
+                'DELETE FROM frontier WHERE host = ? AND id <= ?',
+                (host, rows[-1][0]))
+            self.connection.commit()
+            self.stored[host] -= len(rows)
+        return [item if isinstance(item, str) else decode(item)
+                for _, item in rows]
+
+    def clear(self, host):
+        with self.lock:
+            self.connection.execute('DELETE FROM frontier WHERE host = ?',
+                                    (host,))
+            self.connection.commit()
+            self.stored[host] = 0
+
+    def size(self, host):
+        return self.stored.get(host, 0)
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+class HostQueue(object):
+    """
+    Queue of the links of one host in a Frontier.
+    """
+
+    def __init__(self, store, host):
+        """
+        :param store: the store of the Frontier.
+        :param host: name of the host.
+        """
+        self.store = store
+        self.host = host
+
+    def put(self, x):
+        self.store.put_many(self.host, (x,))
+
+    def get(self):
+        return self.store.get_many(self.host, 1)[0]
+
+    def put_many(self, items):
+        self.store.put_many(self.host, items)
+
+    def get_many(self, n):
+        return self.store.get_many(self.host, n)
+
+    def qsize(self):
+        return self.store.size(self.host)
+
+    def empty(self):
+        return self.store.size(self.host) == 0
+
+    def remove(self):
+        """
+        Removes the stored links of a non-persistent frontier.
+        """
+        if not self.store.persistent:
+            self.store.clear(self.host)
+
+    def __len__(self):
+        return self.store.size(self.host)
+
+    def __str__(self):
+        return 'HostQueue for {} with length {}.'.format(self.host, len(self))
+
+    def __repr__(self):
+        return str(self)
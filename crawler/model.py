@@ -1,6 +1,7 @@
 __author__ = 'roelvdberg@gmail.com'
 import os
 
+from sqlalchemy import Boolean
 from sqlalchemy import Column
 from sqlalchemy import create_engine
 from sqlalchemy import DateTime
@@ -80,6 +81,29 @@ class Heading(Base):
     h6 = Column(String)
 
 
+class Sitemap(Base):
+    __tablename__ = 'sitemaps'
+    id = Column(Integer, primary_key=True)
+    url = Column(String, unique=True)
+    lastmod = Column(String)
+    etag = Column(String)
+    last_modified = Column(String)
+    max_url_lastmod = Column(DateTime)
+    news = Column(Boolean)
+    crawled = Column(DateTime)
+
+
+class Template(Base):
+    __tablename__ = 'templates'
+    id = Column(Integer, primary_key=True)
+    host = Column(String, unique=True)
+    body = Column(String)
+    title = Column(String)
+    date = Column(String)
+    author = Column(String)
+    learned = Column(DateTime)
+
+
 def create_all():
     Base.metadata.create_all(engine)
 
@@ -159,6 +159,30 @@ CRAWL_DELAY = 5         # seconds of waiting time for each time crawled
 REVISIT_AFTER = 15      # revisit time in days
 MAX_THREADS = 50        # number of threads running at once
 MAX_CONCURRENT_SITEMAPS = 50  # number of sitemaps allowed to be fetched at once
+MAX_SITEMAPS_PER_HOST = 4     # child sitemaps of one index fetched at once
+SITEMAP_BUFFER = 1000   # sitemap entries buffered between fetching and adding
+# seconds a child sitemap waits for room in the buffer of its index before it
+# gives up (it is read again in the next run)
+SITEMAP_BUFFER_TIMEOUT = 300
+SITEMAP_QUEUE_LIMIT = 10000  # sitemap links queued per website before pausing
+# seconds between polls of news sitemaps and feeds (None: no polling)
+POLL_INTERVAL = 300
+LINK_BATCH_SIZE = 500   # number of links written to a link queue at once
+LINK_PREFETCH = 10      # links a website takes from its queue at once
+HOST_IDLE_TIMEOUT = 60  # seconds a website waits for new links before it stops
+QUEUE_MEMORY_ITEMS = 1000      # links kept in memory before a queue spills
+QUEUE_MEMORY_BYTES = 1 << 18   # bytes kept in memory before a queue spills
+FRONTIER_FILENAME = '../data/frontier.sqlite3'  # store for spilled link queues
+HEAD_CHUNK_SIZE = 8192  # bytes parsed at once while looking for the page head
+MAX_LINK_DENSITY = 0.5  # share of link text above which a paragraph is skipped
+MIN_PARAGRAPH_LENGTH = 25  # characters a paragraph needs to score for a block
+BOILERPLATE_MIN_PAGES = 3  # pages of a host a text is on before it is skipped
+BOILERPLATE_FINGERPRINTS = 2000  # texts remembered per host for the above
+FINGERPRINT_BATCH_SIZE = 200  # texts of a streamed page looked up at once
+TEMPLATE_LEARN_PAGES = 3  # pages in a row a template must fit to be learned
+TEMPLATE_WINDOW = 50    # pages over which the hit rate of a template is taken
+TEMPLATE_MIN_HIT_RATE = 0.8  # hit rate below which a template is relearned
+STORE_BATCH_SIZE = 200   # paragraphs and headings of a page stored at once
 
 DATE_TIME_DISTANCE = 4  # allowed distance in characters between date and time
 
@@ -167,6 +191,11 @@ DATABASE_FILENAME = 'nieuwscrawltest.sqlite3'
 LOG_FILENAME = 'nieuwscrawltest.log'
 RESET_DATABASE = False
 
+# hosts that are not followed: a name with a dot is a host suffix ('last.fm'
+# also matches 'www.last.fm'), a name without a dot matches a whole label of
+# a host ('google' matches 'www.google.nl', not 'googlenieuws.nl'). Names are
+# not looked up in the path or query of a link, so 'nu.nl/?share=facebook' is
+# followed; use NOFOLLOW_PATHS for those.
 NOFOLLOW = [
     "creativecommons",
     "facebook",
@@ -189,3 +218,24 @@ NOFOLLOW = [
     "youtube",
     'sciencecommons'
 ]
+
+# host suffixes (e.g. 'nieuws.google.nl') that are followed although NOFOLLOW
+# matches them
+FOLLOW = []
+
+# regular expressions for the path and query of links that are not followed,
+# e.g. r'^/(?:login|zoeken)\b'
+NOFOLLOW_PATHS = []
+
+# extensions of files that are no webpages
+NOFOLLOW_EXTENSIONS = [
+    'avi', 'bmp', 'css', 'csv', 'doc', 'docx', 'epub', 'exe', 'flv', 'gif',
+    'gz', 'ico', 'jpeg', 'jpg', 'js', 'json', 'mov', 'mp3', 'mp4', 'mpeg',
+    'mpg', 'odp', 'ods', 'odt', 'ogg', 'pdf', 'png', 'pps', 'ppt', 'pptx',
+    'rar', 'rss', 'svg', 'swf', 'tar', 'tif', 'tiff', 'txt', 'wav', 'webm',
+    'webp', 'wmv', 'xls', 'xlsx', 'xml', 'zip'
+]
+
+# rules that replace the ones above for links to a host (suffix), e.g.
+# {'nos.nl': {'nofollow_paths': [r'^/video/']}}
+URL_FILTER_OVERRIDES = {}
@@ -1,24 +1,229 @@
 # -*- coding: utf-8 -*-
 __author__ = 'roelvdberg@gmail.com'
 
-from gzip import GzipFile
-import os
+from collections import namedtuple
+from datetime import datetime as dt, timedelta, timezone
+import email.utils
+from functools import lru_cache
+import itertools
+import queue
+import re
+import threading
+import time
 import urllib.error
 
 import lxml.etree as etree
 
 try:
     from base import logger_setup
+    import model
+    from settings import MAX_CONCURRENT_SITEMAPS, MAX_SITEMAPS_PER_HOST, \
+        SITEMAP_BUFFER, SITEMAP_BUFFER_TIMEOUT
     import webpage
     import validate
 except ImportError:
     from crawler.base import logger_setup
+    import crawler.model as model
+    from crawler.settings import MAX_CONCURRENT_SITEMAPS, \
+        MAX_SITEMAPS_PER_HOST, SITEMAP_BUFFER, SITEMAP_BUFFER_TIMEOUT
     import crawler.webpage as webpage
     import crawler.validate as validate
 
 
 logger = logger_setup(__name__)
 
+# Shared by all sitemap indexes, so that at most MAX_CONCURRENT_SITEMAPS child
+# sitemaps are downloaded at once. Their entries are passed on once they are
+# downloaded, so that an index whose entries are not read does not hold up
+# the downloads of the others.
+sitemap_downloads = threading.Semaphore(MAX_CONCURRENT_SITEMAPS)
+
+# Marks the end of the entries of all child sitemaps in the buffer of a
+# sitemap index.
+_DONE = object()
+
+# Put in the buffer of a sitemap index after the entries of a child sitemap,
+# so that the state of the child is stored once its entries are read.
+_ChildDone = namedtuple('_ChildDone', 'link lastmod sitemap')
+
+# Location of child sitemaps that worked per base url (see
+# XmlSitemapIndex._try_sitemap): {base: pattern index}
+sitemap_patterns = {}
+
+# Namespace of the news tags in Google News sitemaps.
+NEWS_NAMESPACE = '{http://www.google.com/schemas/sitemap-news/0.9}'
+
+# Namespaces of Atom and RSS 1.0 feeds; RSS 0.9x and 2.0 have none.
+ATOM_NAMESPACE = '{http://www.w3.org/2005/Atom}'
+RSS_NAMESPACE = '{http://purl.org/rss/1.0/}'
+
+# Tags of the publication date of feed items, in order of preference.
+FEED_DATES = ('published', 'pubDate', 'date', 'updated')
+
+LASTMOD = re.compile(r'\s*(\d{4})-(\d\d)-(\d\d)(?:T(\d\d):(\d\d)(?::(\d\d))?'
+                     r'(?:\.\d+)?(?:(Z)|([+-])(\d\d):?(\d\d))?)?')
+
+
+@lru_cache(maxsize=1 << 12)
+def parse_lastmod(lastmod):
+    """
+    Parses a W3C datetime as used for lastmod in sitemaps. Sitemap entries
+    often share their lastmod, hence the cache.
+
+    :param lastmod: string such as '2015-06-01' or '2015-06-01T12:00:00+02:00'
+    :return: naive datetime in UTC or None when lastmod could not be parsed.
+    """
+    try:
+        match = LASTMOD.match(lastmod)
+    except TypeError:
+        return None
+    if not match:
+        return None
+    year, month, day, hour, minute, second, _, sign, tz_hour, tz_minute = \
+        match.groups()
+    try:
+        result = dt(int(year), int(month), int(day), int(hour or 0),
+                    int(minute or 0), int(second or 0))
+    except ValueError:
+        return None
+    if sign:
+        offset = timedelta(hours=int(tz_hour), minutes=int(tz_minute))
+        result = result - offset if sign == '+' else result + offset
+    return result
+
+
+class SitemapState(object):
+    """
+    Stores the state of sitemaps between runs (see model.Sitemap): the lastmod
+    from its sitemap index, its ETag and Last-Modified response headers, the
+    highest lastmod of its urls and whether it is a news sitemap.
+    """
+    headers = (('etag', 'ETag'), ('last_modified', 'Last-Modified'))
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.created = False
+
+    def _session(self):
+        if not self.created:
+            model.Sitemap.__table__.create(model.engine, checkfirst=True)
+            self.created = True
+        return model.Session()
+
+    def get(self, url):
+        """
+        Returns a dictionary with the stored state of url; empty if unknown.
+        """
+        with self.lock:
+            session = self._session()
+            try:
+                record = session.query(model.Sitemap).filter_by(
+                    url=url).first()
+                if record is None:
+                    return {}
+                return {
+                    'lastmod': record.lastmod,
+                    'etag': record.etag,
+                    'last_modified': record.last_modified,
+                    'max_url_lastmod': record.max_url_lastmod,
+                    'news': record.news
+                }
+            finally:
+                session.close()
+
+    def update(self, url, **kwargs):
+        """
+        Updates the stored state of url with the given columns.
+        """
+        with self.lock:
+            session = self._session()
+            try:
+                record = session.query(model.Sitemap).filter_by(
+                    url=url).first()
+                if record is None:
+                    record = model.Sitemap(url=url)
+                    session.add(record)
+                for key, value in kwargs.items():
+                    setattr(record, key, value)
+                record.crawled = dt.now()
+                session.commit()
+            finally:
+                session.close()
+
+    def news_sitemaps(self, base):
+        """
+        Returns the urls of the news sitemaps found for base.
+        """
+        with self.lock:
+            session = self._session()
+            try:
+                return [record.url for record in session.query(
+                    model.Sitemap).filter(model.Sitemap.news.is_(True),
+                                          model.Sitemap.url.like(base + '%'))]
+            finally:
+                session.close()
+
+    def request_headers(self, url):
+        """
+        Headers for a conditional request of url.
+        """
+        state = self.get(url)
+        headers = {}
+        if state.get('etag'):
+            headers['If-None-Match'] = state['etag']
+        if state.get('last_modified'):
+            headers['If-Modified-Since'] = state['last_modified']
+        return headers
+
+    def store_headers(self, url, sitemap):
+        """
+        Stores the ETag and Last-Modified headers of a completely read sitemap.
+
+        Only used for child sitemaps of an index: an unchanged index may still
+        refer to changed child sitemaps.
+        """
+        response_headers = getattr(sitemap, 'response_headers', None)
+        if response_headers:
+            self.update(url, **{
+                column: response_headers.get(header)
+                for column, header in self.headers
+            })
+
+    def changed(self, url, entries, detect_news=True):
+        """
+        Yields the entries with a lastmod after the highest lastmod of a
+        previous run, and entries without a lastmod. For news entries the
+        publication date is used when there is no lastmod. The new highest
+        lastmod is stored once all entries have been read, as is whether the
+        sitemap is a news sitemap.
+
+        :param url: url of the sitemap.
+        :param entries: iterator over dictionaries with 'modified_time' and
+            optionally 'publication_date'.
+        :param detect_news: when False url is not flagged as news sitemap,
+            e.g. for feeds.
+        """
+        state = self.get(url)
+        since = state.get('max_url_lastmod')
+        newest = since
+        news = False
+        for entry in entries:
+            if detect_news and entry.get('publication_date'):
+                news = True
+            lastmod = parse_lastmod(entry.get('modified_time') or
+                                    entry.get('publication_date'))
+            if lastmod is not None:
+                if since is not None and lastmod <= since:
+                    continue
+                if newest is None or lastmod > newest:
+                    newest = lastmod
+            yield entry
+        if newest != since or news != bool(state.get('news')):
+            self.update(url, max_url_lastmod=newest, news=news)
+
+
+sitemap_state = SitemapState()
+
 
 class Sitemap(object):
 
@@ -56,8 +261,6 @@ class Sitemap(object):
                 yield content
             del sitemap
         self.iterable = False
-        raise StopIteration
-        yield
 
     def append(self, url):
         self.urls.append(url)
@@ -101,8 +304,9 @@ class SitemapMixin(object):
     xml = False
     head = False
     save_to_disk = True
-    unique_tag = ""
     as_html = False
+    # the saved file is read while the sitemap is iterated
+    parse_saved = False
 
     def __init__(self, url, html=None, base=None, filename=None, download=True):
         logger.debug('INIT SITEMAPMIXIN {} as {}.'.format(
@@ -121,8 +325,9 @@ class SitemapMixin(object):
             filename=filename,
             download=download
         )
-        self.unique_tag = self.namespace + self.unique_tag
 
+    def request_headers(self, url):
+        return sitemap_state.request_headers(url)
 
     def _attr_len(self, sitemap):
         attributes = ["links", "modified_time", "revisit", 'publication_date',
@@ -154,45 +359,197 @@ class SitemapMixin(object):
     def __iadd__(self, other):
         return self.__add__(other)
 
-    @property
-    def fits_xml(self):
-        with open(self.filename, 'rb') as fileobj:
-            context = etree.iterparse(fileobj, events=('end',),
-                                   tag=self.unique_tag)
-            try:
-                next(context)
-                return True
-            except (StopIteration, etree.XMLSyntaxError):
-                return False
-
-
-# class Rss(SitemapMixin, webpage.Webpage):
-#     unique_tag = 'item'
-#     tag = ["link", "lastBuildDate", "pubDate", "title", "description"]
-#     name = ["links", "modified_time", 'publication_date', 'title',
-#             'description']
-#     parser = etree.XML
-#     xml = True
-#
-#     def __init__(self, url, html=None, base=None):
-#         super().__init__(url, html=html, base=base)
-#         self.modified_time = [
-#             mod_time if mod_time != '' else self.publication_date[i]
-#             for i, mod_time in enumerate(self.modified_time)
-#         ]
+
+class Feed(SitemapMixin, webpage.Webpage):
+    """
+    Parses RSS (0.9x, 1.0 and 2.0) and Atom feeds.
+
+    Items are read while the feed is parsed; only items that are new since the
+    previous read of the feed are passed on (see SitemapState.changed). Feeds
+    are fetched with a conditional request once they have been read.
+    """
+
+    def __init__(self, url, html=None, base=None, filename=None, download=True):
+        super().__init__(
+            url=url,
+            html=html,
+            base=base,
+            filename=filename,
+            download=download
+        )
+        self._iterate_items = iter(sitemap_state.changed(
+            self.url, self._items(), detect_news=False))
+
+    def __next__(self):
+        return next(self._iterate_items)
+
+    def _items(self):
+        try:
+            for item in feed_iter(self.filename):
+                yield item
+        except etree.XMLSyntaxError as e:
+            logger.debug("FEED: {} stopped at syntax error: {}".format(
+                self.url, e))
+            return
+        sitemap_state.store_headers(self.url, self)
+
+
+def feed_date(value, local_name):
+    """
+    Returns the date of a feed item as W3C datetime in UTC.
+
+    :param value: text of the date element.
+    :param local_name: tag name of the date element without namespace; RFC 822
+        dates (e.g. 'Sun, 18 Oct 2015 10:00:00 +0200') are used in RSS 2.0
+        pubDate elements.
+    """
+    if local_name != 'pubDate':
+        return value
+    try:
+        date = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError, IndexError):
+        return None
+    if date.tzinfo is not None:
+        date = date.astimezone(timezone.utc).replace(tzinfo=None)
+    return date.isoformat()
+
+
+def feed_iter(filename):
+    """
+    Streams the items of an RSS or Atom feed.
+
+    :param filename: filename of the feed.
+    :returns: iterator over dictionaries with 'links', 'publication_date' and
+        'title' of each item.
+    """
+    tags = ('item', RSS_NAMESPACE + 'item', ATOM_NAMESPACE + 'entry')
+    with webpage.open_file(filename) as fileobj:
+        context = etree.iterparse(fileobj, events=('end',), tag=tags)
+        for event, elem in context:
+            link = title = None
+            dates = {}
+            for child in elem:
+                if not isinstance(child.tag, str):
+                    continue
+                local_name = child.tag.rsplit('}', 1)[-1]
+                if local_name == 'link':
+                    if child.get('href'):
+                        if child.get('rel', 'alternate') == 'alternate':
+                            link = child.get('href')
+                    elif child.text and child.text.strip():
+                        link = child.text.strip()
+                elif local_name == 'title':
+                    title = child.text
+                elif local_name in FEED_DATES and child.text:
+                    dates.setdefault(local_name, child.text.strip())
+            date = next((feed_date(dates[name], name) for name in FEED_DATES
+                         if name in dates), None)
+            if link:
+                yield {'links': link, 'publication_date': date,
+                       'title': title}
+            elem.clear()
+            while elem.getprevious() is not None:
+                del elem.getparent()[0]
+        del context
+
+
+class SitemapParser(object):
+    """
+    Parses an XML sitemap or sitemap index in a single pass.
+
+    The kind of sitemap ('urlset' or 'sitemapindex') and its namespace are
+    read from the root element on initialisation; kind is None for other
+    files. Iterating yields a tuple (loc, lastmod, changefreq, extras) for each
+    <url> or <sitemap> element, where extras is None or a dictionary with the
+    publication_date and title of a Google News sitemap entry.
+    """
+    tags = ('{*}urlset', '{*}sitemapindex', '{*}url', '{*}sitemap')
+    kinds = {'urlset': 'url', 'sitemapindex': 'sitemap'}
+
+    def __init__(self, filename):
+        """
+        :param filename: filename of the (optionally gzipped) sitemap.
+        """
+        self.kind = None
+        self.namespace = ''
+        self.fileobj = webpage.open_file(filename)
+        self.context = etree.iterparse(self.fileobj, events=('start', 'end'),
+                                       tag=self.tags)
+        try:
+            event, root = next(self.context)
+        except (StopIteration, etree.XMLSyntaxError):
+            self.close()
+            return
+        namespace, _, kind = root.tag.rpartition('}')
+        if kind in self.kinds:
+            self.kind = kind
+            self.namespace = namespace + '}' if namespace else ''
+        else:
+            self.close()
+
+    def close(self):
+        self.fileobj.close()
+
+    def __iter__(self):
+        if self.kind is None:
+            return
+        namespace = self.namespace
+        entry_tag = namespace + self.kinds[self.kind]
+        loc_tag = namespace + 'loc'
+        lastmod_tag = namespace + 'lastmod'
+        changefreq_tag = namespace + 'changefreq'
+        news_tag = NEWS_NAMESPACE + 'news'
+        publication_date_tag = NEWS_NAMESPACE + 'publication_date'
+        title_tag = NEWS_NAMESPACE + 'title'
+        try:
+            for event, elem in self.context:
+                if event == 'start' or elem.tag != entry_tag:
+                    continue
+                loc = lastmod = changefreq = extras = None
+                for child in elem:
+                    tag = child.tag
+                    if tag == loc_tag:
+                        loc = child.text
+                    elif tag == lastmod_tag:
+                        lastmod = child.text
+                    elif tag == changefreq_tag:
+                        changefreq = child.text
+                    elif tag == news_tag:
+                        extras = {}
+                        for news_child in child:
+                            if news_child.tag == publication_date_tag:
+                                extras['publication_date'] = news_child.text
+                            elif news_child.tag == title_tag:
+                                extras['title'] = news_child.text
+                if loc:
+                    yield (loc.strip(), lastmod and lastmod.strip(),
+                           changefreq, extras)
+                elem.clear()
+                while elem.getprevious() is not None:
+                    del elem.getparent()[0]
+        except etree.XMLSyntaxError as e:
+            logger.debug("SITEMAP: stopped at syntax error: {}".format(e))
+        finally:
+            self.close()
 
 
 class XmlSitemap(SitemapMixin, webpage.Webpage):
     """
-    Parses XML sitemapindexes.
+    Base class of XML sitemaps and sitemap indexes.
+
+    The file is parsed once by a SitemapParser. When its root element is not
+    root_tag, the file and its parser are handed over to the class in next.
     """
-    tag = ["loc", "lastmod", "changefreq"]
-    name = ["links", "modified_time", "revisit"]
-    parser = etree.HTML
     xml = True
     next = None
-
-    def __init__(self, url, html=None, base=None, filename=None, download=True):
+    root_tag = None
+
+    def __init__(self, url, html=None, base=None, filename=None, download=True,
+                 parser=None):
+        """
+        :param parser: (optional) SitemapParser of the file at filename, when
+            it was already opened by another sitemap class.
+        """
         logger.debug('SITEMAP: loading XML ' + base)
         super().__init__(
             url=url,
@@ -202,52 +559,39 @@ class XmlSitemap(SitemapMixin, webpage.Webpage):
             download=download
         )
         self.filenameindex = 0
+        self.sitemap_parser = parser if parser is not None else \
+            SitemapParser(self.filename)
         if self.fits_xml:
             self._iterate_sitemaps = iter(self._fitting_sitemap_iterator())
         else:
-            self._iterate_sitemaps = iter(self._next_sitemap_iterator(
-                download=False, filename=self.filename))
+            self._iterate_sitemaps = iter(self._next_sitemap_iterator())
 
     def __next__(self):
-        x = next(self._iterate_sitemaps)
-        return x
+        return next(self._iterate_sitemaps)
 
-    def _next_sitemap_iterator(self, download, filename=None):
-        fn = filename if filename else self.update_filename()
+    @property
+    def fits_xml(self):
+        return self.sitemap_parser.kind == self.root_tag
+
+    def _next_sitemap_iterator(self):
+        if self.next is None and self.sitemap_parser.kind is not None:
+            # a sitemap index nested deeper than NestedXmlSitemapIndex
+            logger.warning("SITEMAP: {} is a {} nested too deep; "
+                           "skipped.".format(self.url,
+                                             self.sitemap_parser.kind))
+            self.sitemap_parser.close()
+            return iter(())
+        # raises a TypeError when there is no next class.
         return self.next(
-                    url=self.url,
-                    base=self.base,
-                    download=download,
-                    filename=fn
-                )
+            url=self.url,
+            base=self.base,
+            download=False,
+            filename=self.filename,
+            parser=self.sitemap_parser
+        )
 
     def _fitting_sitemap_iterator(self):
-        sitemap_dict = {}
-        while True:
-            try:
-                d = next(self._iterator)
-            except StopIteration:
-                iterator = iter(self._sitemap(sitemap_dict))
-                try:
-                    for link in iterator:
-                        yield link
-                    del iterator
-                except urllib.error.HTTPError:
-                    logger.debug("SITEMAP @ {} DOESN'T EXIST; SKIPPED.".format(
-                        self.url))
-                break
-            name, value = list(d.items())[0]
-            if name in sitemap_dict.keys():
-                iterator = iter(self._sitemap(sitemap_dict))
-                try:
-                    for link in iterator:
-                        yield link
-                    del iterator
-                except urllib.error.HTTPError:
-                    logger.debug("SITEMAP @ {} DOESN'T EXIST; SKIPPED.".format(
-                        self.url))
-                sitemap_dict = {}
-            sitemap_dict.update(d)
+        return iter(self.sitemap_parser)
 
     def update_filename(self):
         filebase = self.filename if not self.filename.endswith('.data') else \
@@ -259,82 +603,254 @@ class XmlSitemap(SitemapMixin, webpage.Webpage):
 
 class XmlUrlset(XmlSitemap):
     """
-    Parses XML sitemaps.
+    Parses XML sitemaps, including the publication date and title of Google
+    News sitemaps.
     """
-    unique_tag = 'url'
-    # next = Rss
+    root_tag = 'urlset'
+
+    def _fitting_sitemap_iterator(self):
+        # only urls changed since the previous run are passed on.
+        return sitemap_state.changed(self.url, self._entries())
 
-    def _sitemap(self, sitemap_dict):
-        yield sitemap_dict
+    def _entries(self):
+        for loc, lastmod, changefreq, extras in self.sitemap_parser:
+            entry = {'links': loc, 'modified_time': lastmod,
+                     'revisit': changefreq}
+            if extras:
+                entry.update(extras)
+            yield entry
 
 
 class XmlSitemapIndex(XmlSitemap):
     """
     Parses XML sitemapindexes.
+
+    Child sitemaps are fetched in parallel, each in its own thread, at most
+    MAX_SITEMAPS_PER_HOST at a time for one index and MAX_CONCURRENT_SITEMAPS
+    downloads at a time for all indexes together (see sitemap_downloads).
+    Their entries are passed on through a buffer of SITEMAP_BUFFER entries as
+    soon as they are parsed, in the order in which they arrive. A child
+    sitemap that finds the buffer full for SITEMAP_BUFFER_TIMEOUT seconds,
+    because the entries of the index are not read, gives up; it is read
+    again in the next run. The state of a child sitemap is stored only
+    after its last entry is read from the index.
+
+    Child sitemaps with the same lastmod as in the previous run are skipped.
+    Child sitemaps may be sitemap indexes themselves (see
+    NestedXmlSitemapIndex).
     """
     next = XmlUrlset
-    unique_tag = 'sitemap'
-    tag = ["loc", "lastmod", "changefreq"]
-    name = ["links", "modified_time", "revisit"]
+    root_tag = 'sitemapindex'
+    # class of the child sitemaps, set below NestedXmlSitemapIndex
+    child = None
 
-    def _sitemap(self, sitemap_dict):
-        link = sitemap_dict['links']
+    def _fitting_sitemap_iterator(self):
+        buffer = queue.Queue(maxsize=SITEMAP_BUFFER)
+        stop = threading.Event()
+        children = threading.Thread(target=self._fetch_children,
+                                    args=(buffer, stop), daemon=True)
+        children.start()
+        try:
+            while True:
+                try:
+                    entry = buffer.get(timeout=1)
+                except queue.Empty:
+                    # the children may have given up before _DONE was put
+                    if not children.is_alive() and buffer.empty():
+                        break
+                    continue
+                if entry is _DONE:
+                    break
+                if isinstance(entry, _ChildDone):
+                    sitemap_state.store_headers(entry.sitemap.url,
+                                                entry.sitemap)
+                    sitemap_state.update(entry.link, lastmod=entry.lastmod)
+                    continue
+                yield entry
+        finally:
+            stop.set()
+
+    def _fetch_children(self, buffer, stop):
+        """
+        Starts a thread that fetches each changed child sitemap, at most
+        MAX_SITEMAPS_PER_HOST at a time, and puts _DONE in buffer when they
+        are all done.
+
+        :param buffer: queue.Queue the entries are put in.
+        :param stop: threading.Event that is set when the index is no longer
+            iterated.
+        """
+        running = threading.Semaphore(MAX_SITEMAPS_PER_HOST)
+        try:
+            for link, lastmod, _, _ in self.sitemap_parser:
+                if self._unchanged(link, lastmod):
+                    continue
+                if not self._acquire(running, stop):
+                    return
+                threading.Thread(
+                    target=self._fetch_sitemap,
+                    args=(link, lastmod, self.update_filename(), buffer,
+                          stop, running),
+                    daemon=True
+                ).start()
+            # all children are done when all of them are released
+            for _ in range(MAX_SITEMAPS_PER_HOST):
+                if not self._acquire(running, stop):
+                    return
+        finally:
+            self._put(buffer, _DONE, stop)
+
+    @staticmethod
+    def _unchanged(link, lastmod):
+        if lastmod and sitemap_state.get(link).get('lastmod') == lastmod:
+            logger.debug("SITEMAP: {} unchanged; skipped.".format(link))
+            return True
+        return False
+
+    def _fetch_sitemap(self, link, lastmod, filename, buffer, stop, running):
+        """
+        Fetches a child sitemap and puts its entries in buffer, followed by
+        a _ChildDone.
+
+        :param link: url of the child sitemap in this index.
+        :param lastmod: lastmod of the child sitemap in this index.
+        :param filename: filename the child sitemap is stored to.
+        :param buffer: queue.Queue the entries are put in.
+        :param stop: threading.Event that is set when the index is no longer
+            iterated.
+        :param running: threading.Semaphore of the children of this index
+            that are fetched, released when done.
+        """
+        try:
+            with sitemap_downloads:
+                sitemap = self._try_sitemap(
+                    link=link,
+                    klass=self.child,
+                    filename=filename
+                )
+            if not sitemap:
+                return
+            for entry in itertools.chain(
+                    sitemap, [_ChildDone(link, lastmod, sitemap)]):
+                if not self._put(buffer, entry, stop):
+                    logger.debug("SITEMAP: child {} given up.".format(link))
+                    return
+        except urllib.error.HTTPError as e:
+            if e.code == 304:
+                logger.debug("SITEMAP: {} not modified; skipped.".format(link))
+                sitemap_state.update(link, lastmod=lastmod)
+            else:
+                logger.debug("SITEMAP: child {} failed: {}".format(link, e))
+        except Exception as e:
+            logger.debug("SITEMAP: child {} failed: {}".format(link, e))
+        finally:
+            running.release()
+
+    @staticmethod
+    def _acquire(semaphore, stop):
+        """
+        Acquires semaphore, unless stop is set first.
+
+        :return: True when acquired.
+        """
+        while not stop.is_set():
+            if semaphore.acquire(timeout=1):
+                return True
+        return False
+
+    @staticmethod
+    def _put(buffer, entry, stop):
+        """
+        Puts entry in buffer. Gives up when stop is set or when the buffer
+        stays full for SITEMAP_BUFFER_TIMEOUT seconds.
+
+        :return: True when entry was put in buffer.
+        """
+        deadline = time.monotonic() + SITEMAP_BUFFER_TIMEOUT
+        while not stop.is_set():
+            try:
+                buffer.put(entry, timeout=min(
+                    1, max(deadline - time.monotonic(), 0)))
+                return True
+            except queue.Full:
+                if time.monotonic() >= deadline:
+                    break
+        return False
+
+    def _try_sitemap(self, link, klass, filename):
+        """
+        Returns the child sitemap at link.
+
+        Some sites list child sitemaps at the wrong location. Besides link, the
+        sitemap is tried at base/sitemap/name and base/sitemaps/name. When a
+        location worked before for this host (see sitemap_patterns), only that
+        location is tried, unless it is not found.
+
+        :param link: url of the child sitemap in this index.
+        :param klass: sitemap class used for the child sitemap.
+        :param filename: filename the child sitemap is stored to.
+        :return: sitemap object or () when no location works.
+        """
+        name = link.split(r'/')[-1]
         links = [
-            self.base + r'/sitemaps/' + link.split(r'/')[-1],
-            self.base + r'/sitemap/' + link.split(r'/')[-1],
-            link
+            link,
+            self.base + r'/sitemap/' + name,
+            self.base + r'/sitemaps/' + name
         ]
-        sitemap = self._try_sitemap(
-            links=links,
-            klass=self.next,
-            filename=self.update_filename()
-        )
-        for link in sitemap:
-            yield link
-
-    def _try_sitemap(self, links, klass, filename):
-        try:
-            link = links.pop()
+        cached = sitemap_patterns.get(self.base)
+        patterns = list(range(len(links))) if cached is None else [cached]
+        while patterns:
+            pattern = patterns.pop(0)
             try:
-                return klass(
-                    url=link,
+                sitemap = klass(
+                    url=links[pattern],
                     base=self.base,
                     filename=filename
                 )
+            except urllib.error.HTTPError as e:
+                if e.code == 304:
+                    raise
+                logger.debug("Sitemap with link {} not working".format(
+                    links[pattern]))
+                if e.code == 404 and pattern == cached:
+                    # the location that worked before is not used for this
+                    # sitemap, so the others are tried
+                    patterns = [i for i in range(len(links)) if i != cached]
+                continue
             except (TypeError, etree.XMLSyntaxError):
-                logger.debug("Sitemap with link {} not working".format(link))
-                return self._try_sitemap(links, klass, filename)
-        except IndexError:
-            logger.debug(
-                "SITEMAP WITHOUT RESULTS WITH BASE: {}".format(
-                    self.base)
-            )
-            return ()
+                logger.debug("Sitemap with link {} not working".format(
+                    links[pattern]))
+                continue
+            sitemap_patterns[self.base] = pattern
+            return sitemap
+        logger.debug(
+            "SITEMAP WITHOUT RESULTS WITH BASE: {}".format(
+                self.base)
+        )
+        return ()
 
 
-class GunZip(XmlSitemap):
+class NestedXmlSitemapIndex(XmlSitemapIndex):
     """
-    Parses gunzipped (.gz) XML sitmaps.
+    Parses XML sitemapindexes that are listed in a sitemapindex.
+
+    Sitemap indexes listed in turn are skipped with a warning, so that an
+    index that lists itself is not read over and over.
     """
-    next = XmlSitemapIndex
+    child = XmlUrlset
 
-    @property
-    def fits_xml(self):
-        return True
 
-    @property
-    def namespace(self):
-        return ''
+XmlSitemapIndex.child = NestedXmlSitemapIndex
 
-    def _fitting_sitemap_iterator(self):
-        zipped = GzipFile(filename=self.filename, mode='rb')
-        new_filename = self.update_filename()
-        with open(new_filename, 'w') as new_file:
-            new_file.write(zipped.read().decode('utf-8'))
-        os.remove(self.filename)
-        for link in iter(self._next_sitemap_iterator(download=False,
-                                                     filename=new_filename)):
-            yield link
+
+class GunZip(XmlSitemapIndex):
+    """
+    Parses gunzipped (.gz) XML sitmaps.
+
+    The downloaded file is not decompressed to disk: SitemapParser reads it
+    while it is decompressed (see webpage.open_file).
+    """
+    pass
 
 
 class Html(SitemapMixin, webpage.Links):
@@ -352,5 +868,5 @@ class Txt(webpage.WebpageRaw):
     visited = []
 
     def parse(self, *args, **kwargs):
-        self.links = [y for x in self.html.split('\n') for y in x.split('\r')
-                     if validate.url_explicit(y)]
+        self.links = validate.url_filter.filter_many(
+            y for x in self.html.split('\n') for y in x.split('\r'))
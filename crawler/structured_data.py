@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+Reads the schema.org NewsArticle data that news sites embed in their pages as
+<script type="application/ld+json">: headline, publication and modification
+date, author and often the full article body.
+"""
+__author__ = 'roelvdberg@gmail.com'
+
+import html
+import json
+
+from lxml import etree
+
+try:
+    from content import element_text
+except ImportError:
+    from crawler.content import element_text
+
+LD_JSON = 'application/ld+json'
+
+# schema.org types of (news) articles.
+ARTICLE_TYPES = {'Article', 'NewsArticle', 'AnalysisNewsArticle',
+                 'BackgroundNewsArticle', 'OpinionNewsArticle',
+                 'ReportageNewsArticle', 'ReviewNewsArticle', 'BlogPosting',
+                 'LiveBlogPosting'}
+
+# {name as used by Head and store_page: schema.org property}
+PROPERTIES = (
+    ('title', 'headline'),
+    ('published_time', 'datePublished'),
+    ('modified_time', 'dateModified'),
+    ('author', 'author'),
+    ('description', 'description'),
+    ('body', 'articleBody'),
+)
+
+
+def articles(data):
+    """
+    Iterates over the article objects in the JSON-LD data, also when they are
+    in a list, an @graph or the mainEntity of a WebPage.
+    """
+    if isinstance(data, list):
+        for item in data:
+            yield from articles(item)
+        return
+    if not isinstance(data, dict):
+        return
+    types = data.get('@type', ())
+    if isinstance(types, str):
+        types = (types,)
+    if ARTICLE_TYPES.intersection(types):
+        yield data
+    for key in ('@graph', 'mainEntity'):
+        if key in data:
+            yield from articles(data[key])
+
+
+def text(value):
+    """
+    Returns a property value as text: the name of a Person or Organization,
+    the names in a list joined by commas, and the text of html.
+    """
+    if isinstance(value, list):
+        return ', '.join(filter(None, (text(item) for item in value)))
+    if isinstance(value, dict):
+        value = value.get('name')
+    if not isinstance(value, str):
+        return None
+    value = html.unescape(value).strip()
+    if '<' in value:
+        tree = etree.HTML(value)
+        if tree is None:
+            return None
+        value = element_text(tree).strip()
+    return value or None
+
+
+def paragraphs(body):
+    """
+    Returns the non-empty paragraphs of an articleBody, which may be text with
+    a paragraph per line or html.
+    """
+    if '<' in body:
+        tree = etree.HTML(body)
+        if tree is None:
+            return []
+        found = [element_text(p) for p in tree.iter('p')] or \
+            [element_text(tree)]
+    else:
+        found = html.unescape(body).split('\n')
+    return [paragraph.strip() for paragraph in found if paragraph.strip()]
+
+
+def news_article(tree):
+    """
+    Returns the article data of the JSON-LD blocks in tree:
+    {'title': ..., 'published_time': ..., 'modified_time': ...,
+     'author': ..., 'description': ..., 'body': [paragraph, ...]}
+
+    Dates are returned as found, as are those in the head. When a page holds
+    more than one article, e.g. teasers of related articles, the first one is
+    used. Blocks that are no valid JSON are skipped.
+
+    :param tree: lxml element tree of the page.
+    :return: dictionary with the values that were found, empty when the page
+        has no article data.
+    """
+    for script in tree.iter('script'):
+        if script.get('type', '').strip().lower() != LD_JSON or \
+                not script.text:
+            continue
+        try:
+            # strict=False: some sites put raw newlines in articleBody
+            data = json.loads(script.text, strict=False)
+        except ValueError:
+            continue
+        for article in articles(data):
+            values = {}
+            for name, property_ in PROPERTIES:
+                if name == 'body':
+                    body = article.get(property_)
+                    body = paragraphs(body) if isinstance(body, str) else []
+                    if body:
+                        values[name] = body
+                    continue
+                value = text(article.get(property_))
+                if value:
+                    values[name] = value
+            return values
+    return {}
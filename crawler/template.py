@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+"""
+Extraction templates learned per host: XPath expressions for the article
+body, title, publication date and author of the pages of a site.
+"""
+__author__ = 'roelvdberg@gmail.com'
+
+from datetime import datetime as dt
+import threading
+
+from lxml import etree
+
+try:
+    from content import element_text
+    import model
+    from settings import TEMPLATE_LEARN_PAGES, TEMPLATE_MIN_HIT_RATE, \
+        TEMPLATE_WINDOW
+except ImportError:
+    from crawler.content import element_text
+    import crawler.model as model
+    from crawler.settings import TEMPLATE_LEARN_PAGES, \
+        TEMPLATE_MIN_HIT_RATE, TEMPLATE_WINDOW
+
+# Candidates for the publication date of an article.
+DATES = etree.XPath('descendant-or-self::time[@datetime]')
+
+# Attributes that mark the author of an article, e.g. rel="author",
+# itemprop="author" or class="byline". They are tested while the tree is
+# searched, so that only those that match are returned rather than the
+# attributes of every element of the page.
+AUTHOR_ATTRIBUTES = etree.XPath(
+    'descendant-or-self::*/@*[name()="class" or name()="rel" or '
+    'name()="itemprop"][re:test(., $names, "i")]',
+    namespaces={'re': 'http://exslt.org/regular-expressions'})
+AUTHOR_NAMES = 'author|byline'
+
+
+def element_xpath(element):
+    """
+    Returns an XPath expression that selects element in pages of the same
+    site: by its id or class when that selects only element and looks the
+    same on every page (it holds no digits), or else by its position.
+
+    :param element: lxml element.
+    """
+    tree = element.getroottree()
+    for attribute in ('id', 'class'):
+        value = element.get(attribute)
+        if not value or '"' in value or any(c.isdigit() for c in value):
+            continue
+        expression = '//{}[@{}="{}"]'.format(element.tag, attribute, value)
+        if len(tree.xpath(expression)) == 1:
+            return expression
+    return tree.getpath(element)
+
+
+class Template(object):
+    """
+    Compiled XPath expressions for the body, title, date and author of the
+    pages of a host. The compiled expressions are reused for every page of
+    the host.
+    """
+    fields = ('body', 'title', 'date', 'author')
+
+    def __init__(self, body, title=None, date=None, author=None):
+        """
+        :param body: expression for the element(s) with the article body.
+        :param title: (optional) expression for the element with the title.
+        :param date: (optional) expression for the publication date, an
+            attribute or an element.
+        :param author: (optional) expression for the element with the author.
+        """
+        self.expressions = dict(body=body, title=title, date=date,
+                                author=author)
+        self.xpaths = {field: etree.XPath(expression) for field, expression
+                       in self.expressions.items() if expression}
+        self.pages = 0
+        self.hits = 0
+
+    def body(self, tree):
+        """
+        Returns the elements with the article body in tree.
+        """
+        return [element for element in self.xpaths['body'](tree)
+                if isinstance(element, etree._Element)]
+
+    def values(self, tree):
+        """
+        Returns the title, publication date and author found in tree:
+        {'title': ..., 'published_time': ..., 'author': ...}
+        """
+        values = {}
+        for field, name in (('title', 'title'), ('date', 'published_time'),
+                            ('author', 'author')):
+            try:
+                result = self.xpaths[field](tree)
+            except KeyError:
+                continue
+            for value in result:
+                if isinstance(value, etree._Element):
+                    value = element_text(value)
+                value = str(value).strip()
+                if value:
+                    values[name] = value
+                    break
+        return values
+
+    def __eq__(self, other):
+        return isinstance(other, Template) and \
+            self.expressions == other.expressions
+
+    def __repr__(self):
+        return 'Template({})'.format(', '.join(
+            '{}={!r}'.format(field, self.expressions[field])
+            for field in self.fields))
+
+    @classmethod
+    def learn(cls, tree, main, skip=()):
+        """
+        Returns the template that describes a page.
+
+        :param tree: element tree of the page.
+        :param main: block with the main content of the page (see
+            content.boilerplate) or None.
+        :param skip: elements that are boilerplate.
+        :return: Template or None when the page has no main content.
+        """
+        if main is None:
+            return None
+        title = next((element_xpath(h1) for h1 in tree.iter('h1')
+                      if h1 not in skip), None)
+        date = next((element_xpath(time) + '/@datetime'
+                     for time in DATES(tree)), None)
+        author = next((element_xpath(value.getparent())
+                       for value in AUTHOR_ATTRIBUTES(tree, names=AUTHOR_NAMES)
+                       if element_text(value.getparent()).strip()), None)
+        return cls(element_xpath(main), title, date, author)
+
+
+class TemplateStore(object):
+    """
+    Learns, caches and stores the template of each host (see model.Template).
+
+    A template is learned when the same one describes TEMPLATE_LEARN_PAGES
+    pages in a row. Of every TEMPLATE_WINDOW pages the share for which its
+    body expression finds content is counted; when that is below
+    TEMPLATE_MIN_HIT_RATE the template is forgotten and learned again.
+    """
+
+    def __init__(self, persistent=True, learn_pages=TEMPLATE_LEARN_PAGES,
+                 window=TEMPLATE_WINDOW, min_hit_rate=TEMPLATE_MIN_HIT_RATE):
+        """
+        :param persistent: When True templates are stored in the database and
+            loaded again on start. Default: True
+        :param learn_pages: see above. Default: TEMPLATE_LEARN_PAGES
+        :param window: see above. Default: TEMPLATE_WINDOW
+        :param min_hit_rate: see above. Default: TEMPLATE_MIN_HIT_RATE
+        """
+        self.lock = threading.RLock()
+        self.persistent = persistent
+        self.learn_pages = learn_pages
+        self.window = window
+        self.min_hit_rate = min_hit_rate
+        self.templates = None
+        # templates not learned yet: {host: (Template, number of pages)}
+        self.candidates = {}
+
+    def _session(self):
+        model.Template.__table__.create(model.engine, checkfirst=True)
+        return model.Session()
+
+    def _load(self):
+        if self.templates is not None:
+            return
+        self.templates = {}
+        if not self.persistent:
+            return
+        session = self._session()
+        try:
+            for record in session.query(model.Template):
+                self.templates[record.host] = Template(
+                    record.body, record.title, record.date, record.author)
+        finally:
+            session.close()
+
+    def _store(self, host, template):
+        if not self.persistent:
+            return
+        session = self._session()
+        try:
+            record = session.query(model.Template).filter_by(
+                host=host).first()
+            if template is None:
+                if record is not None:
+                    session.delete(record)
+            else:
+                if record is None:
+                    record = model.Template(host=host)
+                    session.add(record)
+                for field in Template.fields:
+                    setattr(record, field, template.expressions[field])
+                record.learned = dt.now()
+            session.commit()
+        finally:
+            session.close()
+
+    def get(self, host):
+        """
+        Returns the template of host or None when it is not known (yet).
+        """
+        with self.lock:
+            self._load()
+            return self.templates.get(host)
+
+    def learn(self, host, template):
+        """
+        Counts a page of host that template describes and stores it as the
+        template of host once it described learn_pages pages in a row.
+        """
+        if template is None:
+            return
+        with self.lock:
+            candidate, pages = self.candidates.get(host, (None, 0))
+            pages = pages + 1 if candidate == template else 1
+            if pages < self.learn_pages:
+                self.candidates[host] = template, pages
+                return
+            self.candidates.pop(host, None)
+            self._load()
+            self.templates[host] = template
+            self._store(host, template)
+
+    def hit(self, host, hit):
+        """
+        Counts a page of host for which its template did (hit is True) or did
+        not find content, and forgets the template when it misses too often.
+        """
+        with self.lock:
+            self._load()
+            template = self.templates.get(host)
+            if template is None:
+                return
+            template.pages += 1
+            template.hits += bool(hit)
+            if template.pages < self.window:
+                return
+            if template.hits < self.min_hit_rate * template.pages:
+                del self.templates[host]
+                self._store(host, None)
+            else:
+                template.pages = template.hits = 0
+
+
+# Shared by all pages, so that every page of a host adds to what is learned.
+templates = TemplateStore()
@@ -1,61 +1,207 @@
 # -*- coding: utf-8 -*-
 __author__ = 'roelvdberg@gmail.com'
 
+from functools import lru_cache
 import re
 import urllib.parse
 
 try:
-    from settings import NOFOLLOW
+    from settings import FOLLOW, NOFOLLOW, NOFOLLOW_EXTENSIONS, \
+        NOFOLLOW_PATHS, URL_FILTER_OVERRIDES
 except ImportError:
-    from crawler.settings import NOFOLLOW
+    from crawler.settings import FOLLOW, NOFOLLOW, NOFOLLOW_EXTENSIONS, \
+        NOFOLLOW_PATHS, URL_FILTER_OVERRIDES
 
 
-# Regex taken from Django:
-url_regex = re.compile(
-    r'^(?:http|ftp)s?://'  # http:// or https://
-    r'(?:(?:[A-Z0-9](?:[A-Z0-9-]{0,61}[A-Z0-9])?\.)+(?:[A-Z]{2,6}\.?|[A-Z0-9-]{2,}\.?)|'  # domain...
+# Regex taken from Django, split in the host, which is checked once per host
+# (see UrlFilter), and the parts of the url around it, which are cheap to
+# match. The path rules of a UrlFilter are put in the lookahead at {}.
+host_regex = re.compile(
+    r'(?:(?:[A-Z0-9](?:[A-Z0-9-]{0,61}[A-Z0-9])?\.)+'  # domain...
+    r'(?:[A-Z]{2,6}\.?|[A-Z0-9-]{2,}\.?)|'
     r'localhost|'  # localhost...
-    r'\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})'  # ...or ip
-    r'(?::\d+)?'  # optional port
-    r'(?:/?|[/?]\S+)$', re.IGNORECASE)
+    r'\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})$',  # ...or ip
+    re.IGNORECASE)
+URL_PARTS = r'(?i:(?:http|ftp)s?://)([^/?#:\s]+)(?::\d+)?(?:(?=({})))?' \
+            r'(?:[/?]\S*)?$'
+
+
+class HostTrie(object):
+    """
+    Maps host suffixes, e.g. 'last.fm' or 'nieuws.google.nl', to a value.
+    The labels of a host are looked up from its top level domain on, so that
+    the most specific suffix of a host gives its value.
+    """
+
+    def __init__(self, items=()):
+        """
+        :param items: iterable of (host suffix, value).
+        """
+        self.root = {}
+        for suffix, value in items:
+            self[suffix] = value
+
+    def __setitem__(self, suffix, value):
+        node = self.root
+        for label in reversed(suffix.lower().strip('.').split('.')):
+            node = node.setdefault(label, {})
+        node[None] = value
+
+    def get(self, host, default=None):
+        """
+        Returns the value of the most specific suffix of host, or default.
+        """
+        node = self.root
+        value = default
+        for label in reversed(host.split('.')):
+            node = node.get(label)
+            if node is None:
+                break
+            value = node.get(None, value)
+        return value
+
+
+class UrlFilter(object):
+    """
+    Tells whether a link is followed, on its host, path and extension:
+
+    - nofollow: hosts that are not followed. A name with a dot is a host
+      suffix ('last.fm' also denies 'www.last.fm'); a name without a dot
+      denies every host with that label ('google' denies 'www.google.nl').
+    - follow: host suffixes that are followed, although nofollow matches
+      them. The most specific suffix decides.
+    - nofollow_paths: regular expressions; links whose path and query match
+      one of them are not followed. They match anywhere in the path, or at
+      its start when they start with ^.
+    - nofollow_extensions: extensions of the last segment of the path that
+      are not followed, e.g. 'pdf'.
+    - overrides: {host suffix: {rule: value}} rules that replace the rules
+      above for links to that host.
+
+    The rules for a host, and whether it is a valid host, are looked up once
+    and cached. The path rules and extensions are compiled into one
+    alternation, which is part of the expression that splits the url: a url
+    is tested with one match and one lookup of its host.
+    """
+    rule_names = ('nofollow', 'follow', 'nofollow_paths',
+                  'nofollow_extensions')
+
+    def __init__(self, nofollow=(), follow=(), nofollow_paths=(),
+                 nofollow_extensions=(), overrides=None):
+        self.rules = dict(nofollow=list(nofollow), follow=list(follow),
+                          nofollow_paths=list(nofollow_paths),
+                          nofollow_extensions=list(nofollow_extensions))
+        names = [name.lower() for name in nofollow]
+        self.names = frozenset(name for name in names if '.' not in name)
+        self.hosts = HostTrie(
+            [(name, False) for name in names if '.' in name] +
+            [(name, True) for name in follow])
+        # matched from the start of the path: the path rules anywhere in it
+        # (as with re.search) unless they start with ^, the extensions at the
+        # end of the last segment of the path, before the query.
+        paths = [path[1:] if path.startswith('^') else
+                 '.*?(?:{})'.format(path) for path in nofollow_paths]
+        if nofollow_extensions:
+            paths.append(r'(?i:[^?#]*\.(?:{})/?(?:[?#]|$))'.format('|'.join(
+                re.escape(extension.lstrip('.'))
+                for extension in nofollow_extensions)))
+        paths = '|'.join('(?:{})'.format(path) for path in paths) or '(?!)'
+        self.paths = re.compile(paths)
+        self.url = re.compile(URL_PARTS.format(paths))
+        self.host_rules = lru_cache(maxsize=1 << 14)(self._host_rules)
+        self.overrides = HostTrie()
+        for host, rules in (overrides or {}).items():
+            self.override(host, **rules)
+
+    def override(self, host, **rules):
+        """
+        Replaces rules (see rule_names) for links to host and its subdomains.
+        """
+        self.overrides[host] = UrlFilter(**dict(self.rules, **rules))
+        self.host_rules.cache_clear()
+
+    def _host_rules(self, host):
+        """
+        Returns (filter, followed) for host: the UrlFilter with the path
+        rules for host and whether its links are followed at all. Links
+        without a host (relative links) are followed.
+        """
+        if host and not host_regex.match(host):
+            return self, False
+        host = host.lower().rstrip('.')
+        url_filter = self.overrides.get(host, self)
+        followed = url_filter.hosts.get(host)
+        if followed is None:
+            followed = url_filter.names.isdisjoint(host.split('.'))
+        return url_filter, followed
+
+    def allowed(self, host, path):
+        """
+        Returns True when the link to host with path (and query) is followed.
+        """
+        url_filter, followed = self.host_rules(host)
+        return followed and not url_filter.paths.match(path)
+
+    def __call__(self, url_):
+        """
+        Returns True when url_ is an absolute url (see host_regex and
+        URL_PARTS) that is followed.
+        """
+        match = self.url.match(url_)
+        if match is None:
+            return False
+        url_filter, followed = self.host_rules(match.group(1))
+        if url_filter is not self:
+            match = url_filter.url.match(url_)
+        return followed and match.group(2) is None
+
+    def filter_many(self, urls):
+        """
+        Returns the urls in urls that are followed, in order.
+        """
+        match = self.url.match
+        host_rules = self.host_rules
+        followed = []
+        for url_ in urls:
+            found = match(url_)
+            if found is None:
+                continue
+            url_filter, host_followed = host_rules(found.group(1))
+            if url_filter is not self:
+                found = url_filter.url.match(url_)
+            if host_followed and found.group(2) is None:
+                followed.append(url_)
+        return followed
+
+
+url_filter = UrlFilter(NOFOLLOW, FOLLOW, NOFOLLOW_PATHS, NOFOLLOW_EXTENSIONS,
+                       URL_FILTER_OVERRIDES)
 
 
 def url(url_):
     """
-    Validate urls based on simple rules.
-    - check for ms office types like .docx format
-    - if the url has a three-letter-extension this should be htm, com, org, edu
-      or gov
+    Validate urls based on the rules of url_filter, also when they are
+    relative: links to hosts in NOFOLLOW and to files with an extension in
+    NOFOLLOW_EXTENSIONS (e.g. .docx or .pdf) are not valid.
 
     :param url_: url to check
     :return: True if url is valid
     """
-    url_extensions = ["htm", "com", "org", "edu", "gov"]
-    url_ = url_.strip(r'/')
-    try:
-        docxtest = not (url_[-1] == 'x' and url_[-5] == ".")
-    except IndexError:
-        docxtest = True
-    try:
-        match = (url_[-3] in url_extensions or not url_[-4] == ".") \
-                and docxtest \
-                and not any(nofollowtxt in url_ for nofollowtxt in NOFOLLOW)
-    except IndexError:
-        return True
-    return match
+    parts = urllib.parse.urlsplit(url_)
+    return url_filter.allowed(parts.hostname or '', parts.path + (
+        '?' + parts.query if parts.query else ''))
 
 
 def url_explicit(url_):
     """
     Validate url based on regex and simple rules from url_validate.
 
-    See url_validate and url_regex for the chosen rules.
+    See url_filter for the chosen rules.
 
     :param url_: url to check
     :return: True if url is valid
     """
-    match = bool(url_regex.search(url_)) and url(url_)
-    return match
+    return url_filter(url_)
 
 
 import urllib.parse
@@ -69,8 +215,11 @@ def url_encode_non_ascii(b):
 
 def iri_to_uri(iri):
     parts = urllib.parse.urlparse(iri)
+    # the host and port are kept as they are: the colon before the port is
+    # not to be encoded
     return urllib.parse.urlunparse([
-        url_encode_non_ascii(part.encode('utf-8')) for part in parts
+        part if i == 1 else url_encode_non_ascii(part.encode('utf-8'))
+        for i, part in enumerate(parts)
     ])
 
 
@@ -1,7 +1,9 @@
 # -*- coding: utf-8 -*-
 
 from datetime import datetime as dt
-import dateutil.parser as dtparser
+from gzip import GzipFile
+from functools import partial
+from itertools import islice
 import os
 import threading
 import urllib.parse
@@ -10,23 +12,34 @@ import weakref
 
 from lxml import etree
 from sqlalchemy.orm.exc import NoResultFound
-import pybloom.pybloom
 
 try:
     import base as base_
+    from content import boilerplate, element_text, unknown_texts
+    from datetime_from_html import WebPageDateTime, parse_date
     import model
-    from settings import USER_AGENT_INFO, USER_AGENT
+    from settings import USER_AGENT_INFO, USER_AGENT, HEAD_CHUNK_SIZE, \
+        STORE_BATCH_SIZE
+    from structured_data import news_article
+    from template import Template, templates
     import validate
 except ImportError:
     import crawler.base as base_
+    from crawler.content import boilerplate, element_text, unknown_texts
+    from crawler.datetime_from_html import WebPageDateTime, parse_date
     import crawler.model as model
-    from crawler.settings import USER_AGENT_INFO, USER_AGENT
+    from crawler.settings import USER_AGENT_INFO, USER_AGENT, \
+        HEAD_CHUNK_SIZE, STORE_BATCH_SIZE
+    from crawler.structured_data import news_article
+    from crawler.template import Template, templates
     import crawler.validate as validate
 
 __author__ = 'roelvdberg@gmail.com'
 
 logger = base_.logger_setup(__name__)
 
+HEADING_TAGS = ('h1', 'h2', 'h3', 'h4', 'h5', 'h6')
+
 
 def stringify(string):
     """
@@ -48,6 +61,20 @@ def remove_file(filename):
         pass
 
 
+def open_file(filename):
+    """
+    Opens a file for reading in binary mode. Gzipped files are decompressed
+    while they are read.
+
+    :param filename: name of the file.
+    :return: file object.
+    """
+    fileobj = open(filename, 'rb')
+    if fileobj.peek(2)[:2] == b'\x1f\x8b':
+        return GzipFile(fileobj=fileobj, mode='rb')
+    return fileobj
+
+
 def file_iter(filename, tags, as_html=True):
     """
     fast_iter is useful if you need to free memory while iterating through a
@@ -63,7 +90,7 @@ def file_iter(filename, tags, as_html=True):
     """
     if not hasattr(tags, '__iter__'):
         tags = [tags]
-    with open(filename, 'rb') as fileobj:
+    with open_file(filename) as fileobj:
         context = etree.iterparse(fileobj, events=('end',), tag=tags,
                                   html=as_html)
         for event, elem in context:
@@ -71,12 +98,58 @@ def file_iter(filename, tags, as_html=True):
             # It's safe to call clear() here because no descendants will be
             # accessed
             elem.clear()
-            # Also eliminate now-empty references from the root node to elem
+            # Also eliminate now-empty references from the root node to elem,
+            # and to the ancestors of elem (e.g. finished <url> elements when
+            # iterating over <loc> elements)
             while elem.getprevious() is not None:
                 del elem.getparent()[0]
+            for ancestor in elem.iterancestors():
+                while ancestor.getprevious() is not None:
+                    del ancestor.getparent()[0]
         del context
 
 
+def head_iter(chunks, tags):
+    """
+    Iterates over the elements with the given tags in the head of an html
+    document, parsing only as much of the document as needed.
+
+    The document is fed to the parser chunk by chunk and parsing stops at the
+    end of the head or at the first element of the body, so that the cost
+    does not depend on the size of the page.
+
+    :param chunks: iterable of chunks (bytes or str) of the document.
+    :param tags: tags of the elements that are yielded.
+    :returns: elements with one of the given tags, after their end tag.
+    """
+    tags = set(tags)
+    parser = etree.HTMLPullParser(events=('start', 'end'))
+    for chunk in chunks:
+        parser.feed(chunk)
+        for event, elem in parser.read_events():
+            if event == 'start':
+                if elem.tag == 'body':
+                    return
+            elif elem.tag == 'head':
+                return
+            elif elem.tag in tags:
+                yield elem
+
+
+def read_chunks(fileobj, size=HEAD_CHUNK_SIZE):
+    """
+    Iterates over chunks of at most size bytes read from fileobj.
+    """
+    return iter(partial(fileobj.read, size), b'')
+
+
+def string_chunks(string, size=HEAD_CHUNK_SIZE):
+    """
+    Iterates over chunks of at most size characters of string.
+    """
+    return (string[i:i + size] for i in range(0, len(string), size))
+
+
 class WebpageError(Exception):
     pass
 
@@ -90,9 +163,11 @@ class Head(object):
         attribute in Head the found value is stored to.
     """
     location = "/html/head"
+    feed_types = ("application/rss+xml", "application/atom+xml")
     tags = {
         "title": "title",
         "base": "base",
+        "link": "feeds",
         "meta": (
             ("name", {
                 "keywords": "keywords",
@@ -114,17 +189,55 @@ class Head(object):
         )
     }
 
-    def __init__(self, html, from_disk=True, filename=""):
+    def __init__(self, html=None, from_disk=True, filename="", fileobj=None):
         """
-        Initialize root with htmltree at head location.
-
-        :param htmltree: lxml etree object of a webpage.
+        Initialize head for a webpage. Only the head of the page is parsed,
+        see head_iter.
+
+        :param html: html of the webpage, used when it is not read from disk.
+        :param from_disk: when True the webpage is read from filename.
+        :param filename: filename of the webpage saved to disk.
+        :param fileobj: (optional) file-like object the webpage is read from
+            instead, e.g. a http response.
         """
-        if from_disk and filename:
-            self.root = file_iter(filename, self.tags.keys(), as_html=True)
-        else:
-            self.root = ()
         self.html = html
+        self.filename = filename if from_disk else ""
+        self.fileobj = fileobj
+        self.feeds = []
+
+    @classmethod
+    def probe(cls, url, headers=None):
+        """
+        Fetches only the head of a webpage, e.g. to decide whether a page
+        should be revisited. The connection is closed as soon as the head has
+        been read.
+
+        :param url: url of the webpage.
+        :param headers: (optional) dictionary of request headers.
+        :returns: parsed Head, with the response headers of the webpage in
+            its response_headers attribute.
+        """
+        request_ = request.Request(
+            validate.iri_to_uri(url),
+            headers=headers or {'User-Agent': USER_AGENT})
+        with request.urlopen(request_) as response:
+            head = cls(fileobj=response)
+            head.parse()
+            head.response_headers = response.headers
+        return head
+
+    @property
+    def root(self):
+        """
+        Elements of the head with tags in self.tags.
+        """
+        if self.fileobj is not None:
+            yield from head_iter(read_chunks(self.fileobj), self.tags)
+        elif self.filename:
+            with open_file(self.filename) as fileobj:
+                yield from head_iter(read_chunks(fileobj), self.tags)
+        elif self.html:
+            yield from head_iter(string_chunks(self.html), self.tags)
 
     def parse(self):
         """
@@ -167,6 +280,9 @@ class Head(object):
         """
         key = element.tag
         skip_once = False
+        if key == "link":
+            self.search_feed(element)
+            return
         try:
             result = self.tags[key]
         except KeyError:
@@ -186,12 +302,37 @@ class Head(object):
             pass
         setattr(self, name, value)
 
+    def search_feed(self, element):
+        """
+        Adds the href of <link rel="alternate"> elements of RSS and Atom feeds
+        to self.feeds.
+
+        :param element: link element in root.
+        """
+        if element.get("rel", "").lower() == "alternate" and \
+                element.get("type", "").lower() in self.feed_types and \
+                element.get("href"):
+            self.feeds.append(element.get("href"))
+
 
 class WebpageRaw(object):
     robot_archive_options = ["noarchive", "nosnippet", "noindex"]
     head = True
     parser = etree.HTML
     as_html = True
+    # values known before fetching, e.g. from a news sitemap, used when they
+    # are missing in the head: {'published_time': ..., 'title': ...}
+    hints = {}
+    # values found in the page by the template of its host (see
+    # template.Template.values), used before hints.
+    extracted = {}
+    # values from the JSON-LD article data of the page (see
+    # structured_data.news_article), used before all others.
+    structured = {}
+    # when True a page that is saved to disk is parsed from its file once it
+    # is written, see base_tree. Sitemaps read their file while they are
+    # iterated instead.
+    parse_saved = True
 
     def __init__(self, url, html=None, base=None, database_lock=None,
                  encoding='utf-8', save_file=False, filename=None,
@@ -225,6 +366,7 @@ class WebpageRaw(object):
         self.encoding = encoding
         self.session = model.Session()
         self.save_to_disk = save_file
+        self.response_headers = {}
         self._finalizer = weakref.finalize(
             self, remove_file, self.filename if not persistent else "")
         self._iterator = iter(self.file_iter()) if save_file else iter(
@@ -252,34 +394,49 @@ class WebpageRaw(object):
             data, header = self.agent
             if url is None:
                 url = self.url
-
+            header.update(self.request_headers(url))
             url = validate.iri_to_uri(url)
             if self.save_to_disk:
                 with request.urlopen(request.Request(url, headers=header)) as\
                         response, open(self.filename, 'wb') as f:
+                    self.response_headers = response.headers
                     f.write(response.read())
                 logger.debug('Saving {} to disk. Parsing from disk'.format(
                              self.filename))
-                return
-            url = validate.iri_to_uri(url)
-            with request.urlopen(request.Request(url, headers=header)) \
-                    as response:
-                encoding = response.headers.get_content_charset()
-                if encoding:
-                    self.encoding = encoding
-                content = response.read()
-                self.html = content.decode(self.encoding).encode(
-                    'utf-8')
+                if not self.parse_saved:
+                    return
+            else:
+                with request.urlopen(request.Request(url, headers=header)) \
+                        as response:
+                    self.response_headers = response.headers
+                    encoding = response.headers.get_content_charset()
+                    if encoding:
+                        self.encoding = encoding
+                    content = response.read()
+                    self.html = content.decode(self.encoding).encode(
+                        'utf-8')
         elif not download and not self.html:
             return
         self.parse(*args, **kwargs)
 
+    def request_headers(self, url):
+        """
+        Overwrite in child classes to send extra headers when fetching url,
+        e.g. for conditional requests.
+
+        :param url: the url that is fetched.
+        :return: dictionary of {header: value}
+        """
+        return {}
+
     def parse(self, *args, **kwargs):
         pass
 
     def file_iter(self):
         has_attr = self.has_attributes
-        self.tag = [self.namespace + tag for tag in self.tag]
+        # tags that start with a namespace, e.g. '{http://...}title', are kept
+        self.tag = [tag if tag.startswith('{') else self.namespace + tag
+                    for tag in self.tag]
         for elem in file_iter(self.filename, self.tag, self.as_html):
             if has_attr:
                 yield {
@@ -387,9 +544,13 @@ class WebpageRaw(object):
             times = {"published_time": None, "modified_time": None,
                      "expiration_time": None}
             for time in times.keys():
-                timestr = self.find_in_head(time)
-                if timestr:
-                    times[time] = dtparser.parse(timestr, dayfirst=True)
+                for timestr in (self.find_in_head(time), self.hint(time)):
+                    if timestr:
+                        times[time] = parse_date(timestr)
+                    if times[time] is not None:
+                        break
+            if times['published_time'] is None:
+                times['published_time'] = self.time_in_page()
             if self.save_to_disk:
                 with open(self.filename, 'rb') as f:
                     content = f.read().decode(self.encoding)
@@ -404,9 +565,10 @@ class WebpageRaw(object):
                 published_time=times['published_time'],
                 modified_time=times["modified_time"],
                 expiration_time=times["expiration_time"],
-                title=self.find_in_head("title"),
-                description=self.find_in_head("description"),
-                author=self.find_in_head("author"),
+                title=self.find_in_head("title") or self.hint("title"),
+                description=self.find_in_head("description") or
+                self.hint("description"),
+                author=self.find_in_head("author") or self.hint("author"),
                 section=self.find_in_head("section"),
                 tag=self.find_in_head("article_tag"),
                 keywords=self.find_in_head("keywords")
@@ -417,6 +579,28 @@ class WebpageRaw(object):
             self.store_model(item=website)
             logger.debug('Webpage entry added: {}'.format(self.url))
 
+    def time_in_page(self):
+        """
+        Publication time found in the content of the page, used when it is not
+        in the head nor in the hints. Overwrite in child classes that parse
+        the page.
+
+        :return: datetime or None.
+        """
+        return None
+
+    def hint(self, attr):
+        """
+        Value for attr found in the JSON-LD data of the page
+        (self.structured), by the template of the host (self.extracted) or
+        known before fetching (self.hints).
+
+        :param attr: name of the value, e.g. 'title'.
+        :return: value or None when it is not known.
+        """
+        return self.structured.get(attr) or self.extracted.get(attr) or \
+            self.hints.get(attr)
+
     def find_in_head(self, attr):
         """
         Finds attribute in self.head.
@@ -429,6 +613,26 @@ class WebpageRaw(object):
         except:
             return None
 
+    @property
+    def base_tree(self):
+        """
+        Element tree of the page, parsed from self.html or, when the page was
+        saved to disk, from its file. It is parsed once and can be shared
+        with other objects that read the same page, see Links.
+        """
+        try:
+            return self._base_tree
+        except AttributeError:
+            pass
+        if self.html:
+            # through the class: lxml functions bind to the instance
+            self._base_tree = type(self).parser(self.html)
+        else:
+            parser = etree.HTMLParser() if self.as_html else etree.XMLParser()
+            with open_file(self.filename) as fileobj:
+                self._base_tree = etree.parse(fileobj, parser).getroot()
+        return self._base_tree
+
     @property
     def agent(self):
         """
@@ -467,7 +671,7 @@ class WebpageRaw(object):
     @property
     def namespace(self):
         try:
-            with open(self.filename, 'rb') as fileobj:
+            with open_file(self.filename) as fileobj:
                 context = etree.iterparse(fileobj, events=('end',))
                 namespace = next(context)[1].nsmap
                 # logger.debug('NAMESPACE: ' + str(namespace))
@@ -500,10 +704,20 @@ class Webpage(WebpageRaw):
         is matched by attribute values from the robots metadata attribute in
         the head-section of a website.
     :param parser: HTML or XML lxml parser (etree.XML or etree.HTML).
+    :param main_content: if True only elements in the main content of the
+        page are parsed, boilerplate such as navigation and footers is
+        skipped (see content.boilerplate).
+    :param paragraph_tags: tags in self.tag that are paragraphs of the main
+        content, e.g. not headings.
+    :param stream: if True the content is not stored as lists by parse, but
+        read from the page when it is iterated with records().
     """
     tag = ""
     name = []
     attr = []
+    main_content = False
+    paragraph_tags = []
+    stream = False
     split_content = True
     one_tag = False
     selector_string = None
@@ -552,6 +766,13 @@ class Webpage(WebpageRaw):
         This way only sections of a page are parsed (e.g. only elements that
         fall within a <div> tag pair).
 
+        When only the main content is parsed and the JSON-LD data of the page
+        holds the headline and the article body, those are stored and the
+        page is not walked at all.
+
+        When self.stream is True only the boilerplate of the page is found
+        here; its content is read by records().
+
         :param selector_string: for example ".//a" for a hyperlink.
         :param selector_method_name: either 'xpath' or 'cssselect'
         """
@@ -559,14 +780,195 @@ class Webpage(WebpageRaw):
         self.trees = [self.base_tree]
         if self.selector_string:
             self.trees = self._fetch_by_method()
-        for i, t in enumerate(self.tag):
-            content = [self._get_attr(y, i) for x in self.trees for y in
-                       x.iter() if y.tag == t]
-            logger.info(t + ' with name ' + self.name[i] + ' with number: ' +
-                         str(i) + ' and lenght: ' + str(len(content)))
-            self._set_content(i, t, content)
+        elif self.main_content:
+            self.structured = news_article(self.base_tree)
+        self.texts = {}
+        self.skip = ()
+        if self.main_content and not self.structured_content:
+            # the texts of a streamed page are only read by records()
+            self.skip = self._main_content(None if self.stream else
+                                           self.texts)
+        if not self.stream:
+            contents = self._structured_content() if \
+                self.structured_content else self._walk()
+            for i, t in enumerate(self.tag):
+                logger.info(t + ' with name ' +
+                            (self.name[i] if i < len(self.name) else t) +
+                            ' with number: ' + str(i) + ' and lenght: ' +
+                            str(len(contents[i])))
+                self._set_content(i, t, contents[i])
         self.parse_edit()
 
+    @property
+    def structured_content(self):
+        """
+        True when the JSON-LD data of the page holds its headline and body.
+        """
+        return 'body' in self.structured and 'title' in self.structured
+
+    def _elements(self):
+        """
+        Iterates over the elements with a tag in self.tag in self.trees, in
+        document order and without the boilerplate (self.skip).
+
+        :returns: (element, [(index in self.tag, attribute or None), ...])
+        """
+        # the trees are walked once; each element is dispatched on its tag to
+        # the indices in self.tag it belongs to.
+        dispatch = {}
+        for i, t in enumerate(self.tag):
+            if t:
+                dispatch.setdefault(t, []).append((i, self._attr_at(i)))
+        if not dispatch:
+            return
+        for tree in self.trees:
+            for element in tree.iter(*dispatch):
+                if element not in self.skip:
+                    yield element, dispatch[element.tag]
+
+    def _walk(self):
+        """
+        Returns the content found for each tag in self.tag in self.trees.
+        """
+        contents = [[] for _ in self.tag]
+        for element, indices in self._elements():
+            for i, attr in indices:
+                contents[i].append(
+                    element.get(attr, "") if attr else
+                    self.texts.get(element) or element_text(element))
+        return contents
+
+    def records(self):
+        """
+        Iterates over the text of the page in document order, without
+        keeping it: one (kind, heading_context, text) record for each
+        non-empty element with a tag in self.tag. kind is the tag, e.g. 'p'
+        or 'h2', heading_context a tuple with the text of the current h1 to
+        h6 (None for a level without a heading; for a heading it includes
+        itself) and text the stripped text of the element.
+
+        For a page whose JSON-LD data holds its body, the headline and the
+        paragraphs of that body are returned.
+        """
+        if self.structured_content:
+            items = [(self.paragraph_tags[0], paragraph)
+                     for paragraph in self.structured['body']]
+            if 'h1' in self.tag:
+                items.insert(0, ('h1', self.structured['title']))
+        else:
+            items = ((element.tag, self.texts.get(element) or
+                      element_text(element))
+                     for element, _ in self._elements())
+            if self.stream and self.main_content:
+                items = unknown_texts(items, self.base, self.url)
+        headings = [None] * len(HEADING_TAGS)
+        for kind, text in items:
+            text = text.strip()
+            if not text:
+                continue
+            if kind in HEADING_TAGS:
+                level = HEADING_TAGS.index(kind)
+                headings[level] = text
+                for lower in range(level + 1, len(headings)):
+                    headings[lower] = None
+            yield kind, tuple(headings), text
+
+    def store_records(self, batch_size=STORE_BATCH_SIZE):
+        """
+        Stores the records of the page (see records) as the headings and
+        paragraphs of its last webpage entry. They are read and committed
+        batch_size records at a time, so that the database objects of at
+        most one batch are held at once, and the database lock is released
+        in between.
+
+        :param batch_size: number of records stored at once. Default:
+            STORE_BATCH_SIZE
+        :return: number of records stored.
+        """
+        records = self.records()
+        webpage_id = self.last_webpage_entry.id
+        heading = None
+        stored = 0
+        while True:
+            batch = list(islice(records, batch_size))
+            if not batch:
+                break
+            with self.database_lock:
+                for kind, context, text in batch:
+                    if kind in HEADING_TAGS:
+                        heading = model.Heading(
+                            webpage_id=webpage_id,
+                            **dict(zip(HEADING_TAGS, context)))
+                        self.session.add(heading)
+                    else:
+                        # linked through the relationship, so that the batch
+                        # is inserted in one flush on commit
+                        self.session.add(model.Paragraph(
+                            paragraph=text, webpage_id=webpage_id,
+                            headings=heading))
+                self.session.commit()
+            stored += len(batch)
+        return stored
+
+    def _structured_content(self):
+        """
+        Returns the content for each tag in self.tag taken from the JSON-LD
+        data of the page: the paragraphs of the article body for the first
+        paragraph tag and the headline for h1.
+        """
+        contents = [[] for _ in self.tag]
+        for i, t in enumerate(self.tag):
+            if t == self.paragraph_tags[0]:
+                contents[i] = list(self.structured['body'])
+            elif t == 'h1':
+                contents[i] = [self.structured['title']]
+        return contents
+
+    def _main_content(self, texts):
+        """
+        Returns the boilerplate elements in self.trees (see
+        content.boilerplate).
+
+        When the template of the host of this page is known, only the body it
+        selects is parsed and the title, date and author it finds are stored
+        in self.extracted. Else the template of this page is learned (see
+        template.TemplateStore).
+
+        :param texts: dictionary that is filled with the text of elements,
+            or None when the page is streamed: then its texts are not kept
+            and those found on other pages of the host are left out by
+            records() (see content.unknown_texts).
+        """
+        known = texts is not None
+        if self.selector_string:
+            return boilerplate(self.trees, self.base, self.url, self.tag,
+                               self.paragraph_tags, texts, known=known)[0]
+        template = templates.get(self.base)
+        if template is not None:
+            body = template.body(self.base_tree)
+            templates.hit(self.base, body)
+            if body:
+                self.trees = body
+                self.extracted = template.values(self.base_tree)
+                return boilerplate(self.trees, self.base, self.url, self.tag,
+                                   self.paragraph_tags, texts, score=False,
+                                   known=known)[0]
+        skip, main = boilerplate(self.trees, self.base, self.url, self.tag,
+                                 self.paragraph_tags, texts, known=known)
+        if template is None:
+            templates.learn(self.base,
+                            Template.learn(self.base_tree, main, skip))
+        return skip
+
+    def time_in_page(self):
+        """
+        Publication time found in the page (see
+        datetime_from_html.WebPageDateTime).
+        """
+        if self.base_tree is None:
+            return None
+        return WebPageDateTime().parse(None, self.base_tree, host=self.base)
+
     def _set_content(self, i, tag, content):
         """
         Stores the tag content under the given name (self.name; see class
@@ -607,6 +1009,16 @@ class Webpage(WebpageRaw):
             self.selector_string)
         return selection
 
+    def _attr_at(self, i):
+        """
+        Returns the attribute name sought for tag index i or None when the
+        text of the element is sought.
+        """
+        try:
+            return self.attr[i] or None
+        except IndexError:
+            return None
+
     def _get_attr(self, element, i):
         """
         Try to get attribute value or text from element.
@@ -626,13 +1038,12 @@ class Webpage(WebpageRaw):
 
     def _textwalk(self, element):
         """
-        Get all text from element and all child elements recursively.
+        Get all text from element and all child elements.
 
         :param element: element to be parsed.
         :return: all text from element and underlying children
         """
-        children = [self._textwalk(x) + stringify(x.tail) for x in element]
-        return stringify(element.text) + "".join(children)
+        return element_text(element)
 
 
 class Text(Webpage):
@@ -641,115 +1052,89 @@ class Text(Webpage):
     """
     tag = "p"
     name = "text"
+    main_content = True
+    paragraph_tags = ['p']
+    stream = True
 
     def store(self):
         """
         Stores paragraphs and header metadata to database.
         """
-        with self.database_lock:
-            text = [x for x in [txt.strip(' \t\n\r')
-                                for txt in self.text] if x != ""]
-            logger.debug("storing {} paragraphs".format(len(text)))
-            self.store_page()
-            webpage = self.last_webpage_entry
-            for paragraph in text:
-                new_item = model.Paragraph(
-                    paragraph=paragraph,
-                )
-                webpage.paragraphs.append(new_item)
-            self.store_model(item=webpage)
-            logger.debug('Stored webpagetext for: ' + self.url)
+        self.store_page()
+        stored = self.store_records()
+        logger.debug('Stored {} paragraphs for: {}'.format(stored, self.url))
 
 
 class HeadingText(Webpage):
     paragraph_tags = ['p', 'li']
-    heading_tags = ['h1', 'h2', 'h3', 'h4', 'h5', 'h6']
+    heading_tags = list(HEADING_TAGS)
     tag = ['p', 'li', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6']
     name = ['p', 'li', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6']
     split_content = False
+    main_content = True
+    stream = True
 
     def store(self):
         """
-        Stores paragraphs, headings and header metadata to database.
+        Stores paragraphs, headings and header metadata to database. Each
+        paragraph belongs to the heading above it.
         """
-        with self.database_lock:
-            logger.debug(
-                "Storing {} paragraphs and headings for {}".format(
-                    sum([len(getattr(self, x, [])) for x in
-                        self.paragraph_tags]),
-                    self.url
-                )
-            )
-            self.store_page()
-            previous_headings = {h: None for h in self.heading_tags}
-            webpage = self.last_webpage_entry
-            first_heading = True
-            heading = None
-            for tag in self.paragraph_tags:
-                try:
-                    elements = getattr(self, tag)
-                except AttributeError:
-                    continue
-                for item in elements:
-                    item = item.strip(' \t\n\r')
-                    if item == "":
-                        continue
-                    if tag in self.paragraph_tags and not first_heading:
-                        new_paragraph = model.Paragraph(
-                            paragraph=item,
-                        )
-                        heading.paragraphs.append(new_paragraph)
-                        webpage.paragraphs.append(new_paragraph)
-                    else:
-                        if not first_heading:
-                            webpage.headings.append(heading)
-                        else:
-                            first_heading = False
-                        previous_headings[tag] = item
-                        heading = model.Heading(
-                            h1=previous_headings['h1'],
-                            h2=previous_headings['h2'],
-                            h3=previous_headings['h3'],
-                            h4=previous_headings['h4'],
-                            h5=previous_headings['h5'],
-                            h6=previous_headings['h6']
-                        )
-            self.store_model(item=webpage)
-            logger.debug('Stored paragraphs and headings for: ' + self.url)
+        self.store_page()
+        stored = self.store_records()
+        logger.debug('Stored {} paragraphs and headings for: {}'.format(
+            stored, self.url))
 
 
 class Links(Webpage):
     """
     Fetches content from webpage by url and returns its hyperlinks.
+
+    The links of a page that was already fetched and parsed are read from its
+    element tree when it is given as tree, e.g. Links(url, tree=page.base_tree,
+    download=False), so that the page is not parsed again.
     """
     tag = ["a", "a"]
     attr = ["href", "rel"]
     name = ["links", "robots"]
+    # the head is read by the page the links are taken from
+    head = False
 
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, tree=None, **kwargs):
+        """
+        :param tree: (optional) element tree of the page, see
+            WebpageRaw.base_tree.
+        """
+        self.tree = tree
+        if tree is not None:
+            self._base_tree = tree
         super().__init__(*args, **kwargs)
-        self.visited = pybloom.pybloom.BloomFilter(capacity=2000,
-                                                   error_rate=0.001)
 
     def file_iter(self):
-        robot_nofollow = self.robot_archive_options + ['nofollow']
-        self.tag = {self.namespace + tag for tag in self.tag}
-        for elem in file_iter(self.filename, self.tag, as_html=self.as_html):
-            link = elem.attrib.get('href')
-            robots = elem.attrib.get('robots')
-            if link and link not in self.visited and robots not in \
-                    robot_nofollow :
-                yield {'links': link}
-            self.visited.add(link)
-        del self.visited
-
+        if self.tree is not None:
+            elements = self.tree.iter('a')
+        else:
+            elements = file_iter(self.filename, {self.namespace + 'a'},
+                                 as_html=self.as_html)
+        yield from self._links((elem.get('href'), elem.get('rel'))
+                               for elem in elements)
 
     def memory_iter(self):
-        robot_nofollow = self.robot_archive_options + ['nofollow']
-        self.links = (link for i, link in enumerate(self.links) if validate.url(
-            link) and not self.robots[i] in robot_nofollow)
-        self.name = ["links"]
-        for link in self.links:
-            if link not in self.visited:
-                yield {'links': link}
-                self.visited.append(link)
+        yield from self._links(zip(self.links, self.robots))
+
+    def _links(self, pairs):
+        """
+        Iterates over the links of the page, each link once and without the
+        links with rel="nofollow" and the like.
+
+        :param pairs: iterable of (href, rel) for each link in the page.
+        :returns: {'links': href} for each link.
+        """
+        robot_nofollow = set(self.robot_archive_options + ['nofollow'])
+        visited = set()
+        for link, rel in pairs:
+            if not link or link in visited:
+                continue
+            visited.add(link)
+            if rel and robot_nofollow.intersection(rel.lower().split()):
+                continue
+            yield {'links': link}
@@ -0,0 +1,95 @@
+__author__ = 'roelvdberg@gmail.com'
+
+import http.server
+import socketserver
+import threading
+import time
+
+
+class _Server(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+
+class LocalServer(object):
+    """
+    HTTP server on localhost that serves files from memory, for tests that
+    fetch pages, sitemaps and feeds.
+
+    A file with an ETag header is answered with 304 Not Modified when a
+    request sends that ETag in If-None-Match. The path and headers of each
+    request are kept in requests, the most requests that were handled at
+    once in max_active.
+
+    Use as a context manager:
+
+        with LocalServer({'/sitemap.xml': (content, {})}) as server:
+            sitemap.Sitemap(url=server.url + '/sitemap.xml', ...)
+    """
+
+    def __init__(self, files=None, delay=0):
+        """
+        :param files: {path: (content as bytes, {header: value})}
+        :param delay: seconds each response is delayed.
+        """
+        self.files = dict(files or {})
+        self.delay = delay
+        self.requests = []
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+        local_server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                with local_server.lock:
+                    local_server.requests.append(
+                        (self.path, dict(self.headers)))
+                    local_server.active += 1
+                    local_server.max_active = max(local_server.max_active,
+                                                  local_server.active)
+                try:
+                    self.respond()
+                finally:
+                    with local_server.lock:
+                        local_server.active -= 1
+
+            def respond(self):
+                time.sleep(local_server.delay)
+                try:
+                    content, headers = local_server.files[self.path]
+                except KeyError:
+                    self.send_error(404)
+                    return
+                etag = headers.get('ETag')
+                if etag and self.headers.get('If-None-Match') == etag:
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header('Content-Length', str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = _Server(('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:{}'.format(self.server.server_port)
+
+    def paths(self):
+        """
+        Returns the paths that were requested, in order.
+        """
+        with self.lock:
+            return [path for path, _ in self.requests]
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,110 @@
+__author__ = 'roelvdberg@gmail.com'
+
+import unittest
+
+from lxml import etree
+
+try:
+    import content
+except ImportError:
+    import crawler.content as content
+
+PAGE = (
+    '<html><body>'
+    '<div id="cookie-notice"><p>Wij gebruiken cookies om de site te '
+    'verbeteren.</p></div>'
+    '<ul class="main-nav"><li><a href="/">Home</a></li>'
+    '<li><a href="/sport">Sport</a></li></ul>'
+    '<div class="article"><h1>{title}</h1>'
+    '<p>{text} Het kabinet wil de regels voor huurwoningen aanpassen.</p>'
+    '<p>Dat meldt de minister in een brief aan de Tweede Kamer.</p>'
+    '<p>Volg ons ook op social media en schrijf je in voor de nieuwsbrief.'
+    '</p>'
+    '<ul><li>Huren stijgen volgend jaar minder hard dan dit jaar.</li></ul>'
+    '</div>'
+    '<div><p><a href="/1">Eerder nieuws</a> en <a href="/2">meer</a></p>'
+    '<p>Losse paragraaf buiten het artikel, lang genoeg om mee te tellen.</p>'
+    '<a href="/3"><h3>Gerelateerd artikel</h3></a></div>'
+    '<footer><p>Copyright 2015</p></footer>'
+    '</body></html>'
+)
+
+
+class TestBoilerplate(unittest.TestCase):
+
+    def setUp(self):
+        self.fingerprints = content.fingerprints
+        content.fingerprints = content.Fingerprints(min_pages=3)
+
+    def tearDown(self):
+        content.fingerprints = self.fingerprints
+
+    def main_content(self, i, page=PAGE):
+        tree = etree.HTML(page.format(title='Artikel {}'.format(i),
+                                      text='Nummer {}.'.format(i)))
+        tags = ['p', 'li', 'h1', 'h3']
+        skip, main = content.boilerplate([tree], 'http://nos.nl',
+                                         'http://nos.nl/{}'.format(i), tags,
+                                         ['p', 'li'])
+        self.assertEqual('article', main.get('class'))
+        return [content.element_text(element) for element in
+                tree.iter(*tags) if element not in skip]
+
+    def test_main_content(self):
+        article = ['Artikel 0',
+                   'Nummer 0. Het kabinet wil de regels voor huurwoningen '
+                   'aanpassen.',
+                   'Dat meldt de minister in een brief aan de Tweede Kamer.',
+                   'Volg ons ook op social media en schrijf je in voor de '
+                   'nieuwsbrief.',
+                   'Huren stijgen volgend jaar minder hard dan dit jaar.']
+        self.assertEqual(article, self.main_content(0))
+        # crawling the same page again learns nothing new
+        self.assertEqual(article, self.main_content(0))
+        self.assertEqual(article, self.main_content(0))
+
+    def test_page_wrappers(self):
+        # class names of the body and of the elements around the main
+        # element describe the whole page
+        article = self.main_content(0)
+        for page in (
+                PAGE.replace('<body>',
+                             '<body class="page has-sidebar menu-open">'),
+                PAGE.replace('<body>', '<body><div class="cookie-consent">'
+                             '<main>').replace('<footer>',
+                                               '</main></div><footer>'),
+                PAGE.replace('<body>', '<body><div id="page-wrapper" '
+                             'class="with-sidebar"><div role="main">')
+                .replace('<footer>', '</div><aside class="sidebar"><p>'
+                         'Meest gelezen artikelen van deze week op de '
+                         'site.</p></aside></div><footer>')):
+            self.assertEqual(article, self.main_content(0, page))
+
+    def test_learned_boilerplate(self):
+        self.main_content(0)
+        self.main_content(1)
+        # text repeated on the third page of the host is boilerplate
+        self.assertEqual(['Artikel 2',
+                          'Nummer 2. Het kabinet wil de regels voor '
+                          'huurwoningen aanpassen.'], self.main_content(2))
+
+    def test_unknown_texts(self):
+        # a streamed page keeps no texts: the learned boilerplate is left out
+        # while they are read, a few at a time
+        for i, expected in ((0, 5), (1, 5), (2, 2)):
+            tree = etree.HTML(PAGE.format(title='Artikel {}'.format(i),
+                                          text='Nummer {}.'.format(i)))
+            tags = ['p', 'li', 'h1', 'h3']
+            skip, main = content.boilerplate(
+                [tree], 'http://nos.nl', 'http://nos.nl/{}'.format(i), tags,
+                ['p', 'li'], known=False)
+            self.assertEqual('article', main.get('class'))
+            items = ((element.tag, content.element_text(element))
+                     for element in tree.iter(*tags) if element not in skip)
+            self.assertEqual(expected, len(list(content.unknown_texts(
+                items, 'http://nos.nl', 'http://nos.nl/{}'.format(i),
+                batch_size=2))))
+
+
+if __name__ == '__main__':
+    unittest.main()
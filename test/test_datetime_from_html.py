@@ -0,0 +1,139 @@
+__author__ = 'roelvdberg@gmail.com'
+
+from datetime import datetime as dt, timedelta, timezone
+import unittest
+
+try:
+    from datetime_from_html import WebPageDateTime, find_datetime, parse_date
+except ImportError:
+    from crawler.datetime_from_html import WebPageDateTime, find_datetime, \
+        parse_date
+
+CET = timezone(timedelta(hours=1))
+
+# Date strings as found in heads, sitemaps and pages of Dutch news sites,
+# with the datetime they stand for.
+CORPUS = (
+    # ISO 8601
+    ('2016-03-03', dt(2016, 3, 3)),
+    ('2016-3-3', dt(2016, 3, 3)),
+    ('2016-03-03T14:05', dt(2016, 3, 3, 14, 5)),
+    ('2016-03-03T14:05:07', dt(2016, 3, 3, 14, 5, 7)),
+    ('2016-03-03 14:05:07', dt(2016, 3, 3, 14, 5, 7)),
+    ('2016-03-03T14:05:07.25Z',
+     dt(2016, 3, 3, 14, 5, 7, 250000, timezone.utc)),
+    ('2016-03-03T14:05:07+01:00', dt(2016, 3, 3, 14, 5, 7, 0, CET)),
+    ('2016-03-03T14:05:07+0100', dt(2016, 3, 3, 14, 5, 7, 0, CET)),
+    ('2016-03-03T14:05:07.123456789+01',
+     dt(2016, 3, 3, 14, 5, 7, 123456, CET)),
+    ('2016-03-03T13:05:07-0000', dt(2016, 3, 3, 13, 5, 7, 0, timezone.utc)),
+    (' 2016-10-05T09:00:00Z ', dt(2016, 10, 5, 9, 0, 0, 0, timezone.utc)),
+    # day first
+    ('03-03-2016', dt(2016, 3, 3)),
+    ('5-10-2016', dt(2016, 10, 5)),
+    ('05/10/2016', dt(2016, 10, 5)),
+    ('05.10.2016', dt(2016, 10, 5)),
+    ('03-03-2016 14:05', dt(2016, 3, 3, 14, 5)),
+    ('03-03-2016, 14:05', dt(2016, 3, 3, 14, 5)),
+    ('03-03-2016 | 14:05', dt(2016, 3, 3, 14, 5)),
+    ('03-03-2016 - 14:05:30', dt(2016, 3, 3, 14, 5, 30)),
+    ('3/3/2016 om 14.05', dt(2016, 3, 3, 14, 5)),
+    ('03-03-2016 14:05 uur', dt(2016, 3, 3, 14, 5)),
+    # Dutch
+    ('3 mrt 2016', dt(2016, 3, 3)),
+    ('3 mrt. 2016 14:05', dt(2016, 3, 3, 14, 5)),
+    ('3 maart 2016, 14:05', dt(2016, 3, 3, 14, 5)),
+    ('03 Maart 2016 om 14.05 uur', dt(2016, 3, 3, 14, 5)),
+    ('donderdag 3 maart 2016', dt(2016, 3, 3)),
+    ('Do 3 Mrt. 2016 14:05', dt(2016, 3, 3, 14, 5)),
+    ('zondag 18 oktober 2015, 10:00 uur', dt(2015, 10, 18, 10)),
+    ('1 jan 2016', dt(2016, 1, 1)),
+    ('14 februari 2016', dt(2016, 2, 14)),
+    ('1 apr 2016', dt(2016, 4, 1)),
+    ('5 mei 2016', dt(2016, 5, 5)),
+    ('30 jun 2016', dt(2016, 6, 30)),
+    ('21 juli 2016', dt(2016, 7, 21)),
+    ('15 aug. 2016', dt(2016, 8, 15)),
+    ('3 sept 2016', dt(2016, 9, 3)),
+    ('3 september 2016', dt(2016, 9, 3)),
+    ('11 nov 2016', dt(2016, 11, 11)),
+    ('31 december 2016 23:59', dt(2016, 12, 31, 23, 59)),
+    # left to dateutil
+    ('Thu, 03 Mar 2016 14:05:00 +0100', dt(2016, 3, 3, 14, 5, 0, 0, CET)),
+    ('March 3, 2016', dt(2016, 3, 3)),
+    # no dates
+    ('31-02-2016', None),
+    ('30 februari 2016', None),
+    ('2016-13-01', None),
+    ('3 mrt', None),
+    ('gisteren', None),
+    ('', None),
+)
+
+PAGE = (
+    '<html><head><script>var build = "01-01-2000 10:00";</script></head>'
+    '<body><div class="meta">Door de redactie | <span>{}</span></div>'
+    '<p>Vanaf 1-1-2016 gelden er nieuwe regels.</p></body></html>'
+)
+
+
+class TestParseDate(unittest.TestCase):
+
+    def test_corpus(self):
+        for string, expected in CORPUS:
+            date = parse_date(string)
+            self.assertEqual(expected, date, string)
+            if expected is not None:
+                self.assertEqual(expected.utcoffset(), date.utcoffset(),
+                                 string)
+
+
+class TestFindDatetime(unittest.TestCase):
+
+    def test_find_datetime(self):
+        for string, expected in (
+                ('2015-10-18T10:00:00+02:00', dt(2015, 10, 18, 10)),
+                ('Gepubliceerd: 18-10-2015 om 14:05', dt(2015, 10, 18, 14, 5)),
+                ('18/10/2015, 9.30 uur', dt(2015, 10, 18, 9, 30)),
+                ('5.3.2016', dt(2016, 3, 5)),
+                ('Bijgewerkt: 3 mrt. 2016 om 14:05 door de redactie',
+                 dt(2016, 3, 3, 14, 5)),
+                ('31-02-2015 of 01-03-2015', dt(2015, 3, 1)),
+                ('bel 06-12-345678', None),
+                ('versie 2.0.1', None)):
+            self.assertEqual(expected, find_datetime(string))
+
+
+class TestWebPageDateTime(unittest.TestCase):
+
+    def setUp(self):
+        WebPageDateTime.date_xpaths.clear()
+
+    def tearDown(self):
+        WebPageDateTime.date_xpaths.clear()
+
+    def test_parse(self):
+        finder = WebPageDateTime()
+        self.assertEqual(dt(2015, 10, 18, 14, 5), finder.parse(
+            PAGE.format('18-10-2015 14:05')))
+        self.assertEqual(dt(2015, 10, 18, 10), finder.parse(
+            '<p><time datetime="2015-10-18T10:00">gisteren</time></p>'))
+        self.assertIsNone(finder.parse('<p>Geen datum</p>'))
+
+    def test_cached_xpath(self):
+        finder = WebPageDateTime()
+        finder.parse(PAGE.format('18-10-2015 14:05'), host='http://nos.nl')
+        xpath = WebPageDateTime.date_xpaths['http://nos.nl']
+        self.assertEqual('/html/body/div/span', xpath.path)
+        self.assertEqual(dt(2015, 10, 19, 8, 0), finder.parse(
+            PAGE.format('19-10-2015 08:00'), host='http://nos.nl'))
+        self.assertIs(xpath, finder.xpath)
+        # not found at the cached location: the page is scanned again
+        self.assertEqual(dt(2016, 1, 1), finder.parse(
+            PAGE.format('gisteren'), host='http://nos.nl'))
+        self.assertEqual('/html/body/p',
+                         WebPageDateTime.date_xpaths['http://nos.nl'].path)
+
+
+if __name__ == '__main__':
+    unittest.main()
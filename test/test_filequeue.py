@@ -0,0 +1,267 @@
+__author__ = 'roelvdberg@gmail.com'
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+try:
+    import filequeue
+    from filequeue import FileQueue, FileQueueError, HybridQueue, Empty, \
+        encode, decode
+except ImportError:
+    import crawler.filequeue as filequeue
+    from crawler.filequeue import FileQueue, FileQueueError, HybridQueue, \
+        Empty, encode, decode
+
+
+class TestFileQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def queue(self, pickled=True, persistent=False):
+        return FileQueue(directory=self.directory, name='test',
+                         persistent=persistent, overwrite=True,
+                         pickled=pickled)
+
+    def test_fifo(self):
+        for pickled, items in ((True, [('a', 0), ('b', 1), ('c', 2)]),
+                               (False, ['a', 'b', 'c'])):
+            q = self.queue(pickled=pickled)
+            q.put(items[0])
+            q.put(items[1])
+            self.assertEqual(items[0], q.get())
+            q.put(items[2])
+            self.assertEqual(items[1:], [q.get(), q.get()])
+            self.assertRaises(Empty, q.get)
+            q.remove()
+
+    def test_put_get_many(self):
+        q = FileQueue(directory=self.directory, name='test', overwrite=True,
+                      pickled=False, segment_size=20)
+        q.put_many(str(i) for i in range(10))
+        q.put('10')
+        self.assertEqual(11, q.qsize())
+        self.assertEqual(['0', '1', '2', '3'], q.get_many(4))
+        self.assertEqual([str(i) for i in range(4, 11)], q.get_many(100))
+        self.assertRaises(Empty, q.get_many, 1)
+        q.remove()
+
+    def test_blocking_get(self):
+        for q in (self.queue(),
+                  HybridQueue(directory=self.directory, max_items=1)):
+            self.assertRaises(Empty, q.get, block=True, timeout=0.01)
+            # putting is still allowed after the queue ran empty
+            timer = threading.Timer(0.05, q.put_many, args=(['a', 'b'],))
+            timer.start()
+            self.assertEqual(['a', 'b'], q.get_many(2, block=True, timeout=5))
+            timer.join()
+            q.remove()
+
+    def test_codec(self):
+        for item in ['', 'nieuws', ('http://nos.nl', 0), (('a', None), -2),
+                     2 ** 70, {'links': 'http://nos.nl'}]:
+            self.assertEqual(item, decode(encode(item)))
+        self.assertRaises(FileQueueError, encode, {}, False)
+
+    def test_compress(self):
+        q = FileQueue(directory=self.directory, name='test', overwrite=True,
+                      segment_size=100, compress=True)
+        q.put_many(('http://www.nu.nl', i) for i in range(50))
+        self.assertTrue(any(name.endswith('.z')
+                            for name in os.listdir(self.directory)))
+        self.assertEqual([('http://www.nu.nl', i) for i in range(50)],
+                         q.get_many(50))
+        q.remove()
+        self.assertEqual([], os.listdir(self.directory))
+
+    def test_reopen_persistent(self):
+        q = self.queue(pickled=False, persistent=True)
+        for i in range(10):
+            q.put(str(i))
+        self.assertEqual(['0', '1', '2'], [q.get() for _ in range(3)])
+        q.put('10')
+        q.remove()
+        del q
+        q = self.queue(pickled=False, persistent=True)
+        self.assertEqual(8, q.qsize())
+        self.assertEqual([str(i) for i in range(3, 11)],
+                         [q.get() for _ in range(8)])
+        self.assertTrue(q.empty())
+
+    def test_reopen_legacy_files(self):
+        # older versions stored a get, put and pos file; the pos file held
+        # the number of items read from the get file.
+        with open(os.path.join(self.directory, 'get_thread_test_0.queue'),
+                  'w') as f:
+            f.write('0\n1\n2\n3\n')
+        with open(os.path.join(self.directory, 'put_thread_test_0.queue'),
+                  'w') as f:
+            f.write('4\n')
+        with open(os.path.join(self.directory, 'pos_thread_test_0.queue'),
+                  'w') as f:
+            f.write('1')
+        q = self.queue(pickled=False, persistent=True)
+        self.assertEqual(4, q.qsize())
+        self.assertEqual(['1', '2', '3', '4'], [q.get() for _ in range(4)])
+        q.remove()
+
+    def test_segments(self):
+        q = FileQueue(directory=self.directory, name='test', overwrite=True,
+                      segment_size=20)
+        for i in range(20):
+            q.put(i)
+        segments = len(os.listdir(self.directory))
+        self.assertTrue(segments > 3)
+        self.assertEqual(list(range(10)), [q.get() for _ in range(10)])
+        self.assertTrue(len(os.listdir(self.directory)) < segments)
+        q.compact()
+        q.put(20)
+        self.assertEqual(list(range(10, 21)), [q.get() for _ in range(11)])
+        self.assertRaises(Empty, q.get)
+        q.remove()
+        self.assertEqual([], os.listdir(self.directory))
+
+    def test_interrupted_compact(self):
+        def reopen():
+            return FileQueue(directory=self.directory, name='test',
+                             persistent=True, overwrite=True, pickled=False,
+                             segment_size=20)
+
+        # a crash while the read position is stored
+        q = reopen()
+        q.put_many(str(i) for i in range(10))
+        self.assertEqual(['0', '1'], q.get_many(2))
+        with mock.patch.object(q.fq, '_update_pos',
+                               side_effect=OSError('crash')):
+            self.assertRaises(OSError, q.compact)
+        q.remove()
+        del q
+        q = reopen()
+        self.assertEqual(['2', '3'], q.get_many(2))
+        # a crash after the read position was stored, before the compacted
+        # segment replaced the segment
+        with mock.patch.object(filequeue.os, 'replace',
+                               side_effect=OSError('crash')):
+            self.assertRaises(OSError, q.compact)
+        q.remove()
+        del q
+        q = reopen()
+        self.assertEqual([str(i) for i in range(4, 10)], q.get_many(10))
+        # a crash while the compacted segment was written
+        q.put_many(str(i) for i in range(10, 20))
+        self.assertEqual(['10', '11'], q.get_many(2))
+        name = q.fq.segment_name(q.fq.head)
+        with open(name + '.compact', 'wb') as f:
+            f.write(b'\x00')
+        q.remove()
+        del q
+        q = reopen()
+        self.assertFalse(os.path.exists(name + '.compact'))
+        self.assertEqual([str(i) for i in range(12, 20)], q.get_many(10))
+        q.remove()
+
+    def test_crash(self):
+        def reopen():
+            return FileQueue(directory=self.directory, name='test',
+                             persistent=True, overwrite=True, pickled=False,
+                             segment_size=20)
+
+        def crash(q):
+            # the queue is not closed, so its pos file is not written
+            q._finalizer.detach()
+            q.fq._unmap()
+
+        # the pos file is not written for each put and get: the items read
+        # since it was written are read again, the items put are kept
+        q = reopen()
+        q.put_many(str(i) for i in range(5))
+        self.assertEqual(['0', '1'], q.get_many(2))
+        q.put_many(str(i) for i in range(5, 10))
+        crash(q)
+        q = reopen()
+        self.assertEqual(10, len(q))
+        self.assertEqual(['0', '1', '2'], q.get_many(3))
+        # a segment read completely after the pos file was written is gone:
+        # reading starts again at the next segment
+        self.assertEqual(['3', '4', '5', '6'], q.get_many(4))
+        crash(q)
+        q = reopen()
+        self.assertEqual(6, len(q))
+        self.assertEqual([str(i) for i in range(4, 10)], q.get_many(10))
+        q.remove()
+        # with a pos file written for each put and get nothing is read again
+        with mock.patch.object(filequeue, 'POS_SYNC_OPERATIONS', 1):
+            q = reopen()
+            q.put_many(str(i) for i in range(10))
+            self.assertEqual(['0', '1', '2'], q.get_many(3))
+            crash(q)
+        q = reopen()
+        self.assertEqual(7, len(q))
+        self.assertEqual([str(i) for i in range(3, 10)], q.get_many(10))
+        q.remove()
+
+
+class TestHybridQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def queue(self):
+        return HybridQueue(directory=self.directory, name='test',
+                           persistent=True, overwrite=True, pickled=False,
+                           max_items=3)
+
+    def test_spill(self):
+        q = self.queue()
+        q.put_many(['0', '1', '2'])
+        self.assertFalse(q.on_disk)
+        self.assertEqual([], os.listdir(self.directory))
+        q.put_many(['3', '4'])
+        self.assertTrue(q.on_disk)
+        self.assertEqual(['0', '1'], q.get_many(2))
+        q.put('5')
+        self.assertEqual(['2', '3', '4', '5'], q.get_many(10))
+        self.assertRaises(Empty, q.get)
+        self.assertFalse(q.on_disk)
+        self.assertEqual([], os.listdir(self.directory))
+        q.put('6')
+        self.assertEqual('6', q.get())
+
+    def test_persistent(self):
+        q = self.queue()
+        q.put_many(['0', '1'])
+        q.remove()
+        del q
+        q = self.queue()
+        self.assertTrue(q.on_disk)
+        q.put('2')
+        self.assertEqual(['0', '1', '2'], q.get_many(3))
+        q.remove()
+        self.assertEqual([], os.listdir(self.directory))
+
+    def test_unnamed(self):
+        queues = [HybridQueue(directory=self.directory, persistent=True,
+                              overwrite=True, max_items=1)
+                  for _ in range(2)]
+        for i, q in enumerate(queues):
+            q.put_many([str(i)] * 3)
+            self.assertTrue(q.on_disk)
+        self.assertEqual(['0'] * 3, queues[0].get_many(10))
+        self.assertEqual(['1'] * 3, queues[1].get_many(10))
+        for q in queues:
+            q.remove()
+        self.assertEqual([], os.listdir(self.directory))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+__author__ = 'roelvdberg@gmail.com'
+
+import gc
+import os
+import shutil
+import tempfile
+import unittest
+import weakref
+
+try:
+    from filequeue import Empty
+    from frontier import Frontier
+except ImportError:
+    from crawler.filequeue import Empty
+    from crawler.frontier import Frontier
+
+
+class TestFrontier(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'frontier.sqlite3')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_host_queues(self):
+        frontier = Frontier(self.filename, max_items=2)
+        nu = frontier.queue('www.nu.nl')
+        nos = frontier.queue('nos.nl')
+        self.assertIs(nu, frontier.queue('www.nu.nl'))
+        self.assertFalse(frontier.has_content)
+        nu.put_many(['a', 'b', 'c', 'd'])
+        nos.put('e')
+        self.assertTrue(nu.on_disk)
+        self.assertFalse(nos.on_disk)
+        self.assertEqual(4, frontier.size('www.nu.nl'))
+        self.assertEqual({'www.nu.nl', 'nos.nl'},
+                         set(frontier.non_empty_hosts()))
+        self.assertEqual(['a', 'b', 'c'], nu.get_many(3))
+        self.assertEqual(['d'], nu.get_many(3))
+        self.assertRaises(Empty, nu.get)
+        self.assertEqual(['nos.nl'], list(frontier.non_empty_hosts()))
+        frontier.close()
+
+    def test_persistent(self):
+        frontier = Frontier(self.filename)
+        queue = frontier.queue('www.nu.nl')
+        queue.put_many([('a', 'b'), 'c'])
+        queue.remove()
+        frontier.close()
+        frontier = Frontier(self.filename)
+        self.assertEqual(['www.nu.nl'], list(frontier.non_empty_hosts()))
+        queue = frontier.queue('www.nu.nl')
+        self.assertTrue(queue.on_disk)
+        self.assertEqual([('a', 'b'), 'c'], queue.get_many(2))
+        frontier.close()
+
+    def test_garbage_collected(self):
+        frontier = Frontier(self.filename, max_items=2)
+        frontier.queue('www.nu.nl').put_many(['a', 'b', 'c', 'd'])
+        frontier.queue('nos.nl').put('e')
+        reference = weakref.ref(frontier)
+        del frontier
+        gc.collect()
+        # the frontier is closed when it is collected and the links held in
+        # memory are stored
+        self.assertIsNone(reference())
+        frontier = Frontier(self.filename)
+        self.assertEqual(['a', 'b', 'c', 'd'],
+                         frontier.queue('www.nu.nl').get_many(5))
+        self.assertEqual(['e'], frontier.queue('nos.nl').get_many(5))
+        frontier.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,446 @@
+__author__ = 'roelvdberg@gmail.com'
+
+from datetime import datetime as dt
+import gzip
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from sqlalchemy import create_engine
+
+try:
+    import model
+    import sitemap
+    import webpage
+except ImportError:
+    import crawler.model as model
+    import crawler.sitemap as sitemap
+    import crawler.webpage as webpage
+from test.local_server import LocalServer
+
+
+class TestLastmod(unittest.TestCase):
+
+    def test_parse_lastmod(self):
+        for lastmod, expected in (
+                ('2015-07-25', dt(2015, 7, 25)),
+                ('2015-07-25T18:10', dt(2015, 7, 25, 18, 10)),
+                ('2015-07-25T18:10:32Z', dt(2015, 7, 25, 18, 10, 32)),
+                ('2015-07-25T18:10:32.5+02:00', dt(2015, 7, 25, 16, 10, 32)),
+                ('2015-07-25T23:10:32-0100', dt(2015, 7, 26, 0, 10, 32)),
+                ('2015-13-25', None),
+                ('gisteren', None),
+                (None, None)):
+            self.assertEqual(expected, sitemap.parse_lastmod(lastmod))
+
+
+class TestSitemapParser(unittest.TestCase):
+
+    def parse(self, content, compress=False):
+        content = content.encode('utf-8')
+        if compress:
+            content = gzip.compress(content)
+        fd, filename = tempfile.mkstemp()
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(content)
+            parser = sitemap.SitemapParser(filename)
+            return parser.kind, parser.namespace, list(parser)
+        finally:
+            os.remove(filename)
+
+    def test_urlset(self):
+        content = (
+            '<?xml version="1.0"?>'
+            '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9" '
+            'xmlns:news="http://www.google.com/schemas/sitemap-news/0.9">'
+            '<url><loc> http://nos.nl/1 </loc><lastmod>2015-07-25</lastmod>'
+            '<changefreq>daily</changefreq></url>'
+            '<url><loc>http://nos.nl/2</loc><news:news><news:publication>'
+            '<news:name>NOS</news:name></news:publication>'
+            '<news:publication_date>2015-07-25T18:10:32+02:00'
+            '</news:publication_date><news:title>Twee</news:title>'
+            '</news:news></url>'
+            '<url><lastmod>2015-07-25</lastmod></url>'
+            '</urlset>')
+        namespace = '{http://www.sitemaps.org/schemas/sitemap/0.9}'
+        expected = ('urlset', namespace, [
+            ('http://nos.nl/1', '2015-07-25', 'daily', None),
+            ('http://nos.nl/2', None, None, {
+                'publication_date': '2015-07-25T18:10:32+02:00',
+                'title': 'Twee'})
+        ])
+        self.assertEqual(expected, self.parse(content))
+        self.assertEqual(expected, self.parse(content, compress=True))
+
+    def test_sitemapindex(self):
+        self.assertEqual(('sitemapindex', '', [
+            ('http://nos.nl/sitemap1.xml', None, None, None),
+            ('http://nos.nl/sitemap2.xml', '2015-07-25', None, None)
+        ]), self.parse(
+            '<sitemapindex>'
+            '<sitemap><loc>http://nos.nl/sitemap1.xml</loc></sitemap>'
+            '<sitemap><loc>http://nos.nl/sitemap2.xml</loc>'
+            '<lastmod>2015-07-25</lastmod></sitemap>'
+            '</sitemapindex>'))
+
+    def test_no_sitemap(self):
+        for content in ('<html><body><p>nieuws</p></body></html>',
+                        'User-agent: *'):
+            self.assertEqual((None, '', []), self.parse(content))
+
+
+class TestFeed(unittest.TestCase):
+
+    def feed_items(self, content):
+        fd, filename = tempfile.mkstemp()
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(content)
+            return list(sitemap.feed_iter(filename))
+        finally:
+            os.remove(filename)
+
+    def test_rss(self):
+        self.assertEqual([
+            {'links': 'http://nos.nl/1', 'title': 'Een',
+             'publication_date': '2015-10-18T08:00:00'},
+            {'links': 'http://nos.nl/2', 'title': 'Twee',
+             'publication_date': None}
+        ], self.feed_items(
+            '<?xml version="1.0"?><rss version="2.0"><channel>'
+            '<title>NOS</title><link>http://nos.nl</link>'
+            '<item><title>Een</title><link>http://nos.nl/1</link>'
+            '<pubDate>Sun, 18 Oct 2015 10:00:00 +0200</pubDate></item>'
+            '<item><title>Twee</title><link>http://nos.nl/2</link></item>'
+            '</channel></rss>'))
+
+    def test_atom(self):
+        self.assertEqual([
+            {'links': 'http://nu.nl/1', 'title': 'Een',
+             'publication_date': '2015-10-17T09:00:00Z'}
+        ], self.feed_items(
+            '<?xml version="1.0"?><feed xmlns="http://www.w3.org/2005/Atom">'
+            '<title>NU</title><link href="http://nu.nl"/>'
+            '<entry><title>Een</title><link rel="self" href="http://nu.nl/s"/>'
+            '<link href="http://nu.nl/1"/>'
+            '<updated>2015-10-18T09:00:00Z</updated>'
+            '<published>2015-10-17T09:00:00Z</published></entry></feed>'))
+
+
+def urlset(locs):
+    return (
+        '<?xml version="1.0"?>'
+        '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">{}'
+        '</urlset>'
+    ).format(''.join('<url><loc>{}</loc></url>'.format(loc)
+                     for loc in locs)).encode('utf-8')
+
+
+def sitemapindex(locs, lastmods=None):
+    lastmods = lastmods or {}
+    return (
+        '<?xml version="1.0"?>'
+        '<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">'
+        '{}</sitemapindex>'
+    ).format(''.join(
+        '<sitemap><loc>{}</loc>{}</sitemap>'.format(
+            loc, '<lastmod>{}</lastmod>'.format(lastmods[loc])
+            if loc in lastmods else '')
+        for loc in locs)).encode('utf-8')
+
+
+class SitemapTestCase(unittest.TestCase):
+    """
+    Stores the state of sitemaps in a database in a temporary directory.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        engine = create_engine('sqlite:///' + os.path.join(
+            self.directory, 'test.sqlite3'))
+        model.Base.metadata.create_all(engine)
+        model.Session.configure(bind=engine)
+        self.shared = sitemap.sitemap_state
+        sitemap.sitemap_state = sitemap.SitemapState()
+        sitemap.sitemap_state.created = True
+        self.shared_patterns = sitemap.sitemap_patterns
+        sitemap.sitemap_patterns = {}
+
+    def tearDown(self):
+        sitemap.sitemap_patterns = self.shared_patterns
+        sitemap.sitemap_state = self.shared
+        model.Session.configure(bind=model.engine)
+        shutil.rmtree(self.directory)
+
+    def filename(self, name='sitemap.data'):
+        return os.path.join(self.directory, name)
+
+    def index_files(self, server, children, urls):
+        """
+        Files of a sitemap index at /sitemap.xml with the given number of
+        child sitemaps of the given number of urls each.
+
+        :return: files and the urls of all child sitemaps.
+        """
+        files = {}
+        locs = []
+        for child in range(children):
+            path = '/sitemap{}.xml'.format(child)
+            child_locs = [server.url + '/{}/{}'.format(child, url)
+                          for url in range(urls)]
+            files[path] = (urlset(child_locs), {})
+            locs += child_locs
+        files['/sitemap.xml'] = (sitemapindex(
+            server.url + path for path in sorted(files)), {})
+        return files, locs
+
+    def index(self, server):
+        return sitemap.XmlSitemapIndex(
+            url=server.url + '/sitemap.xml', base=server.url,
+            filename=self.filename())
+
+
+class TestSitemapIndex(SitemapTestCase):
+
+    def test_parallel_children(self):
+        with LocalServer(delay=0.2) as server:
+            files, locs = self.index_files(server, children=6, urls=50)
+            server.files.update(files)
+            entries = list(self.index(server))
+        self.assertEqual(sorted(locs),
+                         sorted(entry['links'] for entry in entries))
+        self.assertTrue(1 < server.max_active <= sitemap.MAX_SITEMAPS_PER_HOST)
+
+    def test_full_buffer(self):
+        shared = (sitemap.SITEMAP_BUFFER, sitemap.SITEMAP_BUFFER_TIMEOUT,
+                  sitemap.sitemap_downloads)
+        sitemap.SITEMAP_BUFFER = 5
+        sitemap.SITEMAP_BUFFER_TIMEOUT = 0.5
+        sitemap.sitemap_downloads = threading.Semaphore(2)
+        try:
+            with LocalServer() as server:
+                files, locs = self.index_files(server, children=4, urls=20)
+                server.files.update(files)
+                # the entries of an index are no longer read, as when the
+                # queue of its website is full
+                paused = self.index(server)
+                self.assertIn(next(paused)['links'], locs)
+                # the downloads of another index are not held up by it
+                entries = list(sitemap.XmlSitemapIndex(
+                    url=server.url + '/sitemap.xml', base=server.url,
+                    filename=self.filename('other.data')))
+                self.assertEqual(sorted(locs),
+                                 sorted(entry['links'] for entry in entries))
+                # the child sitemaps of the paused index give up, after which
+                # it finishes with what was buffered
+                time.sleep(1.5)
+                start = time.time()
+                self.assertTrue(0 < len(list(paused)) < len(locs) - 1)
+                self.assertLess(time.time() - start, 5)
+        finally:
+            sitemap.SITEMAP_BUFFER, sitemap.SITEMAP_BUFFER_TIMEOUT, \
+                sitemap.sitemap_downloads = shared
+
+    def test_child_state(self):
+        with LocalServer() as server:
+            files, locs = self.index_files(server, children=1, urls=3)
+            files['/sitemap0.xml'] = (files['/sitemap0.xml'][0],
+                                      {'ETag': '"v1"'})
+            server.files.update(files)
+            child = server.url + '/sitemap0.xml'
+            entries = self.index(server)
+            self.assertEqual(locs[:2], [next(entries)['links'],
+                                        next(entries)['links']])
+            # all entries are buffered, but the last is not read yet
+            time.sleep(0.5)
+            self.assertEqual({}, sitemap.sitemap_state.get(child))
+            self.assertEqual(locs[2:], [entry['links'] for entry in entries])
+            self.assertEqual('"v1"', sitemap.sitemap_state.get(child)['etag'])
+
+    def test_nested(self):
+        with LocalServer() as server:
+            files, locs = self.index_files(server, children=2, urls=2)
+            server.files.update(files)
+            server.files['/index.xml'] = (sitemapindex(
+                [server.url + '/sitemap.xml', server.url + '/index.xml']), {})
+            # the sitemap index in the index is read, the index in that index
+            # is skipped
+            with self.assertLogs(sitemap.logger, 'WARNING'):
+                entries = list(sitemap.XmlSitemapIndex(
+                    url=server.url + '/index.xml', base=server.url,
+                    filename=self.filename()))
+        self.assertEqual(sorted(locs),
+                         sorted(entry['links'] for entry in entries))
+
+    def test_child_locations(self):
+        with LocalServer() as server:
+            locs = [server.url + '/{}'.format(i) for i in range(4)]
+
+            def index(child):
+                server.files['/sitemap.xml'] = (sitemapindex(
+                    [server.url + '/wrong/{}.xml'.format(child)]), {})
+                del server.requests[:]
+                return [entry['links'] for entry in self.index(server)]
+
+            server.files.update({
+                '/sitemap/0.xml': (urlset(locs[:2]), {}),
+                '/sitemap/1.xml': (urlset(locs[2:]), {})
+            })
+            self.assertEqual(locs[:2], index(0))
+            self.assertEqual({server.url: 1}, sitemap.sitemap_patterns)
+            # the location that worked is the only one tried for the other
+            # child sitemaps
+            self.assertEqual(locs[2:], index(1))
+            self.assertEqual(['/sitemap.xml', '/sitemap/1.xml'],
+                             server.paths())
+            # also when it is not a sitemap
+            server.files['/sitemap/1.xml'] = (b'<html></html>', {})
+            self.assertEqual([], index(1))
+            self.assertEqual(['/sitemap.xml', '/sitemap/1.xml'],
+                             server.paths())
+            # the others are tried when it is not found
+            del server.files['/sitemap/1.xml']
+            server.files['/sitemaps/1.xml'] = (urlset(locs[2:]), {})
+            self.assertEqual(locs[2:], index(1))
+            self.assertEqual({server.url: 2}, sitemap.sitemap_patterns)
+
+class TestSitemapState(SitemapTestCase):
+
+    def test_changed(self):
+        state = sitemap.sitemap_state
+        url = 'http://nos.nl/sitemap.xml'
+        state.update(url, max_url_lastmod=dt(2015, 7, 25, 12))
+        entries = [
+            {'links': 'http://nos.nl/1', 'modified_time': '2015-07-25T10:00'},
+            {'links': 'http://nos.nl/2', 'modified_time': '2015-07-25T12:00'},
+            {'links': 'http://nos.nl/3', 'modified_time': None},
+            {'links': 'http://nos.nl/4', 'modified_time': '2015-07-26'},
+            {'links': 'http://nos.nl/5', 'modified_time': None,
+             'publication_date': '2015-07-25T14:00:00Z'}]
+        # entries up to the highest lastmod of the previous run are dropped,
+        # entries without a lastmod are kept
+        self.assertEqual(
+            ['http://nos.nl/3', 'http://nos.nl/4', 'http://nos.nl/5'],
+            [entry['links'] for entry in state.changed(url, iter(entries))])
+        self.assertEqual(dt(2015, 7, 26), state.get(url)['max_url_lastmod'])
+        self.assertTrue(state.get(url)['news'])
+        self.assertEqual([url], state.news_sitemaps('http://nos.nl'))
+        self.assertEqual(
+            ['http://nos.nl/3'],
+            [entry['links'] for entry in state.changed(url, iter(entries))])
+        # the newest lastmod is stored only once all entries are read
+        feed = 'http://nos.nl/rss.xml'
+        changed = state.changed(feed, iter(entries), detect_news=False)
+        next(changed)
+        self.assertEqual({}, state.get(feed))
+        list(changed)
+        self.assertEqual(dt(2015, 7, 26), state.get(feed)['max_url_lastmod'])
+        self.assertFalse(state.get(feed)['news'])
+
+
+class TestConditionalRequests(SitemapTestCase):
+
+    def test_unchanged_children(self):
+        with LocalServer() as server:
+            files, locs = self.index_files(server, children=3, urls=2)
+            children = [server.url + '/sitemap{}.xml'.format(child)
+                        for child in range(3)]
+            lastmods = {loc: '2015-07-25' for loc in children}
+            files['/sitemap.xml'] = (sitemapindex(children, lastmods), {})
+            server.files.update(files)
+            self.assertEqual(sorted(locs), sorted(
+                entry['links'] for entry in self.index(server)))
+            self.assertEqual(4, len(server.requests))
+            # only the child sitemap with a new lastmod is read again
+            lastmods[children[1]] = '2015-07-26'
+            server.files['/sitemap.xml'] = (
+                sitemapindex(children, lastmods), {})
+            self.assertEqual(locs[2:4], sorted(
+                entry['links'] for entry in self.index(server)))
+            self.assertEqual(['/sitemap.xml', '/sitemap1.xml'],
+                             server.paths()[4:])
+
+    def test_etag(self):
+        with LocalServer() as server:
+            files, locs = self.index_files(server, children=1, urls=2)
+            content, _ = files['/sitemap0.xml']
+            files['/sitemap0.xml'] = (content, {
+                'ETag': '"v1"',
+                'Last-Modified': 'Sat, 25 Jul 2015 10:00:00 GMT'})
+            server.files.update(files)
+            self.assertEqual(locs, [entry['links']
+                                    for entry in self.index(server)])
+            child = server.url + '/sitemap0.xml'
+            self.assertEqual('"v1"', sitemap.sitemap_state.get(child)['etag'])
+            # the child sitemap is requested with its ETag and not read again
+            self.assertEqual([], list(self.index(server)))
+            path, headers = server.requests[-1]
+            self.assertEqual('/sitemap0.xml', path)
+            self.assertEqual('"v1"', headers['If-None-Match'])
+            self.assertEqual('Sat, 25 Jul 2015 10:00:00 GMT',
+                             headers['If-Modified-Since'])
+            # a changed child sitemap is read again
+            files['/sitemap0.xml'] = (urlset(locs + [server.url + '/0/2']),
+                                      {'ETag': '"v2"'})
+            server.files.update(files)
+            self.assertEqual(locs + [server.url + '/0/2'],
+                             [entry['links'] for entry in self.index(server)])
+            self.assertEqual('"v2"', sitemap.sitemap_state.get(child)['etag'])
+
+    def test_restart(self):
+        with LocalServer() as server:
+            files, locs = self.index_files(server, children=2, urls=3)
+            children = [server.url + '/sitemap{}.xml'.format(child)
+                        for child in range(2)]
+            files['/sitemap.xml'] = (sitemapindex(
+                children, {loc: '2015-07-25' for loc in children}), {})
+            server.files.update(files)
+            # the crawl stops partway through the child sitemaps
+            entries = self.index(server)
+            read = [next(entries)['links'] for _ in range(2)]
+            del entries
+            # the children that were not read completely are read again in
+            # the next run
+            rest = [entry['links'] for entry in self.index(server)]
+            self.assertEqual(set(locs), set(read + rest))
+            self.assertEqual([], list(self.index(server)))
+
+
+class TestGzip(SitemapTestCase):
+
+    def test_gzip(self):
+        with LocalServer() as server:
+            locs = [server.url + '/{}'.format(i) for i in range(3)]
+            content = gzip.compress(urlset(locs))
+            server.files.update({
+                # a gzipped file, as sent by most servers
+                '/sitemap.xml.gz': (content, {
+                    'Content-Type': 'application/x-gzip'}),
+                # a gzipped response
+                '/sitemap.xml': (content, {
+                    'Content-Type': 'application/xml',
+                    'Content-Encoding': 'gzip'}),
+                '/index.xml.gz': (gzip.compress(sitemapindex(
+                    [server.url + '/sitemap.xml.gz'])), {})
+            })
+            for path, klass in (('/sitemap.xml.gz', sitemap.GunZip),
+                                ('/sitemap.xml', sitemap.XmlSitemapIndex),
+                                ('/index.xml.gz', sitemap.GunZip)):
+                self.assertEqual(locs, [entry['links'] for entry in klass(
+                    url=server.url + path, base=server.url,
+                    filename=self.filename(path[1:] + '.data'))])
+                # the sitemap is saved as it was sent and decompressed while
+                # it is read
+                with open(self.filename(path[1:] + '.data'), 'rb') as f:
+                    self.assertEqual(b'\x1f\x8b', f.read(2))
+                with webpage.open_file(
+                        self.filename(path[1:] + '.data')) as f:
+                    self.assertTrue(f.read().startswith(b'<?xml'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+__author__ = 'roelvdberg@gmail.com'
+
+import unittest
+
+from lxml import etree
+
+try:
+    from structured_data import news_article
+except ImportError:
+    from crawler.structured_data import news_article
+
+PAGE = (
+    '<html><head><script type="application/ld+json">{}</script></head>'
+    '<body><p>Tekst</p></body></html>'
+)
+
+
+def article(json):
+    return news_article(etree.HTML(PAGE.format(json)))
+
+
+class TestNewsArticle(unittest.TestCase):
+
+    def test_news_article(self):
+        self.assertEqual({
+            'title': 'Kabinet valt',
+            'published_time': '2015-10-18T10:00:00+02:00',
+            'modified_time': '2015-10-18T11:30:00+02:00',
+            'author': 'Jan Jansen, Redactie',
+            'body': ['Het kabinet is gevallen.', 'Dat meldt de NOS & RTL.']},
+            article(
+                '{"@context": "http://schema.org", "@type": "NewsArticle", '
+                '"headline": "Kabinet valt", '
+                '"datePublished": "2015-10-18T10:00:00+02:00", '
+                '"dateModified": "2015-10-18T11:30:00+02:00", '
+                '"author": [{"@type": "Person", "name": "Jan Jansen"}, '
+                '"Redactie"], "articleBody": "Het kabinet is gevallen.\n\n'
+                'Dat meldt de NOS &amp; RTL."}'))
+
+    def test_graph(self):
+        self.assertEqual(
+            {'title': 'Kabinet valt', 'body': ['Het kabinet is gevallen.']},
+            article('{"@graph": [{"@type": "WebSite", "name": "NOS"}, '
+                    '{"@type": ["NewsArticle"], "headline": "Kabinet valt",'
+                    '"articleBody": "<p>Het kabinet is <b>gevallen</b>.</p>"'
+                    '}]}'))
+        self.assertEqual(
+            {'title': 'Kabinet valt'},
+            article('{"@type": "WebPage", "mainEntity": {"@type": '
+                    '"ReportageNewsArticle", "headline": "Kabinet valt"}}'))
+
+    def test_no_article(self):
+        self.assertEqual({}, article('{"@type": "Organization"}'))
+        self.assertEqual({}, article('{"@type": "NewsArticle", '))
+        self.assertEqual({}, news_article(etree.HTML('<p>Tekst</p>')))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+__author__ = 'roelvdberg@gmail.com'
+
+import unittest
+
+from lxml import etree
+
+try:
+    import content
+    import template
+except ImportError:
+    import crawler.content as content
+    import crawler.template as template
+
+PAGE = (
+    '<html><body>'
+    '<div class="menu"><p>Home, sport en economie op een rij.</p></div>'
+    '<div id="artikel-{0}" class="article">'
+    '<h1 class="title">Artikel {0}</h1>'
+    '<span class="byline">Redactie {0}</span>'
+    '<time datetime="2015-10-{0:02d}T10:00:00+02:00">{0} oktober</time>'
+    '<p>Nummer {0}. Het kabinet wil de regels voor huurwoningen aanpassen.</p>'
+    '<p>Dat meldt de minister in brief {0} aan de Tweede Kamer.</p>'
+    '</div></body></html>'
+)
+
+
+def learn(i):
+    tree = etree.HTML(PAGE.format(i))
+    skip, main = content.boilerplate([tree], 'http://nos.nl',
+                                     'http://nos.nl/{}'.format(i),
+                                     ['p', 'h1'], ['p'])
+    return tree, template.Template.learn(tree, main, skip)
+
+
+class TestTemplate(unittest.TestCase):
+
+    def setUp(self):
+        self.fingerprints = content.fingerprints
+        content.fingerprints = content.Fingerprints()
+
+    def tearDown(self):
+        content.fingerprints = self.fingerprints
+
+    def test_learn(self):
+        tree, learned = learn(1)
+        self.assertEqual(template.Template(
+            body='//div[@class="article"]', title='//h1[@class="title"]',
+            date='/html/body/div[2]/time/@datetime',
+            author='//span[@class="byline"]'), learned)
+        tree = etree.HTML(PAGE.format(2))
+        self.assertEqual(['artikel-2'],
+                         [element.get('id') for element in learned.body(tree)])
+        self.assertEqual({'title': 'Artikel 2', 'author': 'Redactie 2',
+                          'published_time': '2015-10-02T10:00:00+02:00'},
+                         learned.values(tree))
+
+    def test_store(self):
+        store = template.TemplateStore(persistent=False, learn_pages=3,
+                                       window=4, min_hit_rate=0.5)
+        for i in range(1, 4):
+            self.assertIsNone(store.get('http://nos.nl'))
+            store.learn('http://nos.nl', learn(i)[1])
+        learned = store.get('http://nos.nl')
+        self.assertEqual(learn(4)[1], learned)
+        # two misses out of four pages is still enough
+        for hit in (True, False, True, False):
+            store.hit('http://nos.nl', hit)
+        self.assertIs(learned, store.get('http://nos.nl'))
+        for hit in (True, False, False, False):
+            store.hit('http://nos.nl', hit)
+        self.assertIsNone(store.get('http://nos.nl'))
+
+
+if __name__ == '__main__':
+    unittest.main()
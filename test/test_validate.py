@@ -0,0 +1,136 @@
+__author__ = 'roelvdberg@gmail.com'
+
+import unittest
+
+try:
+    import validate
+except ImportError:
+    import crawler.validate as validate
+
+
+class TestUrlFilter(unittest.TestCase):
+
+    def setUp(self):
+        self.filter = validate.UrlFilter(
+            nofollow=['google', 'last.fm'], follow=['nieuws.google.nl'],
+            nofollow_paths=[r'^/video/', r'[?&]share='],
+            nofollow_extensions=['pdf', 'jpg'],
+            overrides={'nos.nl': {'nofollow_paths': [r'^/live/']}})
+
+    def test_hosts(self):
+        for url, expected in (
+                ('http://www.google.nl/zoeken', False),
+                ('http://google.co.uk', False),
+                ('http://nieuws.google.nl/artikel', True),
+                ('http://last.fm', False),
+                ('http://www.last.fm/muziek', False),
+                ('http://googlenieuws.nl/', True),
+                ('http://nu.nl/tech/google-boete', True)):
+            self.assertEqual(expected, self.filter(url), url)
+
+    def test_nofollow_names(self):
+        # names without a dot match whole labels of the host only, not parts
+        # of labels or of the path and query
+        url_filter = validate.UrlFilter(nofollow=['facebook'])
+        for url, expected in (
+                ('https://www.facebook.com/nu', False),
+                ('https://m.facebook.nl', False),
+                ('http://nu.nl/artikel?share=facebook', True),
+                ('http://nu.nl/facebook/privacy', True),
+                ('http://facebooknieuws.nl/', True)):
+            self.assertEqual(expected, url_filter(url), url)
+            self.assertEqual(expected, validate.url(url), url)
+
+    def test_paths_and_extensions(self):
+        for url, expected in (
+                ('http://nu.nl/video/123', False),
+                ('http://nu.nl/artikel?id=1&share=twitter', False),
+                ('http://nu.nl/foto.JPG', False),
+                ('http://nu.nl/rapport.pdf?download=1', False),
+                ('http://nu.nl/index.php?bestand=rapport.pdf', True),
+                ('http://nu.nl/artikel.html', True),
+                ('http://www.bbc.com', True),
+                ('http://nu.nl/v1.2/', True)):
+            self.assertEqual(expected, self.filter(url), url)
+
+    def test_overrides(self):
+        self.assertTrue(self.filter('http://nos.nl/video/123'))
+        self.assertFalse(self.filter('http://www.nos.nl/live/123'))
+        self.assertFalse(self.filter('http://nos.nl/foto.jpg'))
+        self.filter.override('nu.nl', nofollow_extensions=[])
+        self.assertTrue(self.filter('http://nu.nl/foto.jpg'))
+
+    def test_filter_many(self):
+        self.assertEqual(
+            ['http://nu.nl/artikel', 'http://nieuws.google.nl/'],
+            self.filter.filter_many([
+                'http://nu.nl/artikel', '/relatief', 'mailto:redactie@nu.nl',
+                'http://www.google.nl/', 'http://nieuws.google.nl/']))
+
+    def test_url(self):
+        self.assertTrue(validate.url('/artikel/1'))
+        self.assertFalse(validate.url('/rapport.pdf'))
+        self.assertFalse(validate.url_explicit('/artikel/1'))
+        self.assertTrue(validate.url_explicit('http://nos.nl/artikel/1'))
+        self.assertFalse(validate.url_explicit('https://twitter.com/NOS'))
+
+    def test_iri_to_uri(self):
+        # the colon before a port is kept; quotes and colons elsewhere are
+        # encoded
+        self.assertEqual('http://localhost:8000/artikel',
+                         validate.iri_to_uri('http://localhost:8000/artikel'))
+        self.assertEqual(
+            'http://nu.nl:80/a%27b%3ac?q=%22x%22',
+            validate.iri_to_uri('http://nu.nl:80/a\'b:c?q="x"'))
+
+    def test_nofollow_settings(self):
+        # every entry of NOFOLLOW still rejects the links to its site that
+        # the substring match of url_explicit rejected before
+        rejected = {
+            'creativecommons': ['https://creativecommons.org/licenses/by/4.0/',
+                                'http://nl.creativecommons.org/'],
+            'facebook': ['https://www.facebook.com/nu.nl',
+                         'https://m.facebook.com/sharer.php?u=nu.nl'],
+            'feedly': ['https://feedly.com/i/subscription/feed/nu.nl'],
+            'flickr': ['https://www.flickr.com/photos/nos/123'],
+            'github': ['https://github.com/RoelvandenBerg/nlnieuwscrawler'],
+            'google': ['https://www.google.nl/search?q=kabinet',
+                       'https://plus.google.com/+nunl',
+                       'https://maps.google.com/?q=Den+Haag'],
+            'instagram': ['https://www.instagram.com/nos/'],
+            'last.fm': ['http://www.last.fm/music/Doe+Maar'],
+            'linkedin': ['https://www.linkedin.com/company/nu-nl',
+                         'https://nl.linkedin.com/in/redactie'],
+            'mozzila': ['http://www.mozzila.org/firefox'],
+            'openstreetmap': ['https://www.openstreetmap.org/#map=12/52/4'],
+            'opera': ['http://www.opera.com/download'],
+            'sciencedirect': ['http://www.sciencedirect.com/science/1'],
+            'twitter': ['https://twitter.com/NOS',
+                        'https://mobile.twitter.com/nunl/status/1'],
+            'vimeo': ['https://vimeo.com/123456',
+                      'https://player.vimeo.com/video/1'],
+            'wikimedia': ['https://commons.wikimedia.org/wiki/Hoofdpagina'],
+            'wikipedia': ['https://nl.wikipedia.org/wiki/Tweede_Kamer'],
+            'wiley': ['http://onlinelibrary.wiley.com/doi/10.1002/full'],
+            'youtube': ['https://www.youtube.com/watch?v=123',
+                        'https://m.youtube.com/user/nos'],
+            'sciencecommons': ['http://sciencecommons.org/projects/']}
+        self.assertEqual(sorted(validate.NOFOLLOW), sorted(rejected))
+        for name, urls in rejected.items():
+            for url in urls:
+                self.assertIn(name, url)
+                self.assertFalse(validate.url_explicit(url), url)
+        # links that only contain one of them in another label, the path or
+        # the query, and links that end in three letters after a dot, are
+        # followed now
+        for url in ('http://nu.nl/tech/google-boete',
+                    'http://nos.nl/artikel/operatie-geslaagd',
+                    'http://www.nu.nl/artikel?share=facebook',
+                    'http://www.nationaleopera.nl/',
+                    'http://www.bbc.com',
+                    'http://www.nu.nl/index.php'):
+            self.assertTrue(validate.url_explicit(url), url)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,312 @@
+__author__ = 'roelvdberg@gmail.com'
+
+import os
+import shutil
+import tempfile
+import tracemalloc
+import unittest
+
+from lxml import etree
+from sqlalchemy import create_engine
+
+try:
+    import content
+    import model
+    import template
+    import webpage
+except ImportError:
+    import crawler.content as content
+    import crawler.model as model
+    import crawler.template as template
+    import crawler.webpage as webpage
+from test.local_server import LocalServer
+
+PAGE = (
+    '<!DOCTYPE html><html><head><title>Kabinet valt</title>'
+    '<meta name="author" content="Redactie">'
+    '<meta property="og:title" content="Het kabinet is gevallen">'
+    '<meta property="article:published_time" '
+    'content="2015-10-18T10:00:00+02:00">'
+    '<link rel="alternate" type="application/rss+xml" href="/rss.xml">'
+    '</head><body><svg><title>Logo</title></svg>'
+    '<meta name="author" content="Iemand anders">'
+    '<h1>Kabinet valt</h1><p>Het kabinet is <b>gevallen</b>.</p></body></html>'
+)
+
+
+class TestHead(unittest.TestCase):
+
+    def assertHead(self, head):
+        head.parse()
+        self.assertEqual('Kabinet valt', head.title)
+        self.assertEqual('Redactie', head.author)
+        self.assertEqual('2015-10-18T10:00:00+02:00', head.published_time)
+        self.assertEqual(['/rss.xml'], head.feeds)
+
+    def test_from_html(self):
+        self.assertHead(webpage.Head(html=PAGE, from_disk=False))
+        self.assertHead(webpage.Head(html=PAGE.encode('utf-8'),
+                                     from_disk=False))
+
+    def test_from_disk(self):
+        fd, filename = tempfile.mkstemp()
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(PAGE)
+            self.assertHead(webpage.Head(html=None, filename=filename))
+        finally:
+            os.remove(filename)
+
+    def test_stops_at_body(self):
+        # the body is never read: parsing stops at the first chunk after the
+        # head, whatever follows.
+        chunks = [PAGE[:PAGE.index('<body>')], '<body>', None]
+        self.assertEqual(
+            ['title', 'meta', 'meta', 'meta', 'link'],
+            [e.tag for e in webpage.head_iter(iter(chunks), ['title', 'meta',
+                                                             'link'])])
+
+
+ARTICLE = (
+    '<html><head><title>Artikel {0}</title></head><body>'
+    '<ul class="nav"><li><a href="/">Home</a></li></ul>'
+    '<div class="article"><h1>Artikel {0}</h1>'
+    '<time datetime="2015-10-{0:02d}T10:00:00">{0} oktober</time>'
+    '<p>Nummer {0}. Het kabinet wil de regels voor huurwoningen aanpassen.</p>'
+    '<ul><li>Huren stijgen in jaar {0} minder hard.</li></ul></div>'
+    '<footer><p>Copyright 2015</p></footer></body></html>'
+)
+
+
+def texts(page, kind):
+    return [text for kind_, _, text in page.records() if kind_ == kind]
+
+
+class TestWebpage(unittest.TestCase):
+
+    def setUp(self):
+        self.shared = content.fingerprints, webpage.templates
+        content.fingerprints = content.Fingerprints()
+        webpage.templates = template.TemplateStore(persistent=False)
+
+    def tearDown(self):
+        content.fingerprints, webpage.templates = self.shared
+
+    def test_parse(self):
+        page = webpage.HeadingText(url='http://www.nu.nl/artikel',
+                                   base='http://www.nu.nl',
+                                   html=PAGE.encode('utf-8'))
+        self.assertEqual([('h1', ('Kabinet valt',) + (None,) * 5,
+                           'Kabinet valt'),
+                          ('p', ('Kabinet valt',) + (None,) * 5,
+                           'Het kabinet is gevallen.')],
+                         list(page.records()))
+        # the content is read from the page, not kept
+        self.assertFalse(hasattr(page, 'p'))
+
+    def test_heading_context(self):
+        page = webpage.HeadingText(
+            url='http://www.nu.nl/liveblog', base='http://www.nu.nl',
+            html=('<html><body><h1>Liveblog</h1>'
+                  '<p>Welkom bij het liveblog.</p>'
+                  '<h2>10:00</h2><p>Eerste update.</p><h3>Reactie</h3>'
+                  '<p>Een reactie.</p><h2>11:00</h2><p> </p>'
+                  '<p>Tweede update.</p></body></html>').encode('utf-8'))
+        self.assertEqual([
+            ('h1', ('Liveblog', None, None), 'Liveblog'),
+            ('p', ('Liveblog', None, None), 'Welkom bij het liveblog.'),
+            ('h2', ('Liveblog', '10:00', None), '10:00'),
+            ('p', ('Liveblog', '10:00', None), 'Eerste update.'),
+            ('h3', ('Liveblog', '10:00', 'Reactie'), 'Reactie'),
+            ('p', ('Liveblog', '10:00', 'Reactie'), 'Een reactie.'),
+            ('h2', ('Liveblog', '11:00', None), '11:00'),
+            ('p', ('Liveblog', '11:00', None), 'Tweede update.')],
+            [(kind, context[:3], text)
+             for kind, context, text in page.records()])
+
+    def test_stream_memory(self):
+        # the texts of a streamed page are read once by records() and not
+        # kept, so peak memory does not grow with the page
+        update = ('<div class="update"><h2>{0}:00</h2><p>Update {0}: het '
+                  'kabinet heeft opnieuw vergaderd over de huren.</p></div>')
+        peaks = []
+        for updates in (1000, 4000):
+            content.fingerprints = content.Fingerprints(max_fingerprints=100)
+            webpage.templates = template.TemplateStore(persistent=False)
+            html = ('<html><body><div class="article"><h1>Liveblog</h1>{}'
+                    '</div></body></html>').format(''.join(
+                        update.format(i) for i in range(updates)))
+            page = webpage.HeadingText(
+                url='http://www.nu.nl/liveblog', base='http://www.nu.nl',
+                html=html.encode('utf-8'))
+            page.base_tree
+            tracemalloc.start()
+            try:
+                page.parse()
+                records = sum(1 for _ in page.records())
+                peaks.append(tracemalloc.get_traced_memory()[1])
+            finally:
+                tracemalloc.stop()
+            self.assertEqual(1 + 2 * updates, records)
+        self.assertLess(peaks[1], 1.5 * peaks[0], peaks)
+
+    def test_template(self):
+        for i in range(1, 6):
+            page = webpage.HeadingText(
+                url='http://www.nu.nl/artikel/{}'.format(i),
+                base='http://www.nu.nl',
+                html=ARTICLE.format(i).encode('utf-8'))
+            self.assertEqual(['Artikel {}'.format(i)], texts(page, 'h1'))
+            self.assertEqual(['Nummer {}. Het kabinet wil de regels voor '
+                              'huurwoningen aanpassen.'.format(i)],
+                             texts(page, 'p'))
+            self.assertEqual(['Huren stijgen in jaar {} minder hard.'
+                              .format(i)], texts(page, 'li'))
+        # from the fourth page on the learned template is used
+        self.assertEqual('//div[@class="article"]', webpage.templates.get(
+            'http://www.nu.nl').expressions['body'])
+        self.assertEqual('2015-10-05T10:00:00',
+                         page.hint('published_time'))
+
+    def test_structured_data(self):
+        html = ARTICLE.format(1).replace('</head>', (
+            '<script type="application/ld+json">{"@type": "NewsArticle", '
+            '"headline": "Kabinet wil huren aanpassen", '
+            '"datePublished": "2015-10-01T09:00:00+02:00", '
+            '"articleBody": "Eerste alinea.\\nTweede alinea."}</script>'
+            '</head>'))
+        page = webpage.HeadingText(url='http://www.nu.nl/artikel/1',
+                                   base='http://www.nu.nl',
+                                   html=html.encode('utf-8'))
+        self.assertEqual(['Eerste alinea.', 'Tweede alinea.'],
+                         texts(page, 'p'))
+        self.assertEqual(['Kabinet wil huren aanpassen'], texts(page, 'h1'))
+        self.assertEqual([], texts(page, 'li'))
+        self.assertEqual('2015-10-01T09:00:00+02:00',
+                         page.hint('published_time'))
+        # the page was not walked, so nothing was learned
+        self.assertIsNone(webpage.templates.candidates.get('http://www.nu.nl'))
+
+    def test_walk(self):
+        class Page(webpage.Webpage):
+            # a listed twice, once for an attribute it not always has
+            tag = ['a', 'p', 'a', 'h2']
+            attr = ['href', None, 'title']
+            name = ['href', 'text', 'title', 'heading']
+
+        page = Page(url='http://www.nu.nl/artikel', base='http://www.nu.nl',
+                    html=(
+                        '<html><body><h2>Kop <i>1</i></h2><p>Een <a '
+                        'href="/1" title="Een">link</a> hier.</p><div><a '
+                        'href="/2">twee</a><p>Twee</p></div><h2>Kop 2</h2>'
+                        '</body></html>').encode('utf-8'))
+        # the same content for each tag as a walk over the tree per tag
+        self.assertEqual(
+            [[page._get_attr(element, i) for tree in page.trees
+              for element in tree.iter() if element.tag == t]
+             for i, t in enumerate(page.tag)],
+            page._walk())
+        self.assertEqual(['/1', '/2'], page.href)
+        self.assertEqual(['Een', ''], page.title)
+        self.assertEqual(['Kop 1', 'Kop 2'], page.heading)
+        # in document order
+        self.assertEqual(
+            [element for element in page.base_tree.iter()
+             if element.tag in page.tag],
+            [element for element, _ in page._elements()])
+        self.assertEqual(['h2', 'p', 'a', 'a', 'p', 'h2'],
+                         [element.tag for element, _ in page._elements()])
+        self.assertEqual([(0, 'href'), (2, 'title')],
+                         dict((element.tag, indices) for element, indices
+                              in page._elements())['a'])
+
+
+class TestStore(unittest.TestCase):
+
+    def setUp(self):
+        self.shared = content.fingerprints, webpage.templates
+        content.fingerprints = content.Fingerprints()
+        webpage.templates = template.TemplateStore(persistent=False)
+        self.directory = tempfile.mkdtemp()
+        engine = create_engine('sqlite:///' + os.path.join(
+            self.directory, 'test.sqlite3'))
+        model.Base.metadata.create_all(engine)
+        model.Session.configure(bind=engine)
+
+    def tearDown(self):
+        model.Session.configure(bind=model.engine)
+        content.fingerprints, webpage.templates = self.shared
+        shutil.rmtree(self.directory)
+
+    def test_store_saved_file(self):
+        # as the crawler does: the page is saved to disk before it is parsed
+        html = ARTICLE.format(3).replace(
+            '</ul></div>', '</ul><h2>Reacties</h2><p>De oppositie is '
+            'kritisch.</p></div>').encode('utf-8')
+        with LocalServer({'/artikel/3': (html, {})}) as server:
+            session = model.Session()
+            session.add(model.Website(url=server.url))
+            session.commit()
+            page = webpage.HeadingText(
+                url=server.url + '/artikel/3', base=server.url,
+                save_file=True, persistent=True,
+                filename=os.path.join(self.directory, 'page.data'))
+            page.store()
+        self.assertIsNone(page.html)
+        stored = session.query(model.Webpage).one()
+        self.assertEqual('Artikel 3', stored.title)
+        self.assertEqual(html.decode('utf-8'), stored.content)
+        self.assertEqual(
+            [('Artikel 3', None), ('Artikel 3', 'Reacties')],
+            [(heading.h1, heading.h2) for heading in stored.headings])
+        self.assertEqual([
+            ('Nummer 3. Het kabinet wil de regels voor huurwoningen '
+             'aanpassen.', 'Artikel 3', None),
+            ('Huren stijgen in jaar 3 minder hard.', 'Artikel 3', None),
+            ('De oppositie is kritisch.', 'Artikel 3', 'Reacties')],
+            [(paragraph.paragraph, paragraph.headings.h1,
+              paragraph.headings.h2) for paragraph in stored.paragraphs])
+        session.close()
+
+
+LINKS = (
+    '<html><head><title>Links</title></head><body>'
+    '<a href="/binnenland">Binnenland</a><a href="/sport">Sport</a>'
+    '<a href="/binnenland">Meer binnenland</a><a>Geen link</a>'
+    '<a href="/login" rel="nofollow noopener">Inloggen</a>'
+    '<a href="/sport" rel="tag">Sport</a></body></html>'
+)
+
+
+class TestLinks(unittest.TestCase):
+
+    def assertLinks(self, links):
+        self.assertEqual(['/binnenland', '/sport'],
+                         [item['links'] for item in links])
+
+    def test_shared_tree(self):
+        fd, filename = tempfile.mkstemp()
+        os.close(fd)
+        os.remove(filename)
+        # the file is never read: the tree of the page is used
+        self.assertLinks(webpage.Links(
+            url='http://www.nu.nl/', base='http://www.nu.nl',
+            tree=etree.HTML(LINKS), download=False, save_file=True,
+            filename=filename))
+
+    def test_from_disk(self):
+        fd, filename = tempfile.mkstemp()
+        with os.fdopen(fd, 'w') as f:
+            f.write(LINKS)
+        self.assertLinks(webpage.Links(
+            url='http://www.nu.nl/', base='http://www.nu.nl',
+            download=False, save_file=True, filename=filename))
+
+    def test_from_html(self):
+        self.assertLinks(webpage.Links(
+            url='http://www.nu.nl/', base='http://www.nu.nl',
+            html=LINKS.encode('utf-8')))
+
+
+if __name__ == '__main__':
+    unittest.main()
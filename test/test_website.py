@@ -0,0 +1,294 @@
+__author__ = 'roelvdberg@gmail.com'
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from datetime import datetime as dt
+
+from sqlalchemy import create_engine
+
+try:
+    import crawl
+    from filequeue import HybridQueue
+    import model
+    import sitemap
+    import webpage
+except ImportError:
+    import crawler.crawl as crawl
+    from crawler.filequeue import HybridQueue
+    import crawler.model as model
+    import crawler.sitemap as sitemap
+    import crawler.webpage as webpage
+from test.local_server import LocalServer
+from test.test_sitemap import urlset
+
+
+class BaseUrl(object):
+    """
+    Adds the links of a website to its link queue only.
+    """
+
+    def __init__(self, link_queue):
+        self.link_queue = link_queue
+        self.sitemap_semaphore = threading.Semaphore()
+
+    def add_links(self, link_container, depth=0, base=None):
+        # queued as by base.BaseUrl.add
+        for item in link_container:
+            hints = (item.get('publication_date'), item.get('title'))
+            self.link_queue.put((item['links'],) + hints if any(hints) else
+                                item['links'])
+
+
+def wait_for(condition, timeout=5):
+    start = time.time()
+    while not condition():
+        if time.time() - start > timeout:
+            return False
+        time.sleep(0.05)
+    return True
+
+
+class WebsiteTestCase(unittest.TestCase):
+    """
+    Crawls websites from a local server in a temporary directory: pages and
+    sitemaps are saved to ../data and the state of sitemaps is stored in a
+    temporary database.
+    """
+    settings = {'SITEMAP_QUEUE_LIMIT': 10, 'LINK_BATCH_SIZE': 5,
+                'POLL_INTERVAL': None, 'HOST_IDLE_TIMEOUT': 0.5}
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.directory, 'data'))
+        os.mkdir(os.path.join(self.directory, 'run'))
+        self.cwd = os.getcwd()
+        os.chdir(os.path.join(self.directory, 'run'))
+        # pages are stored from the website threads
+        engine = create_engine('sqlite:///' + os.path.join(
+            self.directory, 'test.sqlite3'),
+            connect_args={'check_same_thread': False})
+        model.Base.metadata.create_all(engine)
+        model.Session.configure(bind=engine)
+        self.shared_state = sitemap.sitemap_state
+        sitemap.sitemap_state = sitemap.SitemapState()
+        sitemap.sitemap_state.created = True
+        self.shared = {name: getattr(crawl, name) for name in self.settings}
+        for name, value in self.settings.items():
+            setattr(crawl, name, value)
+        self.link_queue = HybridQueue(directory=self.directory)
+
+    def tearDown(self):
+        for name, value in self.shared.items():
+            setattr(crawl, name, value)
+        sitemap.sitemap_state = self.shared_state
+        model.Session.configure(bind=model.engine)
+        os.chdir(self.cwd)
+        shutil.rmtree(self.directory)
+
+    def website(self, server, **kwargs):
+        website = crawl.Website(base=server.url, link_queue=self.link_queue,
+                                base_url=BaseUrl(self.link_queue), **kwargs)
+        website.robot_txt.crawl_delay = 0
+        return website
+
+
+class TestSitemapIngestion(WebsiteTestCase):
+
+    def test_backpressure(self):
+        with LocalServer() as server:
+            locs = [server.url + '/{}'.format(i) for i in range(100)]
+            server.files.update({
+                '/robots.txt': ('Sitemap: {}/sitemap.xml'.format(
+                    server.url).encode('utf-8'), {}),
+                '/sitemap.xml': (urlset(locs), {})
+            })
+            website = self.website(server)
+            # the sitemap pauses while the link queue is full
+            self.assertTrue(wait_for(lambda: len(self.link_queue) > 10))
+            time.sleep(1.5)
+            self.assertTrue(website.sitemap_thread.is_alive())
+            self.assertEqual(locs[:15], self.link_queue.get_many(100))
+            # and continues when there is room
+            self.assertTrue(wait_for(lambda: len(self.link_queue) > 10))
+            self.assertEqual(locs[15:30], self.link_queue.get_many(100))
+            # the website thread dies while the link queue is full
+            self.assertTrue(wait_for(lambda: len(self.link_queue) > 10))
+            website.robot_txt.crawl_delay = None
+            self.assertRaises(TypeError, website.run)
+            website.sitemap_thread.join(timeout=5)
+            self.assertFalse(website.sitemap_thread.is_alive())
+
+
+def news_sitemap(articles):
+    """
+    :param articles: list of (url, publication date, title)
+    """
+    return (
+        '<?xml version="1.0"?>'
+        '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9" '
+        'xmlns:news="http://www.google.com/schemas/sitemap-news/0.9">{}'
+        '</urlset>'
+    ).format(''.join(
+        '<url><loc>{}</loc><news:news><news:publication>'
+        '<news:name>Nieuws</news:name></news:publication>'
+        '<news:publication_date>{}</news:publication_date>'
+        '<news:title>{}</news:title></news:news></url>'.format(*article)
+        for article in articles)).encode('utf-8')
+
+
+ARTICLE = b'<html><body><p>Het kabinet is gevallen.</p></body></html>'
+
+
+class TestPolling(WebsiteTestCase):
+    settings = dict(WebsiteTestCase.settings, POLL_INTERVAL=0.5)
+
+    def files(self, server, articles):
+        files = {'/robots.txt': ('Sitemap: {}/news.xml'.format(
+            server.url).encode('utf-8'), {})}
+        files['/news.xml'] = (news_sitemap(
+            (server.url + path, date, title)
+            for path, date, title in articles), {})
+        for path, _, _ in articles:
+            files[path] = (ARTICLE, {})
+        return files
+
+    def stored(self, server):
+        session = model.Session()
+        try:
+            return {page.url[len(server.url):]: (page.published_time,
+                                                 page.title)
+                    for page in session.query(model.Webpage)}
+        finally:
+            session.close()
+
+    def test_poll(self):
+        crawl_done = threading.Event()
+        with LocalServer() as server:
+            session = model.Session()
+            session.add(model.Website(url=server.url))
+            session.commit()
+            session.close()
+            server.files.update(self.files(server, [
+                ('/1', '2015-10-18T10:00:00', 'Kabinet valt')]))
+            website = self.website(server, page=webpage.WebpageRaw,
+                                   crawl_done=crawl_done)
+            thread = threading.Thread(target=website.run, daemon=True)
+            thread.start()
+            # the publication date and title of the news sitemap are stored
+            # for the page, which has neither
+            self.assertTrue(wait_for(lambda: '/1' in self.stored(server)))
+            self.assertEqual((dt(2015, 10, 18, 10), 'Kabinet valt'),
+                             self.stored(server)['/1'])
+            # the website keeps polling while the crawl runs; only the new
+            # article is added
+            server.files.update(self.files(server, [
+                ('/1', '2015-10-18T10:00:00', 'Kabinet valt'),
+                ('/2', '2015-10-18T11:00:00', 'Nieuwe verkiezingen')]))
+            self.assertTrue(wait_for(lambda: '/2' in self.stored(server)))
+            self.assertEqual((dt(2015, 10, 18, 11), 'Nieuwe verkiezingen'),
+                             self.stored(server)['/2'])
+            self.assertTrue(thread.is_alive())
+            time.sleep(1)
+            self.assertEqual(1, server.paths().count('/1'))
+            self.assertEqual(1, server.paths().count('/2'))
+            self.assertGreater(server.paths().count('/news.xml'), 2)
+            # and stops when the crawl is done
+            crawl_done.set()
+            thread.join(timeout=5)
+            self.assertFalse(thread.is_alive())
+            website.poll_thread.join(timeout=5)
+            self.assertFalse(website.poll_thread.is_alive())
+
+    def test_without_crawl(self):
+        with LocalServer() as server:
+            server.files.update(self.files(server, [
+                ('/1', '2015-10-18T10:00:00', 'Kabinet valt')]))
+            website = self.website(server)
+            thread = threading.Thread(target=website.run, daemon=True)
+            thread.start()
+            # the website is done when it has no links left
+            thread.join(timeout=10)
+            self.assertFalse(thread.is_alive())
+            website.poll_thread.join(timeout=5)
+            self.assertFalse(website.poll_thread.is_alive())
+
+
+class StubBaseUrl(list):
+    """
+    Base urls without a database; websites are taken from base_queue.
+    """
+
+    def __init__(self, sitelist, database_lock, directory):
+        super().__init__([{}])
+        self.lock = threading.RLock()
+        self.base_queue = HybridQueue(directory=directory)
+        for base in sitelist:
+            self[0][base] = HybridQueue(directory=directory)
+            self.base_queue.put((base, 0))
+
+
+class BlockingCrawler(crawl.Crawler):
+    """
+    Crawler whose website threads wait until they are released.
+    """
+
+    def __init__(self, sitelist, directory):
+        self.directory = directory
+        self.release = threading.Event()
+        self.count_lock = threading.Lock()
+        self.count = 0
+        self.max_count = 0
+        self.crawled = []
+        super().__init__(sitelist)
+
+    def _website_worker(self, base_url_queue_item):
+        with self.count_lock:
+            self.count += 1
+            self.max_count = max(self.count, self.max_count)
+        self.release.wait()
+        with self.count_lock:
+            self.count -= 1
+            self.crawled.append(base_url_queue_item[0])
+
+
+class TestCrawler(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.shared = crawl.base_.BaseUrl, crawl.MAX_THREADS
+        crawl.base_.BaseUrl = lambda sitelist, database_lock: StubBaseUrl(
+            sitelist, database_lock, self.directory)
+        crawl.MAX_THREADS = 2
+
+    def tearDown(self):
+        crawl.base_.BaseUrl, crawl.MAX_THREADS = self.shared
+        shutil.rmtree(self.directory)
+
+    def test_max_threads(self):
+        sites = ['http://{}.nl'.format(i) for i in range(5)]
+        crawler = BlockingCrawler(sites, self.directory)
+        # other threads, such as those that poll news sitemaps, do not count
+        # as website threads
+        other = threading.Event()
+        for _ in range(3):
+            threading.Thread(target=other.wait, daemon=True).start()
+        thread = threading.Thread(target=crawler.run, daemon=True)
+        thread.start()
+        self.assertTrue(wait_for(lambda: crawler.count == 2))
+        time.sleep(1.5)
+        self.assertEqual(2, crawler.max_count)
+        self.assertEqual(2, len(crawler.threads))
+        crawler.release.set()
+        thread.join(timeout=10)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(2, crawler.max_count)
+        self.assertEqual(sorted(sites), sorted(crawler.crawled))
+        other.set()
+
+
+if __name__ == '__main__':
+    unittest.main()